@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+##########################################################
+# Python replacement for compute-detailed-stats.sh, compute-totals-for-runs.sh
+# and compute-totals-stats.sh.
+# Parses every run*/data/<pipeline>.dat file once into flat arrays and computes
+# detailed_stats_<pipeline>.dat, run*/data/totals.dat and totals_stats.dat with
+# grouped numpy reductions. Values, rounding and std follow the awk scripts; fields
+# are split on commas, so rows like '4, "create-fasta-index",52, ...' are counted.
+# Usage: python3 scripts/cloudvm_stats.py [--base-dir .] [--output-dir results]
+#        [--write-run-totals]
+# Run from data/cloud-vm (or pass --base-dir).
+##########################################################
+import argparse
+import csv
+import os
+import re
+import sys
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+PIPELINES = ["base1", "base2", "optimized", "optimized2", "conf-5", "conf-6"]
+STEP_ORDER = ["trimming", "alignment", "mark-duplicates", "create-fasta-index", "create-fasta-dict", "base-quality-score"]
+METRICS = ["duration", "co2", "energy"]
+RESERVED_FILES = {"totals.dat", "totals1.dat"}
+
+
+@dataclass
+class StepTable:
+    """
+    All step rows of all runs and pipelines as flat, aligned arrays.
+
+    run, pipeline and step are integer codes into runs, pipelines and steps.
+    values has one column per METRICS entry; missing trailing columns are NaN.
+    """
+    runs: List[str] = field(default_factory=list)
+    pipelines: List[str] = field(default_factory=list)
+    steps: List[str] = field(default_factory=list)
+    run: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64))
+    pipeline: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64))
+    step: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64))
+    values: np.ndarray = field(default_factory=lambda: np.empty((0, len(METRICS))))
+
+
+def parse_dat_rows(path: str) -> List[Tuple[str, List[float]]]:
+    """
+    Parse a step .dat file: '<nr>, "<step name>", <duration>, <co2>, <energy>' per line.
+
+    Fields are split on commas, so a missing space after a comma does not merge two fields. The
+    step name is field 2 with quotes and spaces removed, and each value is the numeric prefix of
+    fields 3-5 (0 if there is none), as awk reads them. Comment lines (#) and blank lines are
+    skipped, and missing or empty trailing fields (e.g. mark-duplicates in run4/base1.dat) become NaN.
+
+    Returns:
+    list of (step_name, [duration, co2, energy])
+    """
+    rows = []
+    with open(path, newline="") as f:
+        lines = (line for line in f if line.strip() and not line.startswith("#"))
+        for fields in csv.reader(lines, skipinitialspace=True):
+            if len(fields) < 2:
+                continue
+            name = fields[1].strip().strip('"')
+            values = [_awk_number(v.strip()) if v.strip() else np.nan for v in fields[2:2 + len(METRICS)]]
+            values += [np.nan] * (len(METRICS) - len(values))
+            rows.append((name, values))
+    return rows
+
+
+_NUMBER_PREFIX = re.compile(r"[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?")
+
+
+def _awk_number(value: str) -> float:
+    match = _NUMBER_PREFIX.match(value)
+    return float(match.group(0)) if match else 0.0
+
+
+def discover_run_dirs(base_dir: str) -> List[str]:
+    """
+    run*/data directories under base_dir, in natural order (run2 before run10).
+    """
+    names = [d for d in os.listdir(base_dir)
+             if re.fullmatch(r"run\d+", d) and os.path.isdir(os.path.join(base_dir, d, "data"))]
+    return [os.path.join(base_dir, d, "data") for d in sorted(names, key=lambda d: int(d[3:]))]
+
+
+def load_step_table(base_dir: str, pipelines: Optional[List[str]] = None) -> StepTable:
+    """
+    Load every run*/data/<pipeline>.dat under base_dir into one StepTable.
+
+    Parameters:
+    base_dir: Directory containing the run*/ directories
+    pipelines: Pipeline names to load (default: PIPELINES, followed by any other .dat files found)
+    """
+    run_dirs = discover_run_dirs(base_dir)
+    if pipelines is None:
+        found = set()
+        for run_dir in run_dirs:
+            found.update(f[:-4] for f in os.listdir(run_dir) if f.endswith(".dat") and f not in RESERVED_FILES)
+        pipelines = [p for p in PIPELINES if p in found] + sorted(found - set(PIPELINES))
+
+    table = StepTable(runs=[os.path.basename(os.path.dirname(d)) for d in run_dirs], pipelines=list(pipelines))
+    step_codes: Dict[str, int] = {}
+    run_col, pipeline_col, step_col, values = [], [], [], []
+    for r, run_dir in enumerate(run_dirs):
+        for p, pipeline in enumerate(table.pipelines):
+            path = os.path.join(run_dir, f"{pipeline}.dat")
+            if not os.path.exists(path):
+                continue
+            for name, row_values in parse_dat_rows(path):
+                run_col.append(r)
+                pipeline_col.append(p)
+                step_col.append(step_codes.setdefault(name, len(step_codes)))
+                values.append(row_values)
+    table.steps = list(step_codes)
+    table.run = np.array(run_col, dtype=np.int64)
+    table.pipeline = np.array(pipeline_col, dtype=np.int64)
+    table.step = np.array(step_col, dtype=np.int64)
+    table.values = np.array(values, dtype=np.float64).reshape(-1, len(METRICS))
+    return table
+
+
+def grouped_mean_std(groups: np.ndarray, values: np.ndarray, n_groups: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    NaN-ignoring mean and population std per group for every column of values.
+
+    The deviations are taken from the mean as awk prints it (%.6g), like the -v avg=... std pass
+    of the shell scripts.
+
+    Returns:
+    tuple (mean, std, count), each of shape (n_groups, n_columns)
+    """
+    present = ~np.isnan(values)
+    filled = np.where(present, values, 0.0)
+    count = np.zeros((n_groups, values.shape[1]))
+    total = np.zeros_like(count)
+    np.add.at(count, groups, present)
+    np.add.at(total, groups, filled)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+        deviation = np.where(present, values - printed(mean)[groups], 0.0)
+        squares = np.zeros_like(count)
+        np.add.at(squares, groups, deviation * deviation)
+        std = np.sqrt(squares / count)
+    return mean, std, count
+
+
+def detailed_stats(table: StepTable) -> Dict[str, List[Tuple[int, str, np.ndarray, np.ndarray]]]:
+    """
+    Per pipeline and step: mean and std of duration, CO2 and energy across runs.
+
+    Returns:
+    {pipeline: [(step_number, step_name, means, stds), ...]} with steps in STEP_ORDER
+    (step_number is the position in STEP_ORDER); other step names are ignored, as in
+    compute-detailed-stats.sh
+    """
+    n_steps = len(table.steps)
+    mean, std, count = grouped_mean_std(table.pipeline * n_steps + table.step, table.values, len(table.pipelines) * n_steps)
+    order = [s for s in STEP_ORDER if s in table.steps]
+    stats = {}
+    for p, pipeline in enumerate(table.pipelines):
+        rows = []
+        for name in order:
+            g = p * n_steps + table.steps.index(name)
+            if count[g].max() == 0:
+                continue
+            rows.append((STEP_ORDER.index(name) + 1, name, mean[g], std[g]))
+        stats[pipeline] = rows
+    return stats
+
+
+def run_totals(table: StepTable) -> np.ndarray:
+    """
+    Sum of duration, CO2 and energy over all steps, per run and pipeline (missing values count as 0,
+    like the awk sums).
+
+    Returns:
+    array of shape (n_runs, n_pipelines, 3); NaN where a run has no file for a pipeline
+    """
+    n_pipelines = len(table.pipelines)
+    groups = table.run * n_pipelines + table.pipeline
+    totals = np.zeros((len(table.runs) * n_pipelines, len(METRICS)))
+    np.add.at(totals, groups, np.nan_to_num(table.values))
+    has_data = np.zeros(len(table.runs) * n_pipelines, dtype=bool)
+    has_data[groups] = True
+    totals[~has_data] = np.nan
+    return totals.reshape(len(table.runs), n_pipelines, len(METRICS))
+
+
+def totals_stats(totals: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Mean and population std of the per-run totals, per pipeline.
+
+    compute-totals-stats.sh reads the totals back from run*/data/totals.dat, so the totals are
+    rounded to their printed (%.6g) form first.
+
+    Returns:
+    tuple (mean, std) of shape (n_pipelines, 3)
+    """
+    n_runs, n_pipelines, _ = totals.shape
+    groups = np.tile(np.arange(n_pipelines), n_runs)
+    mean, std, _ = grouped_mean_std(groups, printed(totals).reshape(-1, len(METRICS)), n_pipelines)
+    return mean, std
+
+
+def format_number(value: float) -> str:
+    """
+    Format like awk's print (OFMT %.6g, integral values printed as integers).
+    """
+    if np.isfinite(value) and value == int(value) and abs(value) < 1e16:
+        return str(int(value))
+    return f"{value:.6g}"
+
+
+def printed(values: np.ndarray) -> np.ndarray:
+    """
+    values rounded the way format_number prints them (NaN stays NaN).
+    """
+    return np.vectorize(lambda v: float(format_number(v)), otypes=[np.float64])(values)
+
+
+def write_detailed_stats(stats: Dict[str, list], output_dir: str, prefix: str = "detailed_stats") -> List[str]:
+    paths = []
+    for pipeline, rows in stats.items():
+        path = os.path.join(output_dir, f"{prefix}_{pipeline}.dat")
+        with open(path, "w") as f:
+            f.write(f"# Detailed statistics for {pipeline} - Step Name, Avg Duration (s), StdDev Duration, Avg CO2 (g), StdDev CO2, Avg Energy (kWh), StdDev Energy\n")
+            for number, name, means, stds in rows:
+                cells = [format_number(v) for pair in zip(means, stds) for v in pair]
+                f.write(f"{number}, \"{name}\", {', '.join(cells)}\n")
+        paths.append(path)
+    return paths
+
+
+def write_run_totals(table: StepTable, totals: np.ndarray, base_dir: str) -> List[str]:
+    paths = []
+    for r, run_dir in enumerate(discover_run_dirs(base_dir)):
+        path = os.path.join(run_dir, "totals.dat")
+        with open(path, "w") as f:
+            for p, pipeline in enumerate(table.pipelines):
+                if np.isnan(totals[r, p]).all():
+                    continue
+                f.write(f"{p + 1}, \"{pipeline}\", {', '.join(format_number(v) for v in totals[r, p])}\n")
+        paths.append(path)
+    return paths
+
+
+def write_totals_stats(table: StepTable, mean: np.ndarray, std: np.ndarray, output_dir: str) -> str:
+    path = os.path.join(output_dir, "totals_stats.dat")
+    with open(path, "w") as f:
+        f.write("# Totals statistics across runs - Pipeline Nr, Pipeline Name, Avg Duration (s), StdDev Duration, Avg CO2 (g), StdDev CO2, Avg Energy (kWh), StdDev Energy\n")
+        number = 1
+        for p, pipeline in enumerate(table.pipelines):
+            if np.isnan(mean[p]).all():
+                continue
+            cells = [format_number(v) for pair in zip(mean[p], std[p]) for v in pair]
+            f.write(f"{number}, \"{pipeline}\", {', '.join(cells)}\n")
+            number += 1
+    return path
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compute cloud-vm detailed and totals statistics from run*/data/*.dat")
+    parser.add_argument("--base-dir", default=".", help="directory containing run*/data (default: current directory)")
+    parser.add_argument("--output-dir", default=None, help="where to write the stats files (default: base dir)")
+    parser.add_argument("--write-run-totals", action="store_true", help="also (re)write run*/data/totals.dat")
+    args = parser.parse_args(argv)
+
+    output_dir = args.output_dir or args.base_dir
+    os.makedirs(output_dir, exist_ok=True)
+    table = load_step_table(args.base_dir)
+    if len(table.runs) == 0:
+        print("Error: No run directories found (run*/data/)", file=sys.stderr)
+        return 1
+
+    for path in write_detailed_stats(detailed_stats(table), output_dir):
+        print(f"Detailed statistics saved to {path}")
+    totals = run_totals(table)
+    if args.write_run_totals:
+        for path in write_run_totals(table, totals, args.base_dir):
+            print(f"Run totals saved to {path}")
+    mean, std = totals_stats(totals)
+    print(f"Totals statistics saved to {write_totals_stats(table, mean, std, output_dir)}")
+    print(f"Processed {len(table.pipelines)} pipelines across {len(table.runs)} runs ({len(table.run)} step rows)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+##########################################################
+# Streaming loader for SIMPIPE dry-run metric exports
+# (e.g. run4/data/bsqr-conf-6-input-data.json).
+# Every array stored under a "metrics" object, e.g.
+#   input.data.dryRun.node.metrics.cpuUsageSecondsTotal = [{"timestamp": ..., "value": "..."}, ...]
+# is streamed straight into numpy timestamp/value arrays without building the
+# per-sample dicts of a full json.load, so memory stays bounded by the arrays.
+# Usage: python3 scripts/simpipe_metrics.py run4/data/bsqr-conf-6-input-data.json
+#        python3 scripts/simpipe_metrics.py --check-chunks run4/data/bsqr-conf-6-input-data.json
+##########################################################
+import argparse
+import json
+import re
+import sys
+from dataclasses import dataclass
+from typing import Dict, List, Optional, TextIO, Tuple
+
+import numpy as np
+
+NS_PER_SECOND = 1_000_000_000
+
+# one structural token: punctuation, string, number or literal
+_TOKEN = re.compile(r'\s*(?:([{}\[\]:,])|("(?:[^"\\]|\\.)*")|(-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null))')
+# one {"timestamp": ..., "value": ...} sample with exactly these two keys (either order)
+_SAMPLE_PATTERN = r'\{\s*"(timestamp|value)"\s*:\s*"?([^",}\]\s]*)"?\s*,\s*"(timestamp|value)"\s*:\s*"?([^",}\]\s]*)"?\s*\}'
+_SAMPLE = re.compile(_SAMPLE_PATTERN)
+# a run of comma-separated samples (optionally after the separator of a previous run), matched in one call
+_NON_CAPTURING_SAMPLE = re.sub(r'\((?!\?)', '(?:', _SAMPLE_PATTERN)
+_SAMPLE_RUN = re.compile(rf'(?:\s*,)?\s*{_NON_CAPTURING_SAMPLE}(?:\s*,\s*{_NON_CAPTURING_SAMPLE})*')
+_ARRAY_END = re.compile(r'\s*\]')
+_SEPARATOR = re.compile(r'\s*,')
+
+
+@dataclass
+class MetricSeries:
+    """
+    One metric time series of one node.
+
+    node is the dotted path of the object holding "metrics" (e.g. input.data.dryRun.node),
+    timestamps are datetime64[ns] (UTC) and values float64.
+    """
+    node: str
+    name: str
+    timestamps: np.ndarray
+    values: np.ndarray
+
+    @property
+    def seconds(self) -> np.ndarray:
+        """Timestamps as float64 epoch seconds."""
+        return self.timestamps.view(np.int64) / NS_PER_SECOND
+
+
+class _Buffer:
+    """Sliding text window over a file, refilled in chunks."""
+
+    def __init__(self, f: TextIO, chunk_size: int, lookahead: int):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.lookahead = lookahead
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def ensure(self, force: bool = False) -> bool:
+        """
+        Make sure at least lookahead characters are available, reading as many chunks as that takes
+        (with force, at least one more chunk); returns False at EOF without new data.
+        """
+        available = len(self.text) - self.pos
+        if self.eof or (not force and available >= self.lookahead):
+            return False
+        chunks = []
+        while True:
+            chunk = self.f.read(self.chunk_size)
+            if not chunk:
+                self.eof = True
+                break
+            chunks.append(chunk)
+            available += len(chunk)
+            if available >= self.lookahead:
+                break
+        if not chunks:
+            return False
+        self.text = self.text[self.pos:] + "".join(chunks)
+        self.pos = 0
+        return True
+
+    def match(self, pattern: re.Pattern, grow: bool = False):
+        """
+        Match pattern at the current position. With grow, a token cut off by the end of the window
+        (e.g. a string longer than lookahead) makes the window grow until it matches or EOF.
+        """
+        self.ensure()
+        m = pattern.match(self.text, self.pos)
+        while grow and (m is None or m.end() == len(self.text)) and self.ensure(force=True):
+            m = pattern.match(self.text, self.pos)
+        return m
+
+
+class _SeriesBuilder:
+    """Collects samples as strings and converts them to numpy in fixed-size blocks."""
+
+    def __init__(self, block_size: int):
+        self.block_size = block_size
+        self.raw_timestamps: List[str] = []
+        self.raw_values: List[str] = []
+        self.timestamp_blocks: List[np.ndarray] = []
+        self.value_blocks: List[np.ndarray] = []
+
+    def add(self, timestamps: List[str], values: List[str]):
+        self.raw_timestamps.extend(timestamps)
+        self.raw_values.extend(values)
+        if len(self.raw_timestamps) >= self.block_size:
+            self.flush()
+
+    def flush(self):
+        if not self.raw_timestamps:
+            return
+        self.timestamp_blocks.append(_parse_timestamps(self.raw_timestamps))
+        self.value_blocks.append(_parse_values(self.raw_values))
+        self.raw_timestamps, self.raw_values = [], []
+
+    def build(self, node: str, name: str) -> MetricSeries:
+        self.flush()
+        timestamps = np.concatenate(self.timestamp_blocks) if self.timestamp_blocks else np.empty(0, dtype=np.int64)
+        values = np.concatenate(self.value_blocks) if self.value_blocks else np.empty(0)
+        return MetricSeries(node, name, timestamps.view('datetime64[ns]'), values)
+
+
+def _parse_timestamps(raw: List[str]) -> np.ndarray:
+    """
+    Epoch seconds (int or float strings) or ISO 8601 strings to int64 epoch ns.
+    ISO timestamps are taken as UTC; a trailing Z is accepted, other UTC offsets are not.
+    """
+    try:
+        return np.array(raw, dtype=np.int64) * NS_PER_SECOND
+    except ValueError:
+        pass
+    try:
+        return np.round(np.array(raw, dtype=np.float64) * NS_PER_SECOND).astype(np.int64)
+    except ValueError:
+        return np.array([t[:-1] if t[-1:] in ("Z", "z") else t for t in raw], dtype="datetime64[ns]").view(np.int64)
+
+
+def _parse_values(raw: List[str]) -> np.ndarray:
+    """Value strings to float64; anything non-numeric (e.g. null) becomes NaN."""
+    try:
+        return np.array(raw, dtype=np.float64)
+    except ValueError:
+        values = np.full(len(raw), np.nan)
+        for i, v in enumerate(raw):
+            try:
+                values[i] = float(v)
+            except ValueError:
+                pass
+        return values
+
+
+def _split_samples(pairs: List[Tuple[str, str, str, str]], where: str) -> Tuple[List[str], List[str]]:
+    """(key, value, key, value) matches of _SAMPLE to timestamp and value strings."""
+    first_keys, first, second_keys, second = zip(*pairs)
+    if first_keys.count("timestamp") == len(pairs) and second_keys.count("value") == len(pairs):
+        return list(first), list(second)
+    if first_keys.count("value") == len(pairs) and second_keys.count("timestamp") == len(pairs):
+        return list(second), list(first)
+    timestamps, values = [], []
+    for k1, v1, k2, v2 in pairs:
+        if k1 == k2:
+            raise ValueError(f"Duplicate key '{k1}' in a sample of {where}")
+        timestamps.append(v1 if k1 == "timestamp" else v2)
+        values.append(v2 if k1 == "timestamp" else v1)
+    return timestamps, values
+
+
+def _read_samples(buf: _Buffer, builder: Optional[_SeriesBuilder], where: str):
+    """
+    Consume the elements of a metric array (the '[' is already consumed) up to and including ']'.
+    Samples are dropped if builder is None.
+    """
+    while True:
+        buf.ensure()
+        # fast path: every complete plain sample in the window at once
+        m = _SAMPLE_RUN.match(buf.text, buf.pos)
+        if m is not None:
+            if builder is not None:
+                builder.add(*_split_samples(_SAMPLE.findall(buf.text, m.start(), m.end()), where))
+            buf.pos = m.end()
+            continue
+        m = _ARRAY_END.match(buf.text, buf.pos)
+        if m is not None:
+            buf.pos = m.end()
+            return
+
+        # any other element shape (extra keys, escapes, ...): decode it on its own
+        m = _SEPARATOR.match(buf.text, buf.pos)
+        if m is not None:
+            buf.pos = m.end()
+        buf.ensure(force=True)
+        # an element longer than the window: read on until it decodes or the file ends
+        while True:
+            start = len(buf.text) - len(buf.text[buf.pos:].lstrip())
+            try:
+                element, end = json.JSONDecoder().raw_decode(buf.text, start)
+                break
+            except json.JSONDecodeError as e:
+                if not buf.ensure(force=True):
+                    raise ValueError(f"Malformed sample in {where}: {e}") from None
+        if not isinstance(element, dict) or "timestamp" not in element or "value" not in element:
+            raise ValueError(f"Expected {{timestamp, value}} samples in {where}, got {str(element)[:80]}")
+        if builder is not None:
+            value = element["value"]
+            builder.add([str(element["timestamp"])], ["nan" if value is None else str(value)])
+        buf.pos = end
+
+
+def load_metrics(
+        path: str,
+        metrics: Optional[List[str]] = None,
+        chunk_size: int = 1 << 20,
+        block_size: int = 1 << 16) -> Dict[Tuple[str, str], MetricSeries]:
+    """
+    Stream every metric series of a SIMPIPE dry-run export into numpy arrays.
+
+    Parameters:
+    path: JSON export
+    metrics: Metric names to load (default: all); other metric arrays are skipped without building samples
+    chunk_size: Characters read per file read
+    block_size: Samples converted to numpy at a time
+
+    Returns:
+    {(node, metric_name): MetricSeries} in file order
+    """
+    series: Dict[Tuple[str, str], MetricSeries] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        buf = _Buffer(f, chunk_size, lookahead=4096)
+        # stack of [container, key]; container is "{" or "[", key the current object key or array index
+        stack: List[list] = []
+        expect_key = False
+        while True:
+            m = buf.match(_TOKEN, grow=True)
+            if m is None:
+                if buf.text[buf.pos:].strip():
+                    raise ValueError(f"Invalid JSON in {path} near: {buf.text[buf.pos:buf.pos + 40]!r}")
+                break
+            buf.pos = m.end()
+            punct, string = m.group(1), m.group(2)
+
+            if string is not None and expect_key:
+                stack[-1][1] = json.loads(string)
+                expect_key = False
+            elif punct == "{":
+                stack.append(["{", None])
+                expect_key = True
+            elif punct == "[":
+                if len(stack) >= 2 and stack[-1][0] == "{" and stack[-2] == ["{", "metrics"]:
+                    node, name = _node_path(stack[:-2]), stack[-1][1]
+                    builder = _SeriesBuilder(block_size) if metrics is None or name in metrics else None
+                    _read_samples(buf, builder, f"{path}:{node}.metrics.{name}")
+                    if builder is not None:
+                        series[(node, name)] = builder.build(node, name)
+                else:
+                    stack.append(["[", 0])
+            elif punct in ("}", "]"):
+                stack.pop()
+            elif punct == ",":
+                expect_key = bool(stack) and stack[-1][0] == "{"
+                if stack and stack[-1][0] == "[":
+                    stack[-1][1] += 1
+    return series
+
+
+def _node_path(stack: List[list]) -> str:
+    """Dotted path of the current position, with [i] for array elements (e.g. input.data.nodes[0])."""
+    path = ""
+    for container, key in stack:
+        if container == "[":
+            path += f"[{key}]"
+        else:
+            path += f".{key}" if path else str(key)
+    return path
+
+
+def cpu_utilisation(series: MetricSeries, cores: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    CPU utilisation from a cumulative cpuUsageSecondsTotal counter.
+
+    The rate between consecutive samples is d(value)/d(t) in CPU seconds per second (i.e. busy cores).
+    A decreasing counter is treated as a restart from zero. Intervals with d(t) <= 0 are NaN.
+
+    Parameters:
+    series: Counter series, e.g. load_metrics(...)[(node, "cpuUsageSecondsTotal")]
+    cores: If given, the rate is divided by the number of cores (utilisation in [0, 1])
+
+    Returns:
+    tuple (timestamps, rate) with the end timestamp of each interval
+    """
+    dt = np.diff(series.seconds)
+    dv = np.diff(series.values)
+    dv = np.where(dv < 0, series.values[1:], dv)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rate = np.where(dt > 0, dv / dt, np.nan)
+    if cores:
+        rate = rate / cores
+    return series.timestamps[1:], rate
+
+
+def check_chunking(path: str, chunk_sizes=(7, 64, 1024)) -> List[str]:
+    """
+    Load an export with small read chunks and compare with the default load; returns the differences (empty if none).
+    """
+    expected = load_metrics(path)
+    problems = []
+    for chunk_size in chunk_sizes:
+        try:
+            loaded = load_metrics(path, chunk_size=chunk_size)
+        except ValueError as e:
+            problems.append(f"chunk_size={chunk_size}: {e}")
+            continue
+        if list(loaded) != list(expected):
+            problems.append(f"chunk_size={chunk_size}: series {list(loaded)} instead of {list(expected)}")
+            continue
+        for key, s in expected.items():
+            other = loaded[key]
+            if not (np.array_equal(s.timestamps, other.timestamps)
+                    and np.array_equal(s.values, other.values, equal_nan=True)):
+                problems.append(f"chunk_size={chunk_size}: {key[0]}.{key[1]} differs")
+    return problems
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Summarise the metric series of SIMPIPE dry-run exports")
+    parser.add_argument("files", nargs="+", help="JSON exports")
+    parser.add_argument("--metric", action="append", default=None, help="metric to load (repeatable, default: all)")
+    parser.add_argument("--cores", type=float, default=None, help="number of cores for utilisation of cpuUsageSecondsTotal")
+    parser.add_argument("--check-chunks", action="store_true", help="also reload with small read chunks and compare")
+    args = parser.parse_args(argv)
+
+    failed = False
+    for path in args.files:
+        if args.check_chunks:
+            problems = check_chunking(path)
+            failed |= bool(problems)
+            for problem in problems:
+                print(f"{path}: {problem}")
+        for (node, name), s in load_metrics(path, args.metric).items():
+            line = f"{path}: {node}.{name}: {len(s.values)} samples"
+            if len(s.values):
+                line += f", {s.timestamps[0]} .. {s.timestamps[-1]}"
+            if name == "cpuUsageSecondsTotal" and len(s.values) > 1:
+                _, rate = cpu_utilisation(s, args.cores)
+                line += f", mean utilisation {np.nanmean(rate):.6g}"
+            print(line)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+### Automatic clock-offset estimation between CarbonTracker/SIMPIPE steps and Tapo power data
+import numpy as np
+import pandas as pd
+
+from power_series import as_power_series, to_epoch_ns
+
+NS_PER_SECOND = 1_000_000_000
+
+
+def expected_power_profile(
+        simpipe_data: pd.DataFrame,
+        resolution_seconds: float = 60) -> (int, np.ndarray):
+    """
+    Build a step-wise expected power profile from the step energy and duration rows of a runN.dat file.
+
+    Each step contributes its average power (energy / duration) over [start, stop); time between
+    steps is zero.
+
+    Parameters:
+    simpipe_data (pd.DataFrame): runN.dat content with start, stop and energy (kWh) columns
+    resolution_seconds (float): Grid resolution
+
+    Returns:
+    tuple (start_ns, profile): epoch ns of the first grid point and the power (W) per grid point
+    """
+    starts = to_epoch_ns(simpipe_data['start'])
+    stops = to_epoch_ns(simpipe_data['stop'])
+    durations = (stops - starts) / NS_PER_SECOND
+    step_power = np.where(durations > 0, simpipe_data['energy'].to_numpy(dtype=np.float64) * 3.6e6 / np.maximum(durations, 1e-9), 0.0)
+
+    step_ns = int(resolution_seconds * NS_PER_SECOND)
+    start_ns = int(starts.min())
+    n = int(np.ceil((stops.max() - start_ns) / step_ns))
+    # paint the steps onto the grid with a difference array: +power at start, -power at stop
+    delta = np.zeros(n + 1)
+    np.add.at(delta, ((starts - start_ns) // step_ns).astype(np.int64), step_power)
+    np.add.at(delta, np.minimum((stops - start_ns) // step_ns, n).astype(np.int64), -step_power)
+    return start_ns, np.cumsum(delta)[:n]
+
+
+def resample_power(
+        power_data,
+        resolution_seconds: float = 60) -> (int, np.ndarray):
+    """
+    Resample Tapo power onto a regular grid.
+
+    A Tapo sample at time t covers the interval since the previous sample (see get_power_data),
+    so every grid point takes the value of the first sample at or after it.
+
+    Parameters:
+    power_data (pd.DataFrame or PowerSeries): Data with Date and Power(W) columns
+    resolution_seconds (float): Grid resolution
+
+    Returns:
+    tuple (start_ns, power): epoch ns of the first grid point and the power (W) per grid point
+    """
+    series = as_power_series(power_data)
+    power = np.asarray(series.power, dtype=np.float64)
+    step_ns = int(resolution_seconds * NS_PER_SECOND)
+    start_ns = int(series.dates[0])
+    grid = start_ns + step_ns * np.arange(int((series.dates[-1] - start_ns) // step_ns) + 1)
+    idx = np.minimum(np.searchsorted(series.dates, grid, side='left'), len(power) - 1)
+    return start_ns, power[idx]
+
+
+def sliding_correlation(signal: np.ndarray, template: np.ndarray) -> np.ndarray:
+    """
+    Pearson correlation between template and every equally long window of signal, computed with FFT in O(n log n).
+
+    Returns:
+    np.ndarray of length len(signal) - len(template) + 1 (0 where a window or the template is constant)
+    """
+    n, m = len(signal), len(template)
+    if m > n:
+        raise ValueError(f"template ({m} points) is longer than signal ({n} points)")
+    t = template - template.mean()
+    t_norm = np.sqrt(np.sum(t * t))
+    size = 1 << int(np.ceil(np.log2(n + m - 1)))
+    # correlation = convolution with the reversed template; keep the fully overlapping lags
+    raw = np.fft.irfft(np.fft.rfft(signal, size) * np.fft.rfft(t[::-1], size), size)[m - 1:n]
+
+    # window sums of signal and signal^2 for the per-lag standard deviation
+    csum = np.concatenate([[0.0], np.cumsum(signal)])
+    csum2 = np.concatenate([[0.0], np.cumsum(signal * signal)])
+    window_sum = csum[m:] - csum[:-m]
+    window_var = (csum2[m:] - csum2[:-m]) - window_sum * window_sum / m
+    denominator = np.sqrt(np.maximum(window_var, 0.0)) * t_norm
+    with np.errstate(invalid='ignore', divide='ignore'):
+        correlation = np.where(denominator > 1e-12 * max(t_norm, 1.0), raw / denominator, 0.0)
+    return correlation
+
+
+def alignment_is_reliable(alignment: dict, min_confidence: float = 0.4, min_margin: float = 0.15) -> bool:
+    """
+    True if an estimate_clock_offset result has at least min_confidence correlation and leads the second-best peak
+    by at least min_margin (a missing second peak counts as a lead).
+
+    With the defaults, 14 of the 24 mainframe runs pass over 0-300 minutes, within 27 minutes of
+    surge_time_diffs.dat. The rejected runs include every conf-5 and conf-6 run (correlation about 0.2-0.3, or
+    several similar peaks) and conf-4 run3, whose best peak is 128 minutes off.
+    """
+    margin = alignment['margin']
+    return alignment['confidence'] >= min_confidence and (np.isnan(margin) or margin >= min_margin)
+
+
+def estimate_clock_offset(
+        simpipe_data: pd.DataFrame,
+        power_data,
+        resolution_seconds: float = 60,
+        min_offset_minutes: float = None,
+        max_offset_minutes: float = None,
+        peak_separation_minutes: float = 60) -> dict:
+    """
+    Estimate the clock offset between CarbonTracker/SIMPIPE timestamps and Tapo timestamps.
+
+    The expected power profile of the steps is cross-correlated against the resampled Tapo series,
+    and the offset with the highest Pearson correlation is returned. Tapo exports usually cover
+    several pipeline runs, so restrict the search range (e.g. 0 to 300 minutes for the mainframe
+    data) to avoid matching a neighbouring run.
+
+    Parameters:
+    simpipe_data (pd.DataFrame): runN.dat content with step, start, stop and energy columns
+    power_data (pd.DataFrame or PowerSeries): Tapo data from get_power_data
+    resolution_seconds (float): Grid resolution of the correlation
+    min_offset_minutes, max_offset_minutes (float): Optional search range for the offset
+    peak_separation_minutes (float): Minimum distance of the second-best peak from the best one (see margin)
+
+    Returns:
+    dict with
+        offset_minutes    shift to add to the simpipe timestamps (like simpipe_datetime_shift)
+        confidence        Pearson correlation at the best offset (1 = perfect match)
+        margin            difference to the best correlation at least peak_separation_minutes away in the
+                          search range, i.e. the lead over the second-best peak (NaN if there is none)
+        shifted_data      copy of simpipe_data with start/stop shifted (timezone-naive)
+        offsets_minutes, correlation   the full correlation curve
+    """
+    profile_start, profile = expected_power_profile(simpipe_data, resolution_seconds)
+    power_start, power = resample_power(power_data, resolution_seconds)
+    correlation = sliding_correlation(power, profile)
+
+    step_ns = int(resolution_seconds * NS_PER_SECOND)
+    offsets_minutes = (power_start + step_ns * np.arange(len(correlation)) - profile_start) / NS_PER_SECOND / 60
+    valid = np.ones(len(correlation), dtype=bool)
+    if min_offset_minutes is not None:
+        valid &= offsets_minutes >= min_offset_minutes
+    if max_offset_minutes is not None:
+        valid &= offsets_minutes <= max_offset_minutes
+    if not valid.any():
+        raise ValueError("No candidate offsets in the requested range")
+
+    candidates = np.where(valid, correlation, -np.inf)
+    best = int(np.argmax(candidates))
+    # second-best peak outside the neighbourhood of the best one
+    far = np.abs(offsets_minutes - offsets_minutes[best]) >= peak_separation_minutes
+    runner_up = candidates[far & valid].max() if (far & valid).any() else np.nan
+    offset = float(offsets_minutes[best])
+
+    shifted_data = simpipe_data.copy()
+    for column in ('start', 'stop'):
+        shifted_data[column] = pd.to_datetime(shifted_data[column]).dt.tz_localize(None) + pd.Timedelta(minutes=offset)
+    return {
+        'offset_minutes': offset,
+        'confidence': float(correlation[best]),
+        'margin': float(correlation[best] - runner_up),
+        'shifted_data': shifted_data,
+        'offsets_minutes': offsets_minutes,
+        'correlation': correlation,
+    }
@@ -1,10 +1,45 @@
-### Energy Statistics and plotting
+### Energy Statistics
+# The plotting functions live in plotting.py and are loaded on first use (see __getattr__ at the end), so headless
+# workers that only compute statistics never import matplotlib.
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 
+from instrumentation import timed, message, annotate, count, count_frame
+from power_cache import read_power_cache, write_power_cache
+from power_series import PowerSeries, as_power_series, to_epoch_ns
+from rollup import RollupPyramid
+from interval_join import nearest_start, overlap_join, surge_intervals
+from quantile_sketch import QuantileSketch, baseline_quantiles
+
+PLOTTING_FUNCTIONS = (
+    'plot_energy_usage',
+    'plot_energy_usage_overlay_multiple_datasets',
+    'plot_multiple_datasets',
+    'plot_enhanced_visualization',
+)
+
+
+@timed
+def get_power_data(
+        data_path: str = "./data_tapo-p115-sct-sd/Power.xls",
+        use_cache: bool = True) -> pd.DataFrame:
+    """
+    Load a Tapo power export and derive per-sample energy.
+
+    Parameters:
+        data_path (str): Path to the Tapo .xls export
+        use_cache (bool): Reuse/write the cleaned frame in a sidecar cache next to data_path.
+            The cache is invalidated when the source file's path, mtime or size changes.
 
-def get_power_data(data_path: str = "./data_tapo-p115-sct-sd/Power.xls") -> pd.DataFrame:
+    Returns:
+        pd.DataFrame with Date, Power(W) and Energy(kWh) columns
+    """
+    if use_cache:
+        cached = read_power_cache(data_path)
+        if cached is not None:
+            annotate(cache_hit=True)
+            count_frame(cached)
+            return cached
     raw_power_data = pd.read_excel(data_path)
     raw_power_data = raw_power_data.rename(columns={raw_power_data.columns[0]: 'Date'})
     raw_power_data[raw_power_data.columns[0]] = pd.to_datetime(raw_power_data[raw_power_data.columns[0]])
@@ -15,9 +50,16 @@ def get_power_data(data_path: str = "./data_tapo-p115-sct-sd/Power.xls") -> pd.D
     #raw_power_data.columns
     raw_power_data = raw_power_data[pd.to_numeric(raw_power_data['Energy(kWh)'], errors='coerce').notna()]
     raw_power_data['Energy(kWh)'] = pd.to_numeric(raw_power_data['Energy(kWh)'])
+    if use_cache:
+        try:
+            write_power_cache(data_path, raw_power_data)
+        except OSError as e:
+            message("    get_power_data -- Warning! Could not write cache: %s", e, level='warning')
+    count_frame(raw_power_data)
     return raw_power_data
 
 
+@timed
 def get_time_periods(
         df: pd.DataFrame,
         start_date_baseline: str = None,
@@ -39,30 +81,49 @@ def get_time_periods(
 
     time_periods_ct = []
     if (start_date_baseline is not None) and (end_date_baseline is not None):
-        print("    get_time_periods -- start and end times present. Assuming baseline period.")
-        print("     appending baseline period")
+        message("    get_time_periods -- start and end times present. Assuming baseline period.")
+        message("     appending baseline period")
         time_periods_ct.append(('baseline', start_date_baseline, end_date_baseline))
     else:
-        print("    get_time_periods -- start and end times NOT present. NO baseline step appended.")
+        message("    get_time_periods -- start and end times NOT present. NO baseline step appended.")
     for _, row in df.iterrows():
         step_name = row['step']
         start_time = pd.to_datetime(row['start']).strftime(dt_format)
         stop_time = pd.to_datetime(row['stop']).strftime(dt_format)
         time_periods_ct.append((step_name, start_time, stop_time))
-    print("    get_time_periods -- extracted time periods:")
+    message("    get_time_periods -- extracted time periods:")
     for period in time_periods_ct:
-        print(f"      - {period[0]}: {period[1]} to {period[2]}")
+        message("      - %s: %s to %s", *period)
+    count_frame(df)
+    annotate(periods=len(time_periods_ct))
     return time_periods_ct
 
 
+@timed
 def divide_power_data_into_step_periods(time_periods: list, power_dataframe: pd.DataFrame) -> list:
     """
     Divide the power data into segments based on the specified time periods.
 
+    The window and neighbouring samples of every period are resolved in one batched
+    binary search over the sorted timestamps (see PowerSeries.resolve_periods).
 
+    Parameters:
+    time_periods (list): Tuples (step_name, start_time, stop_time), see get_time_periods
+    power_dataframe (pd.DataFrame or PowerSeries): Power data with Date, Power(W), Energy(kWh) columns
+
+    Returns:
+    list with one segment per time period: row slices (views) of power_dataframe, as DataFrames or, for a
+    PowerSeries, as PowerSeries. The last segment is a modified copy; periods without data give an empty DataFrame.
     """
-    print()
-    print("     divide_power_data_into_step_periods...")
+    message("")
+    message("     divide_power_data_into_step_periods...")
+    series = as_power_series(power_dataframe)
+    # slice the caller's type: the (sorted) frame for DataFrames, the series itself for a PowerSeries
+    source = power_dataframe if isinstance(power_dataframe, PowerSeries) else series.frame
+    count_frame(series)
+    annotate(periods=len(time_periods))
+    positions = series.resolve_periods(time_periods)
+    summaries = series.range_index.query_positions(positions['lo'], positions['hi'])
     data_periods = []
     n_time_periods = len(time_periods)
     baseline_energy = 0
@@ -70,61 +131,93 @@ def divide_power_data_into_step_periods(time_periods: list, power_dataframe: pd.
     counter = 0
     for name, start, end in time_periods:
         counter += 1
-        print(f"        Processing {name}...")
-        print(f"            start: {start}, end: {end}")
-        stats = compute_energy_stats(power_dataframe, start, end)
+        message("        Processing %s...", name)
+        message("            start: %s, end: %s", start, end)
+        lo = positions['lo'][counter - 1]
+        hi = positions['hi'][counter - 1]
+        stats = _energy_stats(_rows(source, lo, hi), start, end, summaries, counter - 1)
         if stats['filtered_data'].empty or stats['filtered_data'] is None: 
-            print(f"        Warning! No data for period: {name}")
+            message("        Warning! No data for period: %s", name, level='warning')
             #print("    Warning! Adding empty data!")
             #data_periods.append({"Date": [], "Energy(kWh)": [], "Power(W)": []})
 
         if name == "baseline":
-            print("        Setting baseline energy and power values from baseline step.")
-            baseline_energy = stats['filtered_data']['Energy(kWh)'].mean()
-            baseline_power = stats['filtered_data']['Power(W)'].mean()
+            message("        Setting baseline energy and power values from baseline step.")
+            baseline_energy = stats['total_energy'] / len(stats['filtered_data']) if not stats['filtered_data'].empty else np.nan
+            baseline_power = stats['avg_power'] if not stats['filtered_data'].empty else np.nan
 
 
         if n_time_periods == counter:
-            print("        Last segment detected.")
+            message("        Last segment detected.")
             # if last segment, compute fraction of step after to add to segment
             # if segment contains no data (filtered_data is empty), use next step as datapoint and divide by fraction of start-stop
-            if isinstance(stats['filtered_data'], pd.DataFrame) and not stats['filtered_data'].empty:
-                print("        Last segment contains data.")
+            if not stats['filtered_data'].empty:
+                message("        Last segment contains data.")
                 t1 = stats['filtered_data']['Date'].max() # last timestamp of segment
-                t2 = power_dataframe[power_dataframe['Date'] > t1]['Date'].min() # first timestamp after segment
+                t2 = series.date_at(positions['after_end'][counter - 1]) # first timestamp after segment
                 end_timestamp = pd.to_datetime(end) # end time of segment (according to carbontracker input)
                 d1 = end_timestamp - t1 # time between t1 and end time
                 d2 = t2 - end_timestamp # time between end time and t2
                 fraction = d2 / (d1 + d2) # fraction of step after last data point that contributes to last step in the segment
-                # set the last timestamp of segment equal to the end_timestamp
-                stats['filtered_data'].loc[stats['filtered_data']['Date'].idxmax(), 'Date'] = end_timestamp
-                # adjust the energy value of the last segment datapoint accordingly
-                stats['filtered_data'].loc[stats['filtered_data']['Date'].idxmax(), 'Energy(kWh)'] *= fraction
-                # val = stats['filtered_data'].loc[stats['filtered_data']['Date'].idxmax(), 'Power(W)']
-                # print(f" val: {val}, dtype: {type(val)}") # it is ok, the value type is numpy.int64
-                stats['filtered_data'].loc[stats['filtered_data']['Date'].idxmax(), 'Power(W)'] *= fraction
+                stats['filtered_data'] = _prorate_last_sample(stats['filtered_data'], end_timestamp, fraction)
             else:
                 # last segment does not contain any data. Use next timestep as datapoint, and devide by fraction of start-stop
-                print("        Last segment contains NO data.")
+                message("        Last segment contains NO data.")
                 start = pd.to_datetime(start)
                 stop = pd.to_datetime(end)
                 dt = stop - start
-                t1 = power_dataframe[power_dataframe['Date'] < start]['Date'].max() # first timestamp before segment
-                t2 = power_dataframe[power_dataframe['Date'] > stop]['Date'].min() # first timestamp after segment
+                t1 = series.date_at(positions['before_start'][counter - 1]) # first timestamp before segment
+                after = positions['after_end'][counter - 1]
+                t2 = series.date_at(after) # first timestamp after segment
                 fraction = dt / (t2 - t1) # fraction of step that contributes to last step in the segment
-                p2 = power_dataframe[power_dataframe['Date'] == t2]['Power(W)'].values[0] if not power_dataframe[power_dataframe['Date'] == t2].empty else 0
-                e2 = power_dataframe[power_dataframe['Date'] == t2]['Energy(kWh)'].values[0] if not power_dataframe[power_dataframe['Date'] == t2].empty else 0
-                print(f"        Using datapoint at {t2} with Power={p2}W, Energy={e2}kWh, fraction={fraction}, baseline_energy={baseline_energy}, baseline_power={baseline_power}")
+                p2 = series.power[after] if after < len(series) else 0
+                e2 = series.energy[after] if after < len(series) else 0
+                message("        Using datapoint at %s with Power=%sW, Energy=%skWh, fraction=%s, baseline_energy=%s, baseline_power=%s",
+                        t2, p2, e2, fraction, baseline_energy, baseline_power)
                 stats['filtered_data'] = pd.DataFrame({
                     'Date': [stop],
                     'Energy(kWh)': [(e2 - baseline_energy) * fraction + baseline_energy],
                     'Power(W)': [(p2 - baseline_power) * fraction + baseline_power]
                 })
+                if isinstance(source, PowerSeries):
+                    stats['filtered_data'] = as_power_series(stats['filtered_data']).compact()
         data_periods.append(stats['filtered_data'])
 
     return data_periods
 
 
+def _prorate_last_sample(segment, end_timestamp: pd.Timestamp, fraction: float):
+    # Copy of segment whose last sample is moved to end_timestamp and has its power and energy scaled by fraction,
+    # so that the modification does not write through to the power data the segment is a view of
+    if isinstance(segment, PowerSeries):
+        dates = np.array(segment.dates)
+        power = segment.power.astype(np.float64)
+        energy = np.array(segment.energy, dtype=np.float64)
+        last = int(np.argmax(dates))
+        dates[last] = to_epoch_ns(end_timestamp)
+        energy[last] *= fraction
+        power[last] *= fraction
+        return PowerSeries.from_arrays(dates, power, energy=energy)
+    # float power, as it is pro-rated
+    segment = segment.astype({'Power(W)': float})
+    # set the last timestamp of segment equal to the end_timestamp
+    segment.loc[segment['Date'].idxmax(), 'Date'] = end_timestamp
+    # adjust the energy and power values of the last segment datapoint accordingly
+    segment.loc[segment['Date'].idxmax(), 'Energy(kWh)'] *= fraction
+    segment.loc[segment['Date'].idxmax(), 'Power(W)'] *= fraction
+    return segment
+
+
+def _column(data, name: str) -> np.ndarray:
+    # column of a DataFrame or PowerSeries as an array (a view where possible)
+    return data.column(name) if isinstance(data, PowerSeries) else data[name].to_numpy()
+
+
+def _rows(data, lo: int, hi: int):
+    # rows [lo, hi) of a DataFrame or PowerSeries, as a view of the same type
+    return data.slice(lo, hi) if isinstance(data, PowerSeries) else data.iloc[lo:hi]
+
+
 def compute_energy_stats(
         df: pd.DataFrame,
         start_date: str,
@@ -133,7 +226,11 @@ def compute_energy_stats(
     Compute energy statistics between two timestamps.
     
     Parameters:
-    df (pd.DataFrame): DataFrame with 'Date' and 'Energy(kWh)' columns
+    df (pd.DataFrame, PowerSeries or RollupPyramid): DataFrame with 'Date' and 'Energy(kWh)' columns.
+        Pass a PowerSeries when querying many windows of the same data; the window is then
+        found with binary search instead of a full-frame mask, the statistics come from its
+        rollup pyramid (whole buckets inside the window, raw samples only at the edges), and
+        filtered_data is a PowerSeries view.
     start_date (str or pd.Timestamp): Start timestamp
     end_date (str or pd.Timestamp): End timestamp
     
@@ -145,18 +242,33 @@ def compute_energy_stats(
     end_date = pd.to_datetime(end_date)
     
     # Filter data between the two timestamps
+    if isinstance(df, (PowerSeries, RollupPyramid)):
+        pyramid = df if isinstance(df, RollupPyramid) else df.rollup
+        lo, hi = pyramid.series.window_bounds(start_date, end_date)
+        return _energy_stats(pyramid.series.slice(lo, hi), start_date, end_date, pyramid.query(start_date, end_date))
     mask = (df['Date'] >= start_date) & (df['Date'] <= end_date)
     filtered_data = df.loc[mask]
-    
+    return _energy_stats(filtered_data, start_date, end_date)
+
+
+def _energy_stats(filtered_data: pd.DataFrame, start_date, end_date, summaries: dict = None, i: int = 0) -> dict:
+    # summaries: optional PowerRangeIndex query result; entry i holds the statistics of filtered_data
     if filtered_data.empty:
-        print(f"No data found between {start_date} and {end_date}")
+        message("No data found between %s and %s", pd.to_datetime(start_date), pd.to_datetime(end_date), level='warning')
+        count(empty_periods=1)
         return {'total_energy': 0, 'avg_power': 0, 'max_power': 0, 'min_power': 0, 'filtered_data': pd.DataFrame()}
     
     # Calculate statistics
-    total_energy = filtered_data['Energy(kWh)'].sum()
-    avg_power = filtered_data['Power(W)'].mean()
-    max_power = filtered_data['Power(W)'].max()
-    min_power = filtered_data['Power(W)'].min()
+    if summaries is not None:
+        total_energy = summaries['total_energy'][i]
+        avg_power = summaries['avg_power'][i]
+        max_power = summaries['max_power'][i]
+        min_power = summaries['min_power'][i]
+    else:
+        total_energy = filtered_data['Energy(kWh)'].sum()
+        avg_power = filtered_data['Power(W)'].mean()
+        max_power = filtered_data['Power(W)'].max()
+        min_power = filtered_data['Power(W)'].min()
     
     return {
         'total_energy': total_energy,
@@ -167,60 +279,81 @@ def compute_energy_stats(
     }
 
 
+@timed
 def compute_baseline_stats(
         df: pd.DataFrame,
         percentile_threshold: float = 70.0,
-        print_stats: bool = True):
+        print_stats: bool = True,
+        sketch_k: int = None):
     # Step 1: Baseline Power Consumption Analysis
     """
     Analyze baseline power consumption by identifying periods with stable, low power usage.
 
     Parameters:
-    df: DataFrame with Date, Power(W), Energy(kWh) columns
+    df: DataFrame or PowerSeries with Date, Power(W), Energy(kWh) columns
     percentile_threshold: Percentile below which we consider power as "baseline"
+    sketch_k: Estimate the threshold and the baseline median with a QuantileSketch of this accuracy instead of
+        exactly (bounded memory, see quantile_sketch.py); the statistics then also hold the sketch's rank_error
 
     Returns:
     dict with baseline statistics
     """
+    power = _column(df, 'Power(W)')
+    if power.dtype == np.float32:
+        # compact PowerSeries: compute in double precision
+        power = power.astype(np.float64)
     # Calculate power threshold for baseline (e.g., 75th percentile and below)
-    power_threshold = np.percentile(df['Power(W)'], percentile_threshold)
+    if sketch_k is not None:
+        estimate = baseline_quantiles(QuantileSketch(sketch_k).update(power), percentile_threshold)
+        power_threshold = estimate['threshold_power']
+    else:
+        power_threshold = np.percentile(power, percentile_threshold)
 
-    # Identify baseline periods
-    baseline_mask = df['Power(W)'] <= power_threshold
-    baseline_data = df[baseline_mask].copy()
+    # Identify baseline periods (only the selected values are gathered, not a copy of the frame)
+    baseline_mask = power <= power_threshold
+    baseline_power = power[baseline_mask]
+    baseline_energy = _column(df, 'Energy(kWh)')[baseline_mask]
+    n_baseline = len(baseline_power)
 
-    # Calculate baseline statistics
+    # Calculate baseline statistics (NaN-skipping, like the pandas reductions they replace)
     baseline_stats = {
         'threshold_power': power_threshold,
-        'baseline_periods': len(baseline_data),
-        'total_periods': len(df),
-        'baseline_percentage': len(baseline_data) / len(df) * 100,
-        'mean_power': baseline_data['Power(W)'].mean(),
-        'median_power': baseline_data['Power(W)'].median(),
-        'std_power': baseline_data['Power(W)'].std(),
-        'min_power': baseline_data['Power(W)'].min(),
-        'max_power': baseline_data['Power(W)'].max(),
-        'mean_energy': baseline_data['Energy(kWh)'].mean(),
-        'total_baseline_energy': baseline_data['Energy(kWh)'].sum()
+        'baseline_periods': n_baseline,
+        'total_periods': len(power),
+        'baseline_percentage': n_baseline / len(power) * 100,
+        'mean_power': np.nanmean(baseline_power, dtype=np.float64),
+        'median_power': np.nanmedian(baseline_power),
+        'std_power': np.nanstd(baseline_power, ddof=1, dtype=np.float64),
+        'min_power': np.nanmin(baseline_power),
+        'max_power': np.nanmax(baseline_power),
+        'mean_energy': np.nanmean(baseline_energy, dtype=np.float64),
+        'total_baseline_energy': np.nansum(baseline_energy, dtype=np.float64)
     }
+    if sketch_k is not None:
+        baseline_stats['median_power'] = estimate['median_power']
+        baseline_stats['rank_error'] = estimate['rank_error']
 
+    count_frame(df)
+    annotate(baseline_rows=baseline_stats['baseline_periods'])
     if print_stats:
-        print("     compute_baseline_stats -- Baseline analysis...")
-        print(f"      Power threshold for baseline: {baseline_stats['threshold_power']:.1f} W")
-        print(f"      Baseline periods: {baseline_stats['baseline_periods']} out of {baseline_stats['total_periods']} ({baseline_stats['baseline_percentage']:.1f}%)")
-        print(f"      Mean baseline power: {baseline_stats['mean_power']:.1f} W")
-        print(f"      Median baseline power: {baseline_stats['median_power']:.1f} W")
-        print(f"      Std baseline power: {baseline_stats['std_power']:.1f} W")
-        print(f"      Power range: {baseline_stats['min_power']:.1f} - {baseline_stats['max_power']:.1f} W")
-        print(f"      Mean baseline energy per period: {baseline_stats['mean_energy']:.6f} kWh")
-        print(f"      Total baseline energy: {baseline_stats['total_baseline_energy']:.4f} kWh")
-        print()
+        message("     compute_baseline_stats -- Baseline analysis...")
+        message("      Power threshold for baseline: %.1f W", baseline_stats['threshold_power'])
+        message("      Baseline periods: %d out of %d (%.1f%%)", baseline_stats['baseline_periods'],
+                baseline_stats['total_periods'], baseline_stats['baseline_percentage'])
+        message("      Mean baseline power: %.1f W", baseline_stats['mean_power'])
+        message("      Median baseline power: %.1f W", baseline_stats['median_power'])
+        message("      Std baseline power: %.1f W", baseline_stats['std_power'])
+        message("      Power range: %.1f - %.1f W", baseline_stats['min_power'], baseline_stats['max_power'])
+        message("      Mean baseline energy per period: %.6f kWh", baseline_stats['mean_energy'])
+        message("      Total baseline energy: %.4f kWh", baseline_stats['total_baseline_energy'])
+        message("")
 
     return baseline_stats
 
 
 # Step 2: Power Surge Detection
 
+@timed
 def detect_power_surges(
         df: pd.DataFrame,
         baseline_stats: dict,
@@ -230,7 +363,7 @@ def detect_power_surges(
     Detect periods of increased power usage (surges).
 
     Parameters:
-    df: DataFrame with Date, Power(W), Energy(kWh) columns
+    df: DataFrame or PowerSeries with Date, Power(W), Energy(kWh) columns
     baseline_stats: Dictionary with baseline statistics
     surge_threshold_multiplier: Multiplier above baseline mean to consider as surge
     min_duration_minutes: Minimum duration in minutes to consider as a valid surge period
@@ -241,87 +374,162 @@ def detect_power_surges(
     # Define surge threshold
     surge_threshold = baseline_stats['mean_power'] * surge_threshold_multiplier
 
-    # Identify surge points
-    df_copy = df.copy()
-    df_copy['is_surge'] = df_copy['Power(W)'] > surge_threshold
-
-    # Find continuous surge periods
+    power = np.asarray(_column(df, 'Power(W)'), dtype=np.float64)
+    energy = np.asarray(_column(df, 'Energy(kWh)'), dtype=np.float64)
+    dates = _column(df, 'Date')
+
+    # Find continuous surge periods (inclusive start/end row positions)
+    starts, ends = find_runs(power > surge_threshold)
+    if len(starts) == 0:
+        return [], surge_threshold
+
+    # Only keep surges longer than minimum duration
+    durations = (dates[ends] - dates[starts]) / np.timedelta64(1, 's') / 60  # minutes
+    keep = durations >= min_duration_minutes
+    starts, ends, durations = starts[keep], ends[keep], durations[keep]
+    if len(starts) == 0:
+        return [], surge_threshold
+
+    # Per-surge reductions over the contiguous segments power[start:end + 1]
+    counts = ends - starts + 1
+    peak_power = segment_reduce(np.maximum, power, starts, ends)
+    min_power = segment_reduce(np.minimum, power, starts, ends)
+    power_sum = segment_reduce(np.add, power, starts, ends)
+    total_energy = segment_reduce(np.add, energy, starts, ends)
+    energy_above_baseline = total_energy - counts * baseline_stats['mean_energy']
+
+    start_times = df['Date'].iloc[starts]
+    end_times = df['Date'].iloc[ends]
     surge_periods = []
-    in_surge = False
-    surge_start = None
-    surge_data = []
-
-    for idx, row in df_copy.iterrows():
-        if row['is_surge'] and not in_surge:
-            # Start of new surge
-            in_surge = True
-            surge_start = row['Date']
-            surge_data = [row]
-        elif row['is_surge'] and in_surge:
-            # Continue surge
-            surge_data.append(row)
-        elif not row['is_surge'] and in_surge:
-            # End of surge
-            surge_end = surge_data[-1]['Date']
-            surge_duration = (surge_end - surge_start).total_seconds() / 60  # minutes
-
-            # Only keep surges longer than minimum duration
-            if surge_duration >= min_duration_minutes:
-                surge_df = pd.DataFrame(surge_data)
-                surge_info = {
-                    'start_time': surge_start,
-                    'end_time': surge_end,
-                    'duration_minutes': surge_duration,
-                    'peak_power': surge_df['Power(W)'].max(),
-                    'avg_power': surge_df['Power(W)'].mean(),
-                    'min_power': surge_df['Power(W)'].min(),
-                    'total_energy': surge_df['Energy(kWh)'].sum(),
-                    'data_points': len(surge_df),
-                    'avg_energy_per_point': surge_df['Energy(kWh)'].mean(),
-                    'surge_data': surge_df
-                }
-                # Calculate energy above baseline
-                baseline_energy_equivalent = len(surge_df) * baseline_stats['mean_energy']
-                surge_info['energy_above_baseline'] = surge_info['total_energy'] - baseline_energy_equivalent
-
-                surge_periods.append(surge_info)
-
-            # Reset for next potential surge
-            in_surge = False
-            surge_data = []
+    for i in range(len(starts)):
+        surge_periods.append({
+            'start_time': start_times.iloc[i],
+            'end_time': end_times.iloc[i],
+            'duration_minutes': float(durations[i]),
+            'peak_power': peak_power[i],
+            'avg_power': power_sum[i] / counts[i],
+            'min_power': min_power[i],
+            'total_energy': total_energy[i],
+            'data_points': int(counts[i]),
+            'avg_energy_per_point': total_energy[i] / counts[i],
+            'surge_data': _rows(df, starts[i], ends[i] + 1),
+            'energy_above_baseline': energy_above_baseline[i]
+        })
 
     return surge_periods, surge_threshold
 
 
+def find_runs(mask: np.ndarray) -> (np.ndarray, np.ndarray):
+    """
+    Run-length encode a boolean array.
+
+    A run is only reported once it is closed by a False value, so a run that is still
+    open at the end of the array is not returned (matching the original row loop in
+    detect_power_surges, which only emitted a surge when power dropped again).
+
+    Parameters:
+    mask (np.ndarray): Boolean array
+
+    Returns:
+    tuple of int arrays (starts, ends) with inclusive row positions of each run
+    """
+    mask = np.asarray(mask, dtype=bool)
+    edges = np.diff(mask.astype(np.int8), prepend=np.int8(0))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) - 1
+    return starts[:len(ends)], ends
+
+
+def segment_reduce(ufunc, values: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """
+    Reduce values[start:end + 1] for many non-overlapping, sorted segments in one call.
+
+    Parameters:
+    ufunc: Binary numpy ufunc, e.g. np.add, np.maximum, np.minimum
+    values (np.ndarray): 1-D array
+    starts, ends (np.ndarray): Inclusive segment bounds, sorted and non-overlapping
+
+    Returns:
+    np.ndarray with one reduced value per segment
+    """
+    if len(starts) == 0:
+        return np.empty(0, dtype=values.dtype)
+    # Interleave segment starts with the row after each segment so that reduceat sees
+    # [start, end + 1) for every segment; the gap slots in between are discarded.
+    # The array is padded so that end + 1 is always a valid position.
+    bounds = np.empty(2 * len(starts), dtype=np.int64)
+    bounds[0::2] = starts
+    bounds[1::2] = ends + 1
+    padded = np.concatenate([values, values[-1:]])
+    return ufunc.reduceat(padded, bounds)[0::2]
+
+
 def compute_surge_vs_simpipe_start_endtime_diffs(
         carbontracker_simpipe_data: pd.DataFrame,
-        surge_periods: list):
-    # Step 6: Time Difference Analysis between Power Surges and Carbontracker
+        surge_periods: list,
+        verbose: bool = True) -> pd.DataFrame:
+    """
+    Step 6: Time difference analysis between the power surges and the Carbontracker execution period.
+
+    The timing relations of all surges are computed at once; the closest surge is found with
+    interval_join.nearest_start.
 
+    Parameters:
+    carbontracker_simpipe_data (pd.DataFrame): SIMPIPE data with start and stop columns
+    surge_periods (list): Surge periods from detect_power_surges
+    verbose (bool): Print the time difference report
+
+    Returns:
+    pd.DataFrame with surge (1-based), start_time, end_time, start_diff_seconds (surge start - carbontracker
+    start), end_diff_seconds (surge end - carbontracker stop), starts_before, overlaps, starts_after and
+    closest (closest surge to the carbontracker start), one row per surge
+    """
     first_start_dt = pd.to_datetime(carbontracker_simpipe_data['start'].iloc[0]).tz_localize(None)
     last_stop_dt = pd.to_datetime(carbontracker_simpipe_data['stop'].iloc[-1]).tz_localize(None)
-
+    ct_start, ct_stop = to_epoch_ns(first_start_dt), to_epoch_ns(last_stop_dt)
+
+    surge_starts, surge_ends = surge_intervals(surge_periods)
+    # Time differences in seconds (positive = surge comes after carbontracker), floored to microseconds
+    # like Timedelta.total_seconds
+    start_diffs = ((surge_starts - ct_start) // 1000) / 1e6
+    end_diffs = ((surge_ends - ct_stop) // 1000) / 1e6
+    overlaps = np.zeros(len(surge_periods), dtype=bool)
+    overlaps[overlap_join(surge_starts, surge_ends, [ct_start], [ct_stop], closed=True)['a']] = True
+    closest = np.zeros(len(surge_periods), dtype=bool)
+    if len(surge_periods):
+        closest[nearest_start([ct_start], surge_starts)[0][0]] = True
+    timing = pd.DataFrame({
+        'surge': np.arange(1, len(surge_periods) + 1),
+        'start_time': [surge['start_time'] for surge in surge_periods],
+        'end_time': [surge['end_time'] for surge in surge_periods],
+        'start_diff_seconds': start_diffs,
+        'end_diff_seconds': end_diffs,
+        'starts_before': surge_starts < ct_start,
+        'overlaps': overlaps,
+        'starts_after': surge_starts > ct_stop,
+        'closest': closest,
+    })
+    if verbose:
+        _print_surge_time_diffs(timing, first_start_dt, last_stop_dt)
+    return timing
+
+
+def _print_surge_time_diffs(timing: pd.DataFrame, first_start_dt, last_stop_dt):
     print("=== TIME DIFFERENCE ANALYSIS ===")
     print(f"Carbontracker start time: {first_start_dt}")
     print(f"Carbontracker stop time: {last_stop_dt}")
     print(f"Carbontracker duration: {(last_stop_dt - first_start_dt).total_seconds() / 60:.1f} minutes\n")
 
-    # Calculate differences for each surge
-    for i, surge in enumerate(surge_periods, 1):
-        surge_start = surge['start_time']
-        surge_end = surge['end_time']
-
-        # Time differences in seconds (positive = surge comes after carbontracker)
-        start_diff_seconds = (surge_start - first_start_dt).total_seconds()
-        end_diff_seconds = (surge_end - last_stop_dt).total_seconds()
-
+    for row in timing.itertuples(index=False):
+        start_diff_seconds = row.start_diff_seconds
+        end_diff_seconds = row.end_diff_seconds
         # Convert to hours and minutes for readability
         start_diff_hours = start_diff_seconds / 3600
         end_diff_hours = end_diff_seconds / 3600
 
-        print(f"Surge {i}:")
-        print(f"  Surge start: {surge_start}")
-        print(f"  Surge end: {surge_end}")
+        print(f"Surge {row.surge}:")
+        print(f"  Surge start: {row.start_time}")
+        print(f"  Surge end: {row.end_time}")
         print("  Start time difference from carbontracker start:")
         if start_diff_seconds >= 0:
             print(f"    +{abs(start_diff_hours):.2f} hours ({abs(start_diff_seconds/60):.1f} minutes) AFTER carbontracker start")
@@ -337,39 +545,24 @@ def compute_surge_vs_simpipe_start_endtime_diffs(
 
     # Summary of timing relationships
     print("=== TIMING RELATIONSHIPS SUMMARY ===")
-    surges_before_ct = sum(1 for surge in surge_periods if surge['start_time'] < first_start_dt)
-    surges_during_ct = sum(1 for surge in surge_periods
-                        if surge['start_time'] <= last_stop_dt and surge['end_time'] >= first_start_dt)
-    surges_after_ct = sum(1 for surge in surge_periods if surge['start_time'] > last_stop_dt)
-
-    print(f"Surges starting before carbontracker         : {surges_before_ct}")
-    print(f"Surges overlapping with carbontracker period : {surges_during_ct}")
-    print(f"Surges starting after carbontracker          : {surges_after_ct}")
-
-    # Check which surge is closest to carbontracker start
-    closest_start_surge = None
-    min_start_diff = float('inf')
-
-    for i, surge in enumerate(surge_periods, 1):
-        start_diff = abs((surge['start_time'] - first_start_dt).total_seconds())
-        if start_diff < min_start_diff:
-            min_start_diff = start_diff
-            closest_start_surge = i
-
-    if closest_start_surge:
-        closest_surge = surge_periods[closest_start_surge - 1]
-        diff_minutes = min_start_diff / 60
-        print(f"\nClosest surge to carbontracker start      : Surge {closest_start_surge}")
-        print(f"Time difference: {diff_minutes:.1f} minutes")
+    print(f"Surges starting before carbontracker         : {int(timing['starts_before'].sum())}")
+    print(f"Surges overlapping with carbontracker period : {int(timing['overlaps'].sum())}")
+    print(f"Surges starting after carbontracker          : {int(timing['starts_after'].sum())}")
+
+    closest = timing[timing['closest']]
+    if not closest.empty:
+        row = closest.iloc[0]
+        print(f"\nClosest surge to carbontracker start      : Surge {row['surge']}")
+        print(f"Time difference: {abs(row['start_diff_seconds']) / 60:.1f} minutes")
 
         # Check if this surge overlaps with carbontracker execution
-        if (closest_surge['start_time'] <= last_stop_dt and
-            closest_surge['end_time'] >= first_start_dt):
+        if row['overlaps']:
             print("This surge OVERLAPS with carbontracker execution period")
         else:
-            print("This surge does NOT overlap with carbontracker execution period")    
+            print("This surge does NOT overlap with carbontracker execution period")
 
 
+@timed
 def compute_relative_energy_usage(
         power_data_segments: pd.DataFrame, 
         time_periods: list,
@@ -377,6 +570,9 @@ def compute_relative_energy_usage(
     """
     Compute the relative energy usage for each segment.
 
+    See attribution.attribute_step_energy for a vectorized variant that pro-rates the
+    boundary samples of every step.
+
     Parameters:
     power_data_segments (list): List of power data segments
 
@@ -394,19 +590,19 @@ def compute_relative_energy_usage(
     try:
         baseline_energy = baseline_segment['Energy(kWh)'].mean()
     except KeyError:
-        print("    Warning! Could not compute baseline energy:")
-        print(baseline_energy)
+        message("    Warning! Could not compute baseline energy:", level='warning')
+        message("%s", baseline_energy, level='warning')
 
     if baseline_stats is not None:
-        print(f"    Using baseline energy from baseline_stats: {baseline_stats['mean_energy']} kWh")
-        print(f"    Baseline energy from baseline_segment    : {baseline_energy} kWh")
+        message("    Using baseline energy from baseline_stats: %s kWh", baseline_stats['mean_energy'])
+        message("    Baseline energy from baseline_segment    : %s kWh", baseline_energy)
         baseline_energy = baseline_stats['mean_energy']
-    outdf = pd.DataFrame(columns=["step", "start", "stop", "duration", "energy(kWh)"])
+    rows = []
 
     segment_nr = 1
     start_segment = 1
     for segment in power_data_segments[start_segment:]:
-        print(f"    Processing segment {segment_nr}")
+        message("    Processing segment %s", segment_nr)
         if not segment.empty:
             total_energy = segment['Energy(kWh)'].sum()
             relative_energy = segment['Energy(kWh)'] - baseline_energy
@@ -414,278 +610,29 @@ def compute_relative_energy_usage(
             total_absolute_energy += total_energy
             total_relative_energy += segment_energy
             step = time_periods[segment_nr][0]
-            print(f"    Step: {step}")
+            message("    Step: %s", step)
             start = time_periods[segment_nr][1]
             stop = time_periods[segment_nr][2]
             duration = (pd.to_datetime(stop) - pd.to_datetime(start)).total_seconds()
-            new_row = pd.DataFrame([{"step": step, "start": start, "stop": stop, "duration": duration, "energy(kWh)": segment_energy, "absolute_energy(kWh)": total_energy}])
-            outdf = pd.concat([outdf, new_row], ignore_index=True)
+            rows.append({"step": step, "start": start, "stop": stop, "duration": duration, "energy(kWh)": segment_energy, "absolute_energy(kWh)": total_energy})
         else:
-            print(f"    Warning! Empty segment {segment_nr}")
+            message("    Warning! Empty segment %s", segment_nr, level='warning')
         # increment the segment_nr
         segment_nr += 1
-    print(f"Total absolute energy consumption (kWh): {total_absolute_energy}")
-    print(f"Total relative energy consumption (kWh): {total_relative_energy}")
+    message("Total absolute energy consumption (kWh): %s", total_absolute_energy)
+    message("Total relative energy consumption (kWh): %s", total_relative_energy)
+    annotate(segments=len(power_data_segments), rows=sum(len(segment) for segment in power_data_segments))
+    # build the table once instead of growing it with pd.concat per segment
+    outdf = pd.DataFrame(rows, columns=["step", "start", "stop", "duration", "energy(kWh)", "absolute_energy(kWh)"])
     return outdf, baseline_energy, total_absolute_energy, total_relative_energy
 
 
-### Plotting
-
-
-def plot_energy_usage(
-        df: pd.DataFrame,
-        x_col: str = 'Date',
-        y_col: str = 'Energy(kWh)',
-        title: str = 'Energy Usage Over Time',
-        start: str = None,
-        end: str = None,
-        timestamps: str = None):
-    """
-    Plot energy usage over time using matplotlib.pyplot
-    
-    Parameters:
-    df (pd.DataFrame): DataFrame with date and energy columns
-    x_col (str): Column name for x-axis (default: 'Date')
-    y_col (str): Column name for y-axis (default: 'Energy(kWh)')
-    title (str): Plot title
-    start (str): Start timestamp for filtering data
-    end (str): End timestamp for filtering data
-    timestamps (list): Optional list of timestamps for highlighting specific events
-        * plot vertical line(s) at given timestamps
-    """
-    
-    if start and end:
-        copy = df[(df[x_col] >= start) & (df[x_col] <= end)]
-    elif start:
-        copy = df[df[x_col] >= start]
-    elif end:
-        copy = df[df[x_col] <= end]
-    else:
-        copy = df
-
-    plt.figure(figsize=(10, 6))
-    plt.plot(copy[x_col], copy[y_col])
-    
-    # Add vertical lines at specified timestamps
-    if timestamps is not None:
-        for timestamp in timestamps:
-            plt.axvline(x=pd.to_datetime(timestamp), color='red', linestyle='--', alpha=0.7, label='Event')
-
-    plt.xlabel(x_col)
-    plt.ylabel(y_col)
-    plt.title(title)
-    plt.grid(True, alpha=0.3)
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-    plt.show()
-
-
-def plot_energy_usage_overlay_multiple_datasets(
-        raw_power_data: pd.DataFrame, 
-        data_periods: pd.DataFrame, 
-        time_periods_ct: list, 
-        start_time: str = None, 
-        end_time: str = None) -> None:
+def __getattr__(name: str):
     """
-    This plots the data as specified in plot_energy_usage and on top plots the multiple datasets as plot_multiple_datasets().
+    Lazily re-export the plotting functions, so `from analysis_functions import plot_energy_usage` keeps working
+    while matplotlib is only imported when a plot is actually requested.
     """
-    # Filter the raw data for the specified time range
-    if start_time and end_time:
-        filtered_raw = raw_power_data[(raw_power_data['Date'] >= start_time) & (raw_power_data['Date'] <= end_time)]
-    elif start_time:
-        filtered_raw = raw_power_data[raw_power_data['Date'] >= start_time]
-    elif end_time:
-        filtered_raw = raw_power_data[raw_power_data['Date'] <= end_time]
-    else:
-        filtered_raw = raw_power_data
-
-    # Create single plot with both datasets
-    plt.figure(figsize=(12, 6))
-    
-    # Plot the overall energy usage first (as background)
-    plt.plot(filtered_raw['Date'], filtered_raw['Energy(kWh)'], 
-             color='lightgray', alpha=0.7, linewidth=2, label='Overall Energy Usage')
-    
-    # Overlay the multiple datasets on the same plot
-    for i, df in enumerate(data_periods):
-        if not isinstance(df, pd.DataFrame):
-            print(f"Dataset {i} is not a valid DataFrame.")
-            continue
-        # Use provided label or generate default
-        if i < len(time_periods_ct):
-            label = time_periods_ct[i][0]
-        else:
-            # Create label from date range
-            start_date = df['Date'].min().strftime('%Y-%m-%d %H:%M')
-            end_date = df['Date'].max().strftime('%Y-%m-%d %H:%M')
-            label = f"Dataset {i+1}: {start_date} to {end_date}"
-        
-        plt.plot(df['Date'], df['Energy(kWh)'], label=label, marker='o', markersize=3)
-    
-    plt.xlabel('Date')
-    plt.ylabel('Energy(kWh)')
-    plt.title('Energy Usage Over Time with Multiple Datasets Overlay')
-    plt.legend()
-    plt.grid(True, alpha=0.3)
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-    plt.show()
-
-
-def plot_multiple_datasets(datasets_list, time_periods, column='Power(W)', title=None):
-    """
-    Plot multiple filtered datasets as separate lines.
-    
-    Parameters:
-    datasets_list (list): List of DataFrames (filtered_data from compute_energy_stats)
-    labels (list): Optional list of labels for each dataset
-    column (str): Column to plot ('Power(W)' or 'Energy(kWh)')
-    title (str): Optional plot title
-    """
-    plt.figure(figsize=(12, 6))
-    
-    for i, df in enumerate(datasets_list):
-        if df.empty:
-            continue
-            
-        # Use provided label or generate default
-        if time_periods and i < len(time_periods):
-            label = time_periods[i][0]
-        else:
-            # Create label from date range
-            start_date = df['Date'].min().strftime('%Y-%m-%d %H:%M')
-            end_date = df['Date'].max().strftime('%Y-%m-%d %H:%M')
-            label = f"Dataset {i+1}: {start_date} to {end_date}"
-        
-        plt.plot(df['Date'], df[column], label=label, marker='o', markersize=3)
-    
-    plt.xlabel('Date')
-    plt.ylabel(column)
-    plt.title(title or f'{column} Over Time - Multiple Datasets')
-    plt.legend()
-    plt.grid(True, alpha=0.3)
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-    plt.show()
-
-
-def plot_enhanced_visualization(
-        carbontracker_simpipe_data: pd.DataFrame,
-        power_data: pd.DataFrame,
-        baseline_stats: dict,
-        surge_periods: list,
-        surge_threshold: float):
-    # Step 5: Enhanced Visualization with Surge Periods and Carbontracker Markers
-
-    # Convert carbontracker timestamps to datetime and make timezone-naive for comparison
-    first_start_dt = pd.to_datetime(carbontracker_simpipe_data['start'].iloc[0]).tz_localize(None)
-    last_stop_dt = pd.to_datetime(carbontracker_simpipe_data['stop'].iloc[-1]).tz_localize(None)
-
-    print(f"Carbontracker period: {first_start_dt} to {last_stop_dt}")
-    print(f"Power data period: {power_data['Date'].min()} to {power_data['Date'].max()}")
-
-    # Create the enhanced plot
-    plt.figure(figsize=(16, 10))
-
-    # Main power consumption plot
-    plt.subplot(2, 1, 1)
-    plt.plot(power_data['Date'], power_data['Power(W)'], linewidth=1, alpha=0.7, color='blue', label='Power Consumption')
-
-    # Add baseline threshold line
-    plt.axhline(y=baseline_stats['mean_power'], color='green', linestyle='--',
-            label=f'Baseline Mean ({baseline_stats["mean_power"]:.1f} W)')
-    plt.axhline(y=surge_threshold, color='red', linestyle='--',
-            label=f'Surge Threshold ({surge_threshold:.1f} W)')
-
-    # Highlight surge periods
-    for i, surge in enumerate(surge_periods):
-        plt.axvspan(surge['start_time'], surge['end_time'],
-                alpha=0.3, color='red', label=f'Surge {i+1}' if i == 0 else "")
-
-    # Add carbontracker start and stop markers
-    plt.axvline(x=first_start_dt, color='purple', linestyle='-', linewidth=2, alpha=0.8,
-            label=f'Carbontracker Start ({first_start_dt.strftime("%H:%M")})')
-    plt.axvline(x=last_stop_dt, color='purple', linestyle='-', linewidth=2, alpha=0.8,
-            label=f'Carbontracker End ({last_stop_dt.strftime("%H:%M")})')
-
-    plt.title('Power Consumption with Surge Periods and Carbontracker Timeline')
-    plt.ylabel('Power (W)')
-    plt.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
-    plt.grid(True, alpha=0.3)
-    plt.xticks(rotation=45)
-
-    # Energy consumption plot
-    plt.subplot(2, 1, 2)
-    plt.plot(power_data['Date'], power_data['Energy(kWh)'], linewidth=1, alpha=0.7, color='orange', label='Energy Consumption')
-
-    # Add baseline energy line
-    plt.axhline(y=baseline_stats['mean_energy'], color='green', linestyle='--',
-            label=f'Baseline Mean ({baseline_stats["mean_energy"]:.6f} kWh)')
-
-    # Highlight surge periods
-    for i, surge in enumerate(surge_periods):
-        plt.axvspan(surge['start_time'], surge['end_time'],
-                alpha=0.3, color='red')
-
-    # Add carbontracker start and stop markers
-    plt.axvline(x=first_start_dt, color='purple', linestyle='-', linewidth=2, alpha=0.8)
-    plt.axvline(x=last_stop_dt, color='purple', linestyle='-', linewidth=2, alpha=0.8)
-
-    plt.title('Energy Consumption with Surge Periods and Carbontracker Timeline')
-    plt.ylabel('Energy (kWh)')
-    plt.xlabel('Date')
-    plt.legend()
-    plt.grid(True, alpha=0.3)
-    plt.xticks(rotation=45)
-
-    plt.tight_layout()
-    plt.show()
-
-    # Analysis of carbontracker period vs power surges
-    print("=== CARBONTRACKER vs POWER SURGE ANALYSIS ===")
-    print(f"Carbontracker monitoring period: {first_start_dt.strftime('%H:%M')} - {last_stop_dt.strftime('%H:%M')}")
-    carbontracker_duration = (last_stop_dt - first_start_dt).total_seconds() / 3600
-    print(f"Carbontracker duration: {carbontracker_duration:.2f} hours")
-
-    # Check overlap with surge periods
-    print("\nOverlap analysis with detected surge periods:")
-    for i, surge in enumerate(surge_periods, 1):
-        surge_start = surge['start_time']
-        surge_end = surge['end_time']
-
-        # Check if there's overlap
-        overlap_start = max(first_start_dt, surge_start)
-        overlap_end = min(last_stop_dt, surge_end)
-
-        if overlap_start < overlap_end:
-            overlap_duration = (overlap_end - overlap_start).total_seconds() / 60
-            surge_duration = surge['duration_minutes']
-            overlap_percentage = (overlap_duration / surge_duration) * 100
-            print(f"  Surge {i}: {overlap_percentage:.1f}% overlap ({overlap_duration:.1f}/{surge_duration:.1f} minutes)")
-            print(f"    Surge: {surge_start.strftime('%H:%M')} - {surge_end.strftime('%H:%M')}")
-            print(f"    Overlap: {overlap_start.strftime('%H:%M')} - {overlap_end.strftime('%H:%M')}")
-        else:
-            print(f"  Surge {i}: No overlap")
-            print(f"    Surge: {surge_start.strftime('%H:%M')} - {surge_end.strftime('%H:%M')}")
-
-    # Calculate energy during carbontracker period
-    ct_mask = (power_data['Date'] >= first_start_dt) & (power_data['Date'] <= last_stop_dt)
-    ct_power_data = power_data[ct_mask]
-
-    if len(ct_power_data) > 0:
-        ct_total_energy = ct_power_data['Energy(kWh)'].sum()
-        ct_avg_power = ct_power_data['Power(W)'].mean()
-        ct_peak_power = ct_power_data['Power(W)'].max()
-
-        print("\nPower statistics during Carbontracker period:")
-        print(f"  Average power: {ct_avg_power:.1f} W")
-        print(f"  Peak power: {ct_peak_power:.1f} W")
-        print(f"  Total energy: {ct_total_energy:.4f} kWh")
-        print(f"  Carbontracker reported energy: {carbontracker_simpipe_data['energy'].sum():.4f} kWh")
-
-        energy_diff = abs(ct_total_energy - carbontracker_simpipe_data['energy'].sum())
-        print(f"  Energy difference: {energy_diff:.4f} kWh")
-    else:
-        print("\nNo power data available during Carbontracker period")
-        print(f"  Power data range: {power_data['Date'].min()} to {power_data['Date'].max()}")
-        print(f"  Carbontracker range: {first_start_dt} to {last_stop_dt}")
\ No newline at end of file
+    if name in PLOTTING_FUNCTIONS:
+        import plotting
+        return getattr(plotting, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,100 @@
+### Vectorized per-step energy attribution with fractional pro-rating at every step boundary
+import numpy as np
+import pandas as pd
+
+from power_series import as_power_series, to_epoch_ns
+
+NS_PER_SECOND = 1_000_000_000
+
+
+def cumulative_energy_curve(power_data) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    Piecewise-linear cumulative energy and sample count over time.
+
+    A Tapo sample at t_i carries the energy of the interval (t_{i-1}, t_i] (see get_power_data),
+    spread uniformly over that interval. The first sample's interval starts at the series' origin
+    if it has one (compact series, power logs), else it is assumed to be as long as the second one's.
+
+    Parameters:
+    power_data (pd.DataFrame or PowerSeries): Data with Date and Energy(kWh) columns
+
+    Returns:
+    tuple (times, energy, samples): knot times (int64 epoch ns), cumulative energy (kWh) and
+    cumulative (fractional) sample count at each knot; all empty for empty power data
+    """
+    series = as_power_series(power_data)
+    dates = series.dates
+    if len(dates) == 0:
+        return dates, np.zeros(0), np.zeros(0)
+    energy = np.asarray(series.energy, dtype=np.float64)
+    origin = series.origin
+    if origin is None:
+        origin = int(dates[0]) - (int(dates[1] - dates[0]) if len(dates) > 1 else 0)
+    times = np.concatenate([[origin], dates])
+    return (times,
+            np.concatenate([[0.0], np.cumsum(energy)]),
+            np.arange(len(times), dtype=np.float64))
+
+
+def attribute_step_energy(
+        power_data,
+        time_periods: list,
+        baseline_energy: float = None,
+        baseline_stats: dict = None) -> pd.DataFrame:
+    """
+    Attribute the measured energy to every step in one vectorized pass.
+
+    Each sample's energy is split across all steps its interval overlaps, proportionally to the
+    overlap, so every step boundary is pro-rated (not only the end of the last step as in
+    divide_power_data_into_step_periods).
+
+    Parameters:
+    power_data (pd.DataFrame or PowerSeries): Power data from get_power_data
+    time_periods (list): Tuples (step_name, start_time, stop_time), see get_time_periods.
+        A period named 'baseline' is used as the baseline and left out of the result.
+    baseline_energy (float): Baseline energy per sample (kWh); overrides the baseline period
+    baseline_stats (dict): Output of compute_baseline_stats; its mean_energy is used as baseline
+        energy per sample if baseline_energy is not given
+
+    Returns:
+    pd.DataFrame with step, start, stop, duration (s), samples (fractional sample count),
+    energy(kWh) (relative to baseline), absolute_energy(kWh) and avg_power(W), one row per step
+    """
+    times, cumulative_energy, cumulative_samples = cumulative_energy_curve(power_data)
+    names = np.array([p[0] for p in time_periods], dtype=object)
+    starts = to_epoch_ns([p[1] for p in time_periods])
+    stops = to_epoch_ns([p[2] for p in time_periods])
+
+    # interpolate each cumulative curve at all starts and stops at once (left/right clamp to 0/total)
+    boundaries = np.concatenate([starts, stops])
+    if len(times):
+        energy_at = np.interp(boundaries, times, cumulative_energy)
+        samples_at = np.interp(boundaries, times, cumulative_samples)
+    else:
+        energy_at = samples_at = np.zeros(len(boundaries))
+    absolute = energy_at[len(starts):] - energy_at[:len(starts)]
+    samples = samples_at[len(starts):] - samples_at[:len(starts)]
+    durations = (stops - starts) / NS_PER_SECOND
+
+    is_baseline = names == 'baseline'
+    if baseline_energy is None and baseline_stats is not None:
+        baseline_energy = baseline_stats['mean_energy']
+    if baseline_energy is None and is_baseline.any():
+        i = np.flatnonzero(is_baseline)[0]
+        baseline_energy = absolute[i] / samples[i] if samples[i] > 0 else 0.0
+    if baseline_energy is None:
+        baseline_energy = 0.0
+
+    steps = ~is_baseline
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg_power = np.where(durations > 0, absolute * 3.6e6 / durations, np.nan)
+    return pd.DataFrame({
+        'step': names[steps],
+        'start': [p[1] for p, keep in zip(time_periods, steps) if keep],
+        'stop': [p[2] for p, keep in zip(time_periods, steps) if keep],
+        'duration': durations[steps],
+        'samples': samples[steps],
+        'energy(kWh)': absolute[steps] - baseline_energy * samples[steps],
+        'absolute_energy(kWh)': absolute[steps],
+        'avg_power(W)': avg_power[steps],
+    })
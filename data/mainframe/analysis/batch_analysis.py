@@ -0,0 +1,342 @@
+### Headless batch driver: regenerate final_results.csv / final_results_details.csv
+#
+# Usage (from data/mainframe/analysis):
+#   python batch_analysis.py
+#   python batch_analysis.py --workers 4 --output-dir /tmp/results
+#
+# Runs the same chain as complete-analysis.ipynb for every conf-*/runN.dat + power-runN.xls
+# pair, one run per worker process. With --trace FILE, the timing spans of every stage (see instrumentation.py)
+# are written to FILE as JSON lines.
+import argparse
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from analysis_functions import (
+    get_time_periods,
+    get_power_data,
+    divide_power_data_into_step_periods,
+    compute_relative_energy_usage,
+    compute_baseline_stats,
+)
+from alignment import alignment_is_reliable, estimate_clock_offset
+from instrumentation import JsonLinesSink, MemorySink, recording, span
+from stage_cache import StageCache, cached_chain, cached_power_data
+
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "carbontracker")
+
+FINAL_RESULTS_COLUMNS = [
+    "conf", "tapo_baseline_energy_avg", "tapo_baseline_energy_std", "tapo_absolute_energy_avg",
+    "tapo_absolute_energy_std", "tapo_relative_energy_avg", "tapo_relative_energy_std", "simpipe_energy_avg",
+    "simpipe_energy_std", "simpipe_duration_avg", "simpipe_duration_std"]
+FINAL_RESULTS_DETAILS_COLUMNS = [
+    "conf", "runNr", "tapo_baseline_energy", "tapo_total_relative_energy", "tapo_total_absolute_energy",
+    "simpipe_total_energy", "simpipe_duration"]
+
+
+def read_simpipe_data(path: str) -> pd.DataFrame:
+    """
+    Read a CarbonTracker/SIMPIPE runN.dat file.
+    """
+    return pd.read_csv(path, sep=r'\s+', comment='#', header=0)
+
+
+def discover_runs(data_dir: str = DEFAULT_DATA_DIR) -> list:
+    """
+    Find every conf-*/runN.dat with a matching power-runN.xls.
+
+    Only the top level of each conf directory is searched, so bad_data/ and first_attempt/ are skipped.
+
+    Returns:
+    list of dicts with conf, runNr, simpipe and tapo paths, ordered by conf and run number
+    """
+    runs = []
+    confs = [d for d in os.listdir(data_dir)
+             if re.fullmatch(r'conf-\d+', d) and os.path.isdir(os.path.join(data_dir, d))]
+    for conf in sorted(confs, key=lambda c: int(c.split('-')[1])):
+        conf_dir = os.path.join(data_dir, conf)
+        run_numbers = []
+        for name in os.listdir(conf_dir):
+            match = re.fullmatch(r'run(\d+)\.dat', name)
+            if match:
+                run_numbers.append(int(match.group(1)))
+        for run_number in sorted(run_numbers):
+            tapo = os.path.join(conf_dir, f"power-run{run_number}.xls")
+            if not os.path.exists(tapo):
+                print(f"    discover_runs -- Warning! No power-run{run_number}.xls for {conf}/run{run_number}.dat, skipping.")
+                continue
+            runs.append({
+                "conf": conf,
+                "runNr": f"run{run_number}",
+                "simpipe": os.path.join(conf_dir, f"run{run_number}.dat"),
+                "tapo": tapo,
+            })
+    return runs
+
+
+def read_surge_time_diffs(path: str) -> dict:
+    """
+    Read surge_time_diffs.dat into {(conf, runNr): startDiff in minutes}.
+    """
+    surge_time_diffs = pd.read_csv(path, sep=r'\s+', comment='#', header=0)
+    return {(row.configuration, f"run{int(row.runNr)}"): float(row.startDiff)
+            for row in surge_time_diffs.itertuples()}
+
+
+def shift_simpipe_data(simpipe_data: pd.DataFrame, minutes: float) -> pd.DataFrame:
+    """
+    Copy of simpipe_data with start/stop parsed as datetimes and shifted by minutes (simpipe_datetime_shift).
+    """
+    simpipe_data = simpipe_data.copy()
+    for column in ("start", "stop"):
+        simpipe_data[column] = pd.to_datetime(simpipe_data[column]) + pd.Timedelta(minutes=minutes)
+    return simpipe_data
+
+
+def analyze_run(job: dict) -> dict:
+    """
+    Run the get_time_periods -> divide_power_data_into_step_periods -> compute_relative_energy_usage
+    chain for one run (same steps as analyze_data in complete-analysis.ipynb).
+
+    Parameters:
+    job (dict): Entry of discover_runs plus simpipe_datetime_shift (minutes), percentile_threshold and verbose.
+        With auto_align set, the shift is estimated with estimate_clock_offset instead, searching
+        within offset_range (minutes) if given; an estimate below min_confidence or min_margin (see
+        alignment_is_reliable) is not used, the run keeps simpipe_datetime_shift and is flagged as alignment_fallback. With trace set, the stage timings are recorded. With cache_dir
+        set, the stages are memoized in a StageCache in that directory.
+
+    Returns:
+    dict with the per-run values of final_results_details.csv (plus trace: list of span records, if requested)
+    """
+    simpipe_data = read_simpipe_data(job["simpipe"])
+    if simpipe_data["energy"].dtype == 'object':
+        raise ValueError(f"Invalid data type for energy column in {job['simpipe']}")
+    sinks = [MemorySink()] if job.get("trace") else []
+    cache = StageCache(job["cache_dir"]) if job.get("cache_dir") else None
+    with recording(*sinks, echo=bool(job.get("verbose"))), span("analyze_run", conf=job["conf"], runNr=job["runNr"]):
+        if cache is None:
+            tapo_power_data = get_power_data(job["tapo"])
+        else:
+            tapo_power_data, _ = cached_power_data(cache, job["tapo"])
+        simpipe_datetime_shift = job.get("simpipe_datetime_shift", 0)
+        alignment = {"offset_minutes": np.nan, "confidence": np.nan, "margin": np.nan}
+        alignment_fallback = False
+        if job.get("auto_align"):
+            offset_range = job.get("offset_range") or (None, None)
+            alignment = estimate_clock_offset(
+                simpipe_data, tapo_power_data, min_offset_minutes=offset_range[0], max_offset_minutes=offset_range[1])
+            if alignment_is_reliable(alignment, job.get("min_confidence", 0.4), job.get("min_margin", 0.15)):
+                simpipe_datetime_shift = alignment["offset_minutes"]
+            else:
+                alignment_fallback = True
+        simpipe_data = shift_simpipe_data(simpipe_data, simpipe_datetime_shift)
+        if cache is None:
+            time_periods = get_time_periods(simpipe_data)
+            baseline_stats = compute_baseline_stats(
+                df=tapo_power_data, percentile_threshold=job.get("percentile_threshold", 70), print_stats=True)
+            segmented_power_data = divide_power_data_into_step_periods(time_periods, tapo_power_data)
+            _, baseline_energy, total_absolute_energy, total_relative_energy = compute_relative_energy_usage(
+                segmented_power_data, time_periods, baseline_stats)
+        else:
+            chain = cached_chain(cache, job["tapo"], simpipe_data,
+                                 percentile_threshold=job.get("percentile_threshold", 70), detect_surges=False)
+            baseline_energy = chain["baseline_energy"]
+            total_absolute_energy = chain["total_absolute_energy"]
+            total_relative_energy = chain["total_relative_energy"]
+    result = {
+        "conf": job["conf"],
+        "runNr": job["runNr"],
+        "tapo_baseline_energy": baseline_energy,
+        "tapo_total_relative_energy": total_relative_energy,
+        "tapo_total_absolute_energy": total_absolute_energy,
+        "simpipe_total_energy": simpipe_data["energy"].sum(),
+        "simpipe_duration": (simpipe_data["stop"] - simpipe_data["start"]).sum().total_seconds(),
+        "simpipe_datetime_shift": simpipe_datetime_shift,
+        "estimated_shift": alignment["offset_minutes"],
+        "reference_shift": job.get("reference_shift", np.nan),
+        "alignment_confidence": alignment["confidence"],
+        "alignment_margin": alignment["margin"],
+        "alignment_fallback": alignment_fallback,
+    }
+    if sinks:
+        result["trace"] = [{"conf": job["conf"], "runNr": job["runNr"], **record} for record in sinks[0].records]
+    return result
+
+
+def aggregate_results(run_results: list) -> (pd.DataFrame, pd.DataFrame):
+    """
+    Build final_results (avg/std per conf) and final_results_details (one row per run).
+    Standard deviations are population std (np.std), as in complete-analysis.ipynb.
+    """
+    final_results_details = pd.DataFrame(run_results, columns=FINAL_RESULTS_DETAILS_COLUMNS)
+    rows = []
+    for conf, group in final_results_details.groupby("conf", sort=False):
+        row = {"conf": conf}
+        for prefix, column in [
+                ("tapo_baseline_energy", "tapo_baseline_energy"),
+                ("tapo_absolute_energy", "tapo_total_absolute_energy"),
+                ("tapo_relative_energy", "tapo_total_relative_energy"),
+                ("simpipe_energy", "simpipe_total_energy"),
+                ("simpipe_duration", "simpipe_duration")]:
+            values = group[column].to_numpy(dtype=np.float64)
+            row[f"{prefix}_avg"] = np.mean(values)
+            row[f"{prefix}_std"] = np.std(values)
+        rows.append(row)
+    return pd.DataFrame(rows, columns=FINAL_RESULTS_COLUMNS), final_results_details
+
+
+def run_batch(
+        data_dir: str = DEFAULT_DATA_DIR,
+        output_dir: str = None,
+        surge_time_diffs_path: str = None,
+        workers: int = None,
+        percentile_threshold: float = 70,
+        auto_align: bool = False,
+        offset_range: tuple = None,
+        min_confidence: float = 0.4,
+        min_margin: float = 0.15,
+        verbose: bool = False,
+        trace_path: str = None,
+        cache_dir: str = None) -> (pd.DataFrame, pd.DataFrame):
+    """
+    Analyse every discovered run in a process pool and write final_results.csv and final_results_details.csv.
+
+    Parameters:
+    data_dir (str): Directory with the conf-* directories
+    output_dir (str): Where to write the CSVs (default: data_dir). Nothing is written if it is an empty string.
+    surge_time_diffs_path (str): Time shifts per run (default: data_dir/surge_time_diffs.dat)
+    workers (int): Number of worker processes (default: all cores)
+    percentile_threshold (float): Baseline percentile passed to compute_baseline_stats
+    auto_align (bool): Estimate each run's time shift by cross-correlation instead of reading surge_time_diffs.dat.
+        Unreliable estimates fall back to surge_time_diffs.dat. The estimates, their error against
+        surge_time_diffs.dat and the fallbacks are written to time_shifts.csv next to the results.
+    offset_range (tuple): (min, max) search range in minutes for auto_align
+    min_confidence, min_margin (float): Quality gate of the auto_align estimates, see alignment_is_reliable
+    verbose (bool): Let the workers print the analysis output
+    trace_path (str): Append the timing spans and messages of every run to this JSON lines file
+    cache_dir (str): Memoize the stages of every run in this directory (see stage_cache.py), so that a rerun with
+        other parameters only recomputes the stages they affect
+
+    Returns:
+    tuple (final_results, final_results_details)
+    """
+    output_dir = data_dir if output_dir is None else output_dir
+    surge_time_diffs_path = surge_time_diffs_path or os.path.join(data_dir, "surge_time_diffs.dat")
+    shifts = read_surge_time_diffs(surge_time_diffs_path) if os.path.exists(surge_time_diffs_path) else {}
+
+    jobs = []
+    for run in discover_runs(data_dir):
+        key = (run["conf"], run["runNr"])
+        if key not in shifts and not auto_align:
+            print(f"    run_batch -- Warning! No surge time diff for {key[0]} {key[1]}, using no shift.")
+        jobs.append({**run, "simpipe_datetime_shift": shifts.get(key, 0), "reference_shift": shifts.get(key, np.nan),
+                     "percentile_threshold": percentile_threshold, "auto_align": auto_align,
+                     "offset_range": offset_range, "min_confidence": min_confidence, "min_margin": min_margin,
+                     "verbose": verbose, "trace": bool(trace_path), "cache_dir": cache_dir})
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        run_results = [analyze_run(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, max(len(jobs), 1))) as pool:
+            run_results = list(pool.map(analyze_run, jobs))
+
+    if trace_path:
+        with JsonLinesSink(trace_path) as sink:
+            for result in run_results:
+                for record in result.pop("trace"):
+                    sink(record)
+
+    final_results, final_results_details = aggregate_results(run_results)
+    shifts = time_shifts(run_results) if auto_align else None
+    if auto_align:
+        print("    run_batch -- auto-align estimates against surge_time_diffs.dat (minutes):")
+        print(summarize_time_shifts(shifts).to_string(index=False))
+        for row in shifts[shifts["alignment_fallback"]].itertuples():
+            print(f"    run_batch -- Warning! Unreliable alignment for {row.conf} {row.runNr} "
+                  f"(estimate {row.estimated_shift:.1f}, confidence {row.alignment_confidence:.2f}, "
+                  f"margin {row.alignment_margin:.2f}), using {row.simpipe_datetime_shift:.1f}.")
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        final_results.to_csv(os.path.join(output_dir, "final_results.csv"), index=False)
+        final_results_details.to_csv(os.path.join(output_dir, "final_results_details.csv"), index=False)
+        if auto_align:
+            shifts.to_csv(os.path.join(output_dir, "time_shifts.csv"), index=False)
+    return final_results, final_results_details
+
+
+def time_shifts(run_results: list) -> pd.DataFrame:
+    """
+    Per run: the shift used, the auto_align estimate, the surge_time_diffs.dat shift, the estimate's error against it
+    (minutes), the correlation, the margin over the second-best peak and whether the run fell back.
+    """
+    shifts = pd.DataFrame(run_results, columns=[
+        "conf", "runNr", "simpipe_datetime_shift", "estimated_shift", "reference_shift", "alignment_confidence",
+        "alignment_margin", "alignment_fallback"])
+    shifts.insert(5, "shift_error", shifts["estimated_shift"] - shifts["reference_shift"])
+    return shifts
+
+
+def summarize_time_shifts(shifts: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per conf: runs, fallbacks, and the mean and maximum absolute error of the estimates against surge_time_diffs.dat,
+    over all runs and over the accepted ones.
+    """
+    shifts = shifts.assign(abs_error=shifts["shift_error"].abs(),
+                           accepted_abs_error=shifts["shift_error"].abs().where(~shifts["alignment_fallback"]))
+    return shifts.groupby("conf", sort=False).agg(
+        runs=("runNr", "size"),
+        fallbacks=("alignment_fallback", "sum"),
+        mean_abs_error=("abs_error", "mean"),
+        max_abs_error=("abs_error", "max"),
+        accepted_mean_abs_error=("accepted_abs_error", "mean"),
+        accepted_max_abs_error=("accepted_abs_error", "max"),
+    ).reset_index()
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Regenerate final_results.csv and final_results_details.csv for all confs and runs.")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="directory with the conf-* directories")
+    parser.add_argument("--output-dir", default=None, help="where to write the CSVs (default: data dir)")
+    parser.add_argument("--surge-time-diffs", default=None, help="surge_time_diffs.dat with per-run shifts in minutes")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--percentile-threshold", type=float, default=70, help="baseline percentile threshold")
+    parser.add_argument("--auto-align", action="store_true", help="estimate time shifts by cross-correlation instead of using surge_time_diffs.dat")
+    parser.add_argument("--offset-range", type=float, nargs=2, default=None, metavar=("MIN", "MAX"),
+                        help="search range in minutes for --auto-align")
+    parser.add_argument("--min-confidence", type=float, default=0.4,
+                        help="minimum correlation of an --auto-align estimate (else surge_time_diffs.dat is used)")
+    parser.add_argument("--min-margin", type=float, default=0.15,
+                        help="minimum lead of an --auto-align estimate over the second-best peak")
+    parser.add_argument("--verbose", action="store_true", help="print the per-run analysis output")
+    parser.add_argument("--trace", default=None, metavar="FILE", help="append per-stage timing spans as JSON lines to FILE")
+    parser.add_argument("--cache-dir", default=None, help="memoize the analysis stages in this directory")
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    final_results, final_results_details = run_batch(
+        data_dir=args.data_dir,
+        output_dir=args.output_dir,
+        surge_time_diffs_path=args.surge_time_diffs,
+        workers=args.workers,
+        percentile_threshold=args.percentile_threshold,
+        auto_align=args.auto_align,
+        offset_range=args.offset_range,
+        min_confidence=args.min_confidence,
+        min_margin=args.min_margin,
+        verbose=args.verbose,
+        trace_path=args.trace,
+        cache_dir=args.cache_dir)
+    elapsed = time.perf_counter() - t0
+    print(final_results.to_string(index=False))
+    print(f"\nAnalysed {len(final_results_details)} runs in {len(final_results)} configurations in {elapsed:.2f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+### Bootstrap confidence intervals and pairwise configuration differences for final_results_details.csv
+#
+# Usage (from data/mainframe/analysis):
+#   python bootstrap.py                                      # all metrics of ../data/carbontracker/final_results_details.csv
+#   python bootstrap.py --resamples 100000 --confidence 0.99 --output-dir /tmp/out
+#
+# final_results.csv holds only the mean and std of the (four) runs of every conf. This stage resamples the runs of
+# every conf with replacement and reports percentile confidence intervals of the mean of every metric, and for every
+# pair of confs the difference of the means with its interval and a two-sided bootstrap p-value (Holm-adjusted over
+# the pairs of each metric). All resamples of all confs and metrics are drawn and reduced as one array operation.
+# With four runs per conf the intervals are approximate (the bootstrap tends to make them too narrow for so few runs).
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from batch_analysis import DEFAULT_DATA_DIR, FINAL_RESULTS_DETAILS_COLUMNS
+
+DEFAULT_DETAILS_PATH = os.path.join(DEFAULT_DATA_DIR, "final_results_details.csv")
+DEFAULT_METRICS = FINAL_RESULTS_DETAILS_COLUMNS[2:]
+DEFAULT_RESAMPLES = 10_000
+
+
+def _run_tensor(details: pd.DataFrame, metrics: list) -> (list, np.ndarray, np.ndarray):
+    # (conf, run, metric) array of the run values, zero-padded to the largest number of runs, plus runs per conf
+    confs = list(pd.unique(details['conf']))
+    groups = details.groupby('conf', sort=False)
+    runs = np.array([groups.get_group(conf).shape[0] for conf in confs])
+    values = np.zeros((len(confs), runs.max() if len(confs) else 0, len(metrics)))
+    for c, conf in enumerate(confs):
+        values[c, :runs[c]] = groups.get_group(conf)[metrics].to_numpy(dtype=np.float64)
+    return confs, values, runs
+
+
+def bootstrap_means(
+        details: pd.DataFrame,
+        metrics: list = None,
+        n_resamples: int = DEFAULT_RESAMPLES,
+        seed: int = 0) -> dict:
+    """
+    Bootstrap distribution of the per-conf mean of every metric.
+
+    Every resample draws, for every conf independently, as many runs as it has with replacement. The draws are turned
+    into run counts (conf, resample, run) and reduced to means with one tensor contraction.
+
+    Parameters:
+    details (pd.DataFrame): final_results_details (conf, runNr and one column per metric)
+    metrics (list): Metric columns (default: all numeric columns of final_results_details.csv)
+    n_resamples (int): Number of bootstrap resamples
+    seed (int): Random seed
+
+    Returns:
+    dict with confs (list), metrics (list), runs (array, runs per conf), observed (array conf x metric) and
+    resampled (array conf x metric x resample, resamples last so that they are reduced over contiguous memory)
+    """
+    metrics = list(metrics or DEFAULT_METRICS)
+    confs, values, runs = _run_tensor(details, metrics)
+    rng = np.random.default_rng(seed)
+    n_runs = values.shape[1]
+    # draw r of conf c is only used for r < runs[c]; it picks one of the conf's own runs
+    draws = rng.integers(0, runs[:, None, None], size=(len(confs), n_resamples, n_runs))
+    used = np.broadcast_to(np.arange(n_runs) < runs[:, None, None], draws.shape)
+    # how often every run is drawn in every resample, as one bincount over (conf, resample, run) cells
+    cells = (np.arange(len(confs) * n_resamples).reshape(len(confs), n_resamples, 1) * n_runs + draws)[used]
+    counts = np.bincount(cells, minlength=draws.size).reshape(draws.shape).astype(np.float64)
+    resampled = np.einsum('cbr,crm->cmb', counts, values) / runs[:, None, None]
+    return {
+        'confs': confs,
+        'metrics': metrics,
+        'runs': runs,
+        'observed': values.sum(axis=1) / runs[:, None],
+        'resampled': resampled,
+    }
+
+
+def _percentiles(values: np.ndarray, quantiles: list) -> np.ndarray:
+    # np.quantile (linear interpolation) along the last axis, with one partition for all quantiles
+    n = values.shape[-1]
+    positions = np.asarray(quantiles, dtype=np.float64) * (n - 1)
+    lower = np.floor(positions).astype(np.int64)
+    upper = np.minimum(lower + 1, n - 1)
+    part = np.partition(values, np.unique(np.concatenate([lower, upper])), axis=-1)
+    weight = positions - lower
+    return np.stack([part[..., lo] * (1 - w) + part[..., hi] * w for lo, hi, w in zip(lower, upper, weight)])
+
+
+def _holm(p_values: np.ndarray) -> np.ndarray:
+    # Holm step-down adjustment along axis 0 (one family per column)
+    m = p_values.shape[0]
+    order = np.argsort(p_values, axis=0)
+    ranked = np.take_along_axis(p_values, order, axis=0) * (m - np.arange(m))[:, None]
+    ranked = np.minimum(np.maximum.accumulate(ranked, axis=0), 1.0)
+    adjusted = np.empty_like(p_values)
+    np.put_along_axis(adjusted, order, ranked, axis=0)
+    return adjusted
+
+
+def confidence_intervals(boot: dict, confidence: float = 0.95) -> pd.DataFrame:
+    """
+    Percentile confidence intervals of the mean of every metric per conf.
+
+    Parameters:
+    boot (dict): Result of bootstrap_means
+    confidence (float): Coverage of the intervals
+
+    Returns:
+    pd.DataFrame with conf, metric, runs, mean, ci_low, ci_high
+    """
+    alpha = 1 - confidence
+    low, high = _percentiles(boot['resampled'], [alpha / 2, 1 - alpha / 2])
+    n_confs, n_metrics = boot['observed'].shape
+    return pd.DataFrame({
+        'conf': np.repeat(boot['confs'], n_metrics),
+        'metric': np.tile(boot['metrics'], n_confs),
+        'runs': np.repeat(boot['runs'], n_metrics),
+        'mean': boot['observed'].ravel(),
+        'ci_low': low.ravel(),
+        'ci_high': high.ravel(),
+    })
+
+
+def pairwise_differences(boot: dict, confidence: float = 0.95) -> pd.DataFrame:
+    """
+    Difference of the means (conf_a - conf_b) of every metric for every pair of confs.
+
+    The bootstrap p-value is twice the smaller of the fractions of resampled differences at or below and at or above
+    zero (capped at 1), i.e. the smallest 1 - confidence at which the percentile interval excludes zero.
+
+    Parameters:
+    boot (dict): Result of bootstrap_means
+    confidence (float): Coverage of the intervals
+
+    Returns:
+    pd.DataFrame with conf_a, conf_b, metric, difference, ci_low, ci_high, p_value and p_value_holm
+    (adjusted over all pairs of the same metric)
+    """
+    alpha = 1 - confidence
+    a, b = np.triu_indices(len(boot['confs']), k=1)
+    resampled = boot['resampled'][a] - boot['resampled'][b]
+    low, high = _percentiles(resampled, [alpha / 2, 1 - alpha / 2])
+    below = np.count_nonzero(resampled <= 0, axis=-1) / resampled.shape[-1]
+    above = np.count_nonzero(resampled >= 0, axis=-1) / resampled.shape[-1]
+    p_values = np.minimum(2 * np.minimum(below, above), 1.0)
+    n_metrics = len(boot['metrics'])
+    confs = np.asarray(boot['confs'], dtype=object)
+    return pd.DataFrame({
+        'conf_a': np.repeat(confs[a], n_metrics),
+        'conf_b': np.repeat(confs[b], n_metrics),
+        'metric': np.tile(boot['metrics'], len(a)),
+        'difference': (boot['observed'][a] - boot['observed'][b]).ravel(),
+        'ci_low': low.ravel(),
+        'ci_high': high.ravel(),
+        'p_value': p_values.ravel(),
+        'p_value_holm': (_holm(p_values) if len(a) else p_values).ravel(),
+    })
+
+
+def bootstrap_statistics(
+        details: pd.DataFrame,
+        metrics: list = None,
+        n_resamples: int = DEFAULT_RESAMPLES,
+        confidence: float = 0.95,
+        seed: int = 0) -> (pd.DataFrame, pd.DataFrame):
+    """
+    Confidence intervals per conf and pairwise conf differences of every metric from one set of resamples.
+
+    Returns:
+    tuple (intervals, differences), see confidence_intervals and pairwise_differences
+    """
+    boot = bootstrap_means(details, metrics, n_resamples, seed)
+    return confidence_intervals(boot, confidence), pairwise_differences(boot, confidence)
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Bootstrap confidence intervals and conf differences of the final results.")
+    parser.add_argument("details", nargs="?", default=DEFAULT_DETAILS_PATH, help="final_results_details.csv")
+    parser.add_argument("--metrics", nargs="*", default=None, help="metric columns (default: all)")
+    parser.add_argument("--resamples", type=int, default=DEFAULT_RESAMPLES, help="bootstrap resamples")
+    parser.add_argument("--confidence", type=float, default=0.95, help="coverage of the intervals")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--output-dir", default=None,
+                        help="write final_results_ci.csv and final_results_differences.csv to this directory")
+    args = parser.parse_args(argv)
+
+    details = pd.read_csv(args.details)
+    t0 = time.perf_counter()
+    intervals, differences = bootstrap_statistics(details, args.metrics, args.resamples, args.confidence, args.seed)
+    elapsed = time.perf_counter() - t0
+
+    with pd.option_context('display.width', 200, 'display.max_rows', None):
+        print(intervals.to_string(index=False))
+        print()
+        print(differences.to_string(index=False))
+    print(f"\n{args.resamples} resamples of {len(details)} runs in {intervals['conf'].nunique()} confs "
+          f"and {intervals['metric'].nunique()} metrics in {elapsed:.3f} s")
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+        intervals.to_csv(os.path.join(args.output_dir, "final_results_ci.csv"), index=False)
+        differences.to_csv(os.path.join(args.output_dir, "final_results_differences.csv"), index=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
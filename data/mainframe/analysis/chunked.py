@@ -0,0 +1,520 @@
+### Chunked (out-of-core) analysis of long Tapo power logs with mergeable partial aggregates
+#
+# Usage (from data/mainframe/analysis):
+#   python chunked.py path/to/power.csv                                   # baseline and surges
+#   python chunked.py path/to/power-run1.xls --steps path/to/run1.dat --chunk-size 50000
+#
+# The power log (CSV or .xls export, a PowerSeries directory, or a DataFrame/PowerSeries) is read in blocks of
+# chunk_size samples; Energy(kWh) is derived across block boundaries exactly as get_power_data does for the whole
+# file. Every block is folded into small aggregates (BaselineAggregate, SurgeAggregate, PeriodAggregate) that can
+# also be computed per block in parallel and merged in order, so memory is bounded by the block size rather than
+# the length of the log.
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.api import guess_datetime_format
+
+from analysis_functions import segment_reduce
+from power_series import PowerSeries, to_epoch_ns
+
+DEFAULT_CHUNK_SIZE = 100_000
+_NO_TIME = np.iinfo(np.int64).min
+_END_OF_TIME = np.iinfo(np.int64).max
+
+
+def _clean_chunk(raw: pd.DataFrame, previous_ns, date_format: str = None) -> (PowerSeries, int):
+    # get_power_data for one block: parse dates, drop non-numeric power, energy from the interval since the
+    # previous valid sample (carried over from the previous block; the very first sample has none and is dropped)
+    power = pd.to_numeric(raw['Power(W)'], errors='coerce')
+    valid = power.notna().to_numpy()
+    dates = np.asarray(pd.to_datetime(raw.iloc[:, 0], format=date_format).to_numpy()[valid], dtype='datetime64[ns]').view(np.int64)
+    power = power.to_numpy(dtype=np.float64)[valid]
+    if len(dates) == 0:
+        return None, previous_ns
+    last_ns = int(dates[-1])
+    if previous_ns is None:
+        previous_ns, dates, power = int(dates[0]), dates[1:], power[1:]
+        if len(dates) == 0:
+            return None, last_ns
+    energy = power / 1000 * (np.diff(dates, prepend=np.int64(previous_ns)) / 1e9 / 3600)
+    return PowerSeries.from_arrays(dates, power, energy=energy, origin=previous_ns), last_ns
+
+
+def _raw_blocks(source, chunk_size: int):
+    # blocks of the raw export (first column: timestamp, plus Power(W)), before cleaning
+    if isinstance(source, pd.DataFrame):
+        for lo in range(0, len(source), chunk_size):
+            yield source.iloc[lo:lo + chunk_size]
+    elif str(source).lower().endswith('.csv'):
+        yield from pd.read_csv(source, chunksize=chunk_size)
+    elif str(source).lower().endswith('.xls'):
+        # xlrd parses the whole workbook (an .xls holds at most 65535 rows); only the DataFrames are built per block
+        import xlrd
+
+        book = xlrd.open_workbook(source, on_demand=True)
+        try:
+            sheet = book.sheet_by_index(0)
+            header = [str(v) for v in sheet.row_values(0)]
+            for lo in range(1, sheet.nrows, chunk_size):
+                rows = [[xlrd.xldate_as_datetime(c.value, book.datemode) if c.ctype == xlrd.XL_CELL_DATE else c.value
+                         for c in sheet.row(r)] for r in range(lo, min(lo + chunk_size, sheet.nrows))]
+                yield pd.DataFrame(rows, columns=header)
+        finally:
+            book.release_resources()
+    else:
+        raise ValueError(f"Unsupported power data source {source!r}, expected a .csv or .xls file")
+
+
+def iter_power_chunks(source, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """
+    Yield the cleaned power data of source in blocks of (at most) chunk_size samples.
+
+    Parameters:
+    source: Path to a Tapo .xls export or a CSV with the same columns (timestamp first, Power(W)), a directory
+        written by PowerSeries.save (memory-mapped), a PowerSeries, or a raw DataFrame as read from an export
+    chunk_size (int): Samples per block
+
+    Returns:
+    iterator of compact PowerSeries; together they hold the same samples as get_power_data(source)
+    """
+    if isinstance(source, (str, os.PathLike)) and os.path.isdir(source):
+        source = PowerSeries.open(source)
+    if isinstance(source, PowerSeries):
+        for lo in range(0, len(source), chunk_size):
+            yield source.slice(lo, lo + chunk_size)
+        return
+    previous_ns = None
+    date_format = None
+    for raw in _raw_blocks(source, chunk_size):
+        if date_format is None and len(raw) and isinstance(raw.iloc[0, 0], str):
+            # like pd.to_datetime on the whole column: the format is guessed from its first element
+            date_format = guess_datetime_format(raw.iloc[0, 0])
+        chunk, previous_ns = _clean_chunk(raw, previous_ns, date_format)
+        if chunk is not None:
+            yield chunk
+
+
+def _percentile_from_counts(values: np.ndarray, counts: np.ndarray, percentile: float) -> float:
+    # np.percentile (linear interpolation) of the multiset in which values[i] occurs counts[i] times
+    cumulative = np.cumsum(counts)
+    virtual = (cumulative[-1] - 1) * (percentile / 100)
+    below = np.floor(virtual)
+    t = virtual - below
+    a = values[np.searchsorted(cumulative, below, side='right')]
+    b = values[np.searchsorted(cumulative, min(below + 1, cumulative[-1] - 1), side='right')]
+    # same lerp as numpy, for identical thresholds
+    return b - (b - a) * (1 - t) if t >= 0.5 else a + (b - a) * t
+
+
+class BaselineAggregate:
+    """
+    Mergeable input of compute_baseline_stats: sample count and energy sum per distinct power value.
+
+    Tapo plugs report whole watts, so the table stays small however long the log is; power with many distinct
+    (non-integer) values makes it grow accordingly.
+    """
+
+    def __init__(self):
+        self.values = np.empty(0, dtype=np.float64)
+        self.counts = np.empty(0, dtype=np.int64)
+        self.energy = np.empty(0, dtype=np.float64)
+
+    def update(self, chunk: PowerSeries) -> 'BaselineAggregate':
+        values, inverse, counts = np.unique(np.asarray(chunk.power, dtype=np.float64), return_inverse=True, return_counts=True)
+        return self._add(values, counts, np.bincount(inverse, weights=chunk.energy, minlength=len(values)))
+
+    def merge(self, other: 'BaselineAggregate') -> 'BaselineAggregate':
+        return self._add(other.values, other.counts, other.energy)
+
+    def _add(self, values, counts, energy):
+        merged, inverse = np.unique(np.concatenate([self.values, values]), return_inverse=True)
+        self.counts = np.bincount(inverse, weights=np.concatenate([self.counts, counts]), minlength=len(merged)).astype(np.int64)
+        self.energy = np.bincount(inverse, weights=np.concatenate([self.energy, energy]), minlength=len(merged))
+        self.values = merged
+        return self
+
+    def result(self, percentile_threshold: float = 70.0) -> dict:
+        """
+        Baseline statistics with the keys and meaning of compute_baseline_stats.
+        """
+        total = int(self.counts.sum())
+        threshold = _percentile_from_counts(self.values, self.counts, percentile_threshold)
+        selected = self.values <= threshold
+        values, counts = self.values[selected], self.counts[selected]
+        n = int(counts.sum())
+        mean = np.sum(values * counts) / n
+        middle = [(n - 1) // 2, n // 2]
+        median = np.mean(values[np.searchsorted(np.cumsum(counts), middle, side='right')])
+        return {
+            'threshold_power': threshold,
+            'baseline_periods': n,
+            'total_periods': total,
+            'baseline_percentage': n / total * 100,
+            'mean_power': mean,
+            'median_power': median,
+            'std_power': np.sqrt(np.sum(counts * (values - mean) ** 2) / (n - 1)) if n > 1 else np.nan,
+            'min_power': values[0],
+            'max_power': values[-1],
+            'mean_energy': self.energy[selected].sum() / n,
+            'total_baseline_energy': self.energy[selected].sum(),
+        }
+
+
+def _run(start, end, count, power_sum, power_max, power_min, energy_sum) -> dict:
+    return {'start': start, 'end': end, 'count': count, 'power_sum': power_sum,
+            'power_max': power_max, 'power_min': power_min, 'energy_sum': energy_sum}
+
+
+def _join(a: dict, b: dict) -> dict:
+    # run a immediately followed by run b (either may be None)
+    if a is None or b is None:
+        return a if b is None else b
+    return _run(a['start'], b['end'], a['count'] + b['count'], a['power_sum'] + b['power_sum'],
+                max(a['power_max'], b['power_max']), min(a['power_min'], b['power_min']), a['energy_sum'] + b['energy_sum'])
+
+
+class SurgeAggregate:
+    """
+    Mergeable surge detection (detect_power_surges) for a fixed surge threshold.
+
+    A partial over consecutive samples keeps the run of surge samples touching its first sample (head), the
+    closed runs inside it and the run touching its last sample (tail); merging joins the left tail to the right
+    head. Partials must be merged in time order.
+
+    Parameters:
+    surge_threshold (float): Power above which a sample belongs to a surge (baseline mean power x multiplier)
+    """
+
+    def __init__(self, surge_threshold: float):
+        self.surge_threshold = surge_threshold
+        self.samples = 0
+        self.head = None
+        self.closed = []
+        self.tail = None
+
+    def update(self, chunk: PowerSeries) -> 'SurgeAggregate':
+        return self.merge(SurgeAggregate(self.surge_threshold)._fill(chunk))
+
+    def _fill(self, chunk: PowerSeries) -> 'SurgeAggregate':
+        power = np.asarray(chunk.power, dtype=np.float64)
+        energy = np.asarray(chunk.energy, dtype=np.float64)
+        n = len(power)
+        self.samples = n
+        mask = power > self.surge_threshold
+        edges = np.diff(mask.astype(np.int8), prepend=np.int8(0), append=np.int8(0))
+        starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1) - 1
+        if len(starts) == 0:
+            return self
+        stats = zip(starts, ends, ends - starts + 1,
+                    segment_reduce(np.add, power, starts, ends), segment_reduce(np.maximum, power, starts, ends),
+                    segment_reduce(np.minimum, power, starts, ends), segment_reduce(np.add, energy, starts, ends))
+        runs = [_run(int(chunk.dates[s]), int(chunk.dates[e]), int(c), ps, pmax, pmin, es)
+                for s, e, c, ps, pmax, pmin, es in stats]
+        if starts[0] == 0:
+            self.head = runs.pop(0)
+        if runs and ends[-1] == n - 1:
+            self.tail = runs.pop()
+        elif self.head is not None and ends[-1] == n - 1:
+            # one run over the whole chunk: head and tail at once
+            self.tail = self.head
+        self.closed = runs
+        return self
+
+    @property
+    def _full(self) -> bool:
+        return self.head is not None and self.head is self.tail
+
+    def merge(self, other: 'SurgeAggregate') -> 'SurgeAggregate':
+        """
+        Fold in the partial of the samples that directly follow this one.
+        """
+        if other.samples == 0:
+            return self
+        if self.samples == 0:
+            self.samples, self.head, self.closed, self.tail = other.samples, other.head, list(other.closed), other.tail
+            return self
+        left_full, right_full = self._full, other._full
+        joined = _join(self.tail, other.head)
+        if left_full and right_full:
+            self.head = self.tail = joined
+        elif left_full:
+            self.head, self.closed, self.tail = joined, list(other.closed), other.tail
+        elif right_full:
+            self.tail = joined
+        else:
+            self.closed = self.closed + ([joined] if joined is not None else []) + other.closed
+            self.tail = other.tail
+        self.samples += other.samples
+        return self
+
+    def result(self, baseline_stats: dict, min_duration_minutes: float = 10) -> list:
+        """
+        Surge periods with the entries of detect_power_surges (except surge_data). As there, a surge still
+        going on at the end of the data is not reported.
+        """
+        runs = ([self.head] if self.head is not None and not self._full else []) + self.closed
+        surge_periods = []
+        for run in runs:
+            duration = (run['end'] - run['start']) / 1e9 / 60
+            if duration < min_duration_minutes:
+                continue
+            surge_periods.append({
+                'start_time': pd.Timestamp(run['start']),
+                'end_time': pd.Timestamp(run['end']),
+                'duration_minutes': float(duration),
+                'peak_power': run['power_max'],
+                'avg_power': run['power_sum'] / run['count'],
+                'min_power': run['power_min'],
+                'total_energy': run['energy_sum'],
+                'data_points': run['count'],
+                'avg_energy_per_point': run['energy_sum'] / run['count'],
+                'energy_above_baseline': run['energy_sum'] - run['count'] * baseline_stats['mean_energy'],
+            })
+        return surge_periods
+
+
+class PeriodAggregate:
+    """
+    Mergeable per-period statistics for divide_power_data_into_step_periods / compute_relative_energy_usage:
+    sample count, energy and power sums and extrema inside every (name, start, end) period, plus the last sample
+    inside it and the neighbouring samples before and after it (needed to pro-rate the last step).
+
+    Parameters:
+    time_periods (list): Tuples (step_name, start_time, stop_time), see get_time_periods
+    """
+
+    def __init__(self, time_periods: list):
+        self.time_periods = list(time_periods)
+        self.starts = to_epoch_ns([p[1] for p in self.time_periods])
+        self.ends = to_epoch_ns([p[2] for p in self.time_periods])
+        n = len(self.time_periods)
+        self.count = np.zeros(n, dtype=np.int64)
+        self.energy = np.zeros(n)
+        self.power = np.zeros(n)
+        self.power_max = np.full(n, -np.inf)
+        self.power_min = np.full(n, np.inf)
+        self.last = {'date': np.full(n, _NO_TIME), 'power': np.zeros(n), 'energy': np.zeros(n)}
+        self.before = np.full(n, _NO_TIME)
+        self.after = {'date': np.full(n, _END_OF_TIME), 'power': np.zeros(n), 'energy': np.zeros(n)}
+
+    def update(self, chunk: PowerSeries) -> 'PeriodAggregate':
+        if len(chunk) == 0:
+            return self
+        partial = PeriodAggregate(self.time_periods)
+        lo = np.searchsorted(chunk.dates, self.starts, side='left')
+        hi = np.maximum(np.searchsorted(chunk.dates, self.ends, side='right'), lo)
+        stats = chunk.range_index.query_positions(lo, hi)
+        power, energy = np.asarray(chunk.power, dtype=np.float64), np.asarray(chunk.energy, dtype=np.float64)
+        partial.count = stats['count']
+        partial.energy = stats['total_energy']
+        partial.power = stats['total_power']
+        inside = partial.count > 0
+        partial.power_max = np.where(inside, stats['max_power'], -np.inf)
+        partial.power_min = np.where(inside, stats['min_power'], np.inf)
+        last = np.maximum(hi - 1, 0)
+        partial.last = {'date': np.where(inside, chunk.dates[last], _NO_TIME),
+                        'power': power[last], 'energy': energy[last]}
+        partial.before = np.where(lo > 0, chunk.dates[np.maximum(lo - 1, 0)], _NO_TIME)
+        after = np.minimum(hi, len(chunk) - 1)
+        partial.after = {'date': np.where(hi < len(chunk), chunk.dates[after], _END_OF_TIME),
+                         'power': power[after], 'energy': energy[after]}
+        return self.merge(partial)
+
+    def merge(self, other: 'PeriodAggregate') -> 'PeriodAggregate':
+        """
+        Fold in a partial over other samples (in any order; the samples must not overlap).
+        """
+        self.count = self.count + other.count
+        self.energy = self.energy + other.energy
+        self.power = self.power + other.power
+        self.power_max = np.maximum(self.power_max, other.power_max)
+        self.power_min = np.minimum(self.power_min, other.power_min)
+        later = other.last['date'] > self.last['date']
+        self.last = {k: np.where(later, other.last[k], v) for k, v in self.last.items()}
+        self.before = np.maximum(self.before, other.before)
+        earlier = other.after['date'] < self.after['date']
+        self.after = {k: np.where(earlier, other.after[k], v) for k, v in self.after.items()}
+        return self
+
+    def stats(self) -> pd.DataFrame:
+        """
+        Per period: step, start, stop, data_points, total_energy, avg_power, max_power, min_power (as compute_energy_stats).
+        """
+        inside = self.count > 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            avg_power = np.where(inside, self.power / self.count, np.nan)
+        return pd.DataFrame({
+            'step': [p[0] for p in self.time_periods],
+            'start': [p[1] for p in self.time_periods],
+            'stop': [p[2] for p in self.time_periods],
+            'data_points': self.count,
+            'total_energy': self.energy,
+            'avg_power': avg_power,
+            'max_power': np.where(inside, self.power_max, np.nan),
+            'min_power': np.where(inside, self.power_min, np.nan),
+        })
+
+    def relative_energy_usage(self, baseline_stats: dict = None) -> (pd.DataFrame, float, float, float):
+        """
+        Same result as compute_relative_energy_usage(divide_power_data_into_step_periods(time_periods, power_data),
+        time_periods, baseline_stats) on the whole log: the first period is the baseline segment and the last one is
+        pro-rated at its end.
+        """
+        n = len(self.time_periods)
+        # rows of every segment, and energy sum and number of rows with a (non-NaN) energy, as pandas sums skip NaN
+        segment_rows = self.count.copy()
+        segment_energy = self.energy.copy()
+        segment_valid = self.count.copy()
+        # baseline energy of divide_power_data_into_step_periods, set by a period named 'baseline'
+        divide_baseline_energy = 0
+        for i, (name, _, _) in enumerate(self.time_periods):
+            if name == 'baseline':
+                divide_baseline_energy = self.energy[i] / self.count[i] if self.count[i] else np.nan
+        if n:
+            i = n - 1
+            after = self.after['date'][i]
+            t2 = np.nan if after == _END_OF_TIME else float(after)
+            if self.count[i] > 0:
+                # last sample moved to the period end, its energy scaled by the part of its interval before the end
+                t1 = float(self.last['date'][i])
+                d1, d2 = self.ends[i] - t1, t2 - self.ends[i]
+                last_energy = self.last['energy'][i] * (d2 / (d1 + d2))
+                segment_energy[i] -= self.last['energy'][i]
+            else:
+                # one sample at the period end, interpolated from the first sample after it
+                before = self.before[i]
+                t1 = np.nan if before == _NO_TIME else float(before)
+                fraction = (self.ends[i] - self.starts[i]) / (t2 - t1)
+                e2 = self.after['energy'][i] if after != _END_OF_TIME else 0
+                last_energy = (e2 - divide_baseline_energy) * fraction + divide_baseline_energy
+                segment_rows[i] = 1
+                segment_valid[i] = 1
+            if np.isnan(last_energy):
+                segment_valid[i] -= 1
+            else:
+                segment_energy[i] += last_energy
+
+        # compute_relative_energy_usage: the first segment is the baseline (an empty one leaves it at 0)
+        baseline_energy = 0
+        if n and segment_rows[0] > 0:
+            baseline_energy = segment_energy[0] / segment_valid[0] if segment_valid[0] else np.nan
+        if baseline_stats is not None:
+            baseline_energy = baseline_stats['mean_energy']
+        rows = []
+        for i in range(1, n):
+            if segment_rows[i] == 0:
+                continue
+            step, start, stop = self.time_periods[i]
+            rows.append({"step": step, "start": start, "stop": stop,
+                         "duration": (pd.to_datetime(stop) - pd.to_datetime(start)).total_seconds(),
+                         "energy(kWh)": segment_energy[i] - segment_valid[i] * baseline_energy,
+                         "absolute_energy(kWh)": segment_energy[i]})
+        outdf = pd.DataFrame(rows, columns=["step", "start", "stop", "duration", "energy(kWh)", "absolute_energy(kWh)"])
+        total_absolute_energy = sum(row["absolute_energy(kWh)"] for row in rows)
+        total_relative_energy = sum(row["energy(kWh)"] for row in rows)
+        return outdf, baseline_energy, total_absolute_energy, total_relative_energy
+
+
+def analyze_chunked(
+        source,
+        time_periods: list = None,
+        percentile_threshold: float = 70.0,
+        surge_threshold_multiplier: float = 1.2,
+        min_duration_minutes: float = 10,
+        chunk_size: int = DEFAULT_CHUNK_SIZE) -> dict:
+    """
+    Baseline, surges and (optionally) per-step energy of a power log, in two passes over its blocks.
+
+    The first pass builds the baseline and per-period aggregates, the second one detects surges against the
+    baseline threshold. Only one block and the aggregates are in memory at a time.
+
+    Parameters:
+    source: Power log, see iter_power_chunks
+    time_periods (list): Optional step periods, see get_time_periods
+    percentile_threshold, surge_threshold_multiplier, min_duration_minutes: As for compute_baseline_stats and
+        detect_power_surges
+    chunk_size (int): Samples per block
+
+    Returns:
+    dict with samples, baseline_stats, surge_threshold, surge_periods and, with time_periods, period_stats
+    (see PeriodAggregate.stats), steps, baseline_energy, total_absolute_energy and total_relative_energy
+    """
+    baseline = BaselineAggregate()
+    periods = PeriodAggregate(time_periods) if time_periods else None
+    samples = 0
+    for chunk in iter_power_chunks(source, chunk_size):
+        samples += len(chunk)
+        baseline.update(chunk)
+        if periods is not None:
+            periods.update(chunk)
+    if samples == 0:
+        raise ValueError(f"No power data in {source!r}")
+    baseline_stats = baseline.result(percentile_threshold)
+
+    surge_threshold = baseline_stats['mean_power'] * surge_threshold_multiplier
+    surges = SurgeAggregate(surge_threshold)
+    for chunk in iter_power_chunks(source, chunk_size):
+        surges.update(chunk)
+
+    result = {
+        'samples': samples,
+        'baseline_stats': baseline_stats,
+        'surge_threshold': surge_threshold,
+        'surge_periods': surges.result(baseline_stats, min_duration_minutes),
+    }
+    if periods is not None:
+        steps, baseline_energy, total_absolute_energy, total_relative_energy = periods.relative_energy_usage(baseline_stats)
+        result.update(period_stats=periods.stats(), steps=steps, baseline_energy=baseline_energy,
+                      total_absolute_energy=total_absolute_energy, total_relative_energy=total_relative_energy)
+    return result
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Analyse a long Tapo power log in bounded memory.")
+    parser.add_argument("source", help="Tapo .xls export, CSV with the same columns, or PowerSeries directory")
+    parser.add_argument("--steps", default=None, help="CarbonTracker/SIMPIPE runN.dat with the steps to attribute energy to")
+    parser.add_argument("--simpipe-datetime-shift", type=float, default=0, help="shift of the step times in minutes")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="samples per block")
+    parser.add_argument("--percentile-threshold", type=float, default=70, help="baseline percentile threshold")
+    parser.add_argument("--surge-threshold-multiplier", type=float, default=1.2, help="surge threshold relative to baseline mean")
+    parser.add_argument("--min-duration-minutes", type=float, default=10, help="minimum surge duration")
+    args = parser.parse_args(argv)
+
+    time_periods = None
+    if args.steps:
+        from analysis_functions import get_time_periods
+        from batch_analysis import read_simpipe_data, shift_simpipe_data
+        from instrumentation import recording
+
+        with recording(echo=False):
+            time_periods = get_time_periods(shift_simpipe_data(read_simpipe_data(args.steps), args.simpipe_datetime_shift))
+
+    t0 = time.perf_counter()
+    result = analyze_chunked(
+        args.source, time_periods, percentile_threshold=args.percentile_threshold,
+        surge_threshold_multiplier=args.surge_threshold_multiplier, min_duration_minutes=args.min_duration_minutes,
+        chunk_size=args.chunk_size)
+    elapsed = time.perf_counter() - t0
+
+    stats = result['baseline_stats']
+    print(f"Samples: {result['samples']}")
+    print(f"Baseline: threshold {stats['threshold_power']:.1f} W, mean {stats['mean_power']:.1f} W, "
+          f"{stats['baseline_periods']} of {stats['total_periods']} samples, mean energy {stats['mean_energy']:.6f} kWh")
+    print(f"Surges above {result['surge_threshold']:.1f} W: {len(result['surge_periods'])}")
+    for surge in result['surge_periods']:
+        print(f"  {surge['start_time']} - {surge['end_time']}  {surge['duration_minutes']:8.1f} min  "
+              f"peak {surge['peak_power']:.1f} W  {surge['energy_above_baseline']:.4f} kWh above baseline")
+    if time_periods:
+        print(result['steps'].to_string(index=False))
+        print(f"Total absolute energy consumption (kWh): {result['total_absolute_energy']}")
+        print(f"Total relative energy consumption (kWh): {result['total_relative_energy']}")
+    print(f"\nAnalysed in {elapsed:.2f} s with blocks of {args.chunk_size} samples")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
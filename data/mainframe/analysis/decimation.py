@@ -0,0 +1,112 @@
+### Peak-preserving downsampling of time series for plotting (min/max bucketing and LTTB)
+import numpy as np
+
+from power_series import to_epoch_ns
+
+
+def _as_numeric(x) -> np.ndarray:
+    x = np.asarray(x)
+    if x.dtype.kind in 'mM':
+        return x.astype(f'{x.dtype.kind}8[ns]').view(np.int64).astype(np.float64)
+    if x.dtype.kind == 'O':
+        return to_epoch_ns(x).astype(np.float64)
+    return x.astype(np.float64)
+
+
+def _bucket_edges(x: np.ndarray, n_buckets: int) -> np.ndarray:
+    # equal-width buckets in x (i.e. one per pixel column), as index boundaries; empty buckets collapse
+    edges = np.searchsorted(x, np.linspace(x[0], x[-1], n_buckets + 1), side='left')
+    edges[-1] = len(x)
+    return np.unique(edges)
+
+
+def minmax_indices(x, y, n_buckets: int) -> np.ndarray:
+    """
+    Indices of the minimum and maximum sample of every x bucket, plus the first and last sample.
+
+    Every peak and dip survives, so a line drawn through the kept points looks the same as the full
+    series when there is at least one bucket per pixel column.
+
+    Parameters:
+    x: Sorted x values (numbers or datetimes)
+    y: y values
+    n_buckets (int): Number of equal-width x buckets (at most 2 * n_buckets + 2 points are kept)
+
+    Returns:
+    np.ndarray of sorted, unique indices into x/y
+    """
+    x, y = _as_numeric(x), np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n <= 2 * n_buckets + 2:
+        return np.arange(n)
+    edges = _bucket_edges(x, n_buckets)
+    counts = np.diff(edges)
+    bucket = np.repeat(np.arange(len(counts)), counts)
+    # sort by (bucket, y): the first element of each bucket is its argmin, the last its argmax
+    order = np.lexsort((y, bucket))
+    return np.unique(np.concatenate([[0, n - 1], order[edges[:-1]], order[edges[1:] - 1]]))
+
+
+def lttb_indices(x, y, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: indices of n_out samples that keep the visual shape of the series.
+
+    The first and last samples are always kept; from each of the n_out - 2 buckets in between, the sample forming
+    the largest triangle with the previously kept sample and the mean of the next bucket is kept.
+
+    Parameters:
+    x: Sorted x values (numbers or datetimes)
+    y: y values
+    n_out (int): Number of samples to keep (at least 3)
+
+    Returns:
+    np.ndarray of sorted indices into x/y
+    """
+    x, y = _as_numeric(x), np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    # bucket boundaries over the samples between the fixed first and last point
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    # mean of every bucket, for the "next bucket" vertex of the triangles
+    csum_x = np.concatenate([[0.0], np.cumsum(x)])
+    csum_y = np.concatenate([[0.0], np.cumsum(y)])
+    sizes = np.maximum(np.diff(edges), 1)
+    mean_x = np.append((csum_x[edges[1:]] - csum_x[edges[:-1]]) / sizes, x[-1])
+    mean_y = np.append((csum_y[edges[1:]] - csum_y[edges[:-1]]) / sizes, y[-1])
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for b in range(n_out - 2):
+        lo, hi = edges[b], max(edges[b + 1], edges[b] + 1)
+        ax, ay = x[previous], y[previous]
+        area = np.abs((ax - mean_x[b + 1]) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (mean_y[b + 1] - ay))
+        previous = lo + int(np.argmax(area))
+        selected[b + 1] = previous
+    return selected
+
+
+def decimate_indices(x, y, max_points: int, method: str = 'minmax') -> np.ndarray:
+    """
+    Indices of at most max_points samples to draw (all samples if there are not more than that).
+
+    Parameters:
+    x, y: Series to downsample
+    max_points (int): Point budget, e.g. from pixel_budget
+    method (str): 'minmax' (keeps every extreme) or 'lttb' (keeps the shape)
+    """
+    if max_points is None or max_points <= 0 or len(y) <= max_points:
+        return np.arange(len(y))
+    if method == 'minmax':
+        return minmax_indices(x, y, max(1, (max_points - 2) // 2))
+    if method == 'lttb':
+        return lttb_indices(x, y, max_points)
+    raise ValueError(f"Unknown decimation method '{method}', expected 'minmax' or 'lttb'")
+
+
+def pixel_budget(ax, points_per_pixel: float = 2) -> int:
+    """
+    Number of points worth drawing on a matplotlib Axes: points_per_pixel per horizontal pixel.
+    """
+    return int(ax.get_window_extent().width * points_per_pixel)
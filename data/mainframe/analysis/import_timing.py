@@ -0,0 +1,78 @@
+### Import-time measurement of the analysis modules, each sample in a fresh interpreter (like a new pool worker)
+#
+# Usage (from data/mainframe/analysis):
+#   python import_timing.py                                   # analysis_functions, plotting, batch_analysis, ...
+#   python import_timing.py analysis_functions --repeat 10 --output import_times.csv
+import argparse
+import csv
+import datetime
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+ANALYSIS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MODULES = ["analysis_functions", "plotting", "batch_analysis", "power_model"]
+HEAVY_MODULES = ["pandas", "matplotlib"]
+
+_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t0
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure_import_time(module: str, repeat: int = 5, python: str = sys.executable) -> dict:
+    """
+    Time `import module` in repeat fresh interpreters started in the analysis directory.
+
+    Returns:
+    dict with module, median_ms, min_ms, max_ms and loaded (which of pandas/matplotlib the import pulled in)
+    """
+    samples = []
+    loaded = []
+    for _ in range(repeat):
+        result = subprocess.run(
+            [python, "-c", _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+            cwd=ANALYSIS_DIR, capture_output=True, text=True, check=True)
+        probe = json.loads(result.stdout.strip().splitlines()[-1])
+        samples.append(probe["seconds"] * 1000)
+        loaded = probe["loaded"]
+    return {
+        "module": module,
+        "median_ms": float(np.median(samples)),
+        "min_ms": float(np.min(samples)),
+        "max_ms": float(np.max(samples)),
+        "loaded": " ".join(loaded),
+    }
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Measure the import time of analysis modules in fresh interpreters.")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES, help="modules to import")
+    parser.add_argument("--repeat", type=int, default=5, help="interpreters per module")
+    parser.add_argument("--output", default=None, help="append the results to this CSV to track them over time")
+    args = parser.parse_args(argv)
+
+    results = [measure_import_time(module, args.repeat) for module in args.modules]
+    for r in results:
+        print(f"{r['module']:<20} median {r['median_ms']:8.1f} ms  (min {r['min_ms']:.1f}, max {r['max_ms']:.1f})  loads: {r['loaded'] or '-'}")
+
+    if args.output:
+        new_file = not os.path.exists(args.output)
+        timestamp = datetime.datetime.now().isoformat(timespec="seconds")
+        with open(args.output, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=["timestamp", "python", "module", "median_ms", "min_ms", "max_ms", "loaded"])
+            if new_file:
+                writer.writeheader()
+            for r in results:
+                writer.writerow({"timestamp": timestamp, "python": sys.version.split()[0], **r})
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
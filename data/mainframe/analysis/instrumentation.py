@@ -0,0 +1,233 @@
+### Structured timing spans and progress messages for the analysis chain
+#
+# The analysis functions report progress with message() and time themselves with @timed. Records go to the
+# registered sinks (JsonLinesSink, MemorySink or any callable taking a dict); messages are also printed to stdout
+# while echo is on (the default, so notebooks show the same output as before). With no sink and echo off,
+# a timed call costs one extra function call and a message() call returns immediately.
+import functools
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+
+_sinks = []
+_echo = True
+_stack = []
+
+
+def add_sink(sink):
+    """
+    Register a sink: a callable that receives every record (dict).
+    """
+    _sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    if sink in _sinks:
+        _sinks.remove(sink)
+
+
+def set_echo(echo: bool) -> bool:
+    """
+    Print messages to stdout (True, default) or not. Returns the previous setting.
+    """
+    global _echo
+    previous, _echo = _echo, bool(echo)
+    return previous
+
+
+class recording:
+    """
+    Context manager that registers sinks (and optionally sets echo) for the duration of a block.
+
+        sink = MemorySink()
+        with recording(sink, echo=False):
+            divide_power_data_into_step_periods(time_periods, power_data)
+        sink.to_dataframe()
+    """
+
+    def __init__(self, *sinks, echo: bool = None):
+        self.sinks = sinks
+        self.echo = echo
+        self._previous_echo = None
+
+    def __enter__(self):
+        for sink in self.sinks:
+            add_sink(sink)
+        if self.echo is not None:
+            self._previous_echo = set_echo(self.echo)
+        return self.sinks[0] if len(self.sinks) == 1 else self.sinks
+
+    def __exit__(self, *exc):
+        for sink in self.sinks:
+            remove_sink(sink)
+        if self.echo is not None:
+            set_echo(self._previous_echo)
+        return False
+
+
+def _emit(record: dict):
+    for sink in _sinks:
+        sink(record)
+
+
+def message(text: str, *args, level: str = 'info'):
+    """
+    Progress message in place of print: text is %-formatted with args only if it is echoed or recorded.
+    """
+    if not _echo and not _sinks:
+        return
+    if args:
+        text = text % args
+    if _echo:
+        print(text)
+    text = text.strip()
+    if _sinks and text:
+        _emit({'type': 'message', 'level': level, 'stage': _stack[-1].name if _stack else None,
+               'message': text, 'time': time.time()})
+
+
+class Span:
+    """
+    A timed stage. Emitted on exit as a record with name, parent, start (epoch s), seconds, error and its fields.
+    """
+    __slots__ = ('name', 'fields', 'parent', 'start', '_t0')
+
+    def __init__(self, name: str, fields: dict):
+        self.name = name
+        self.fields = fields
+        self.parent = None
+        self.start = None
+        self._t0 = None
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def add(self, **counts):
+        for key, value in counts.items():
+            self.fields[key] = self.fields.get(key, 0) + value
+
+    def __enter__(self):
+        self.parent = _stack[-1].name if _stack else None
+        _stack.append(self)
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self._t0
+        _stack.pop()
+        _emit({'type': 'span', 'name': self.name, 'parent': self.parent, 'start': self.start, 'seconds': seconds,
+               'error': exc_type.__name__ if exc_type else None, **self.fields})
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def set(self, **fields):
+        pass
+
+    def add(self, **counts):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name: str, **fields):
+    """
+    Context manager timing a block; a shared no-op object when no sink is registered.
+    """
+    return Span(name, fields) if _sinks else _NO_SPAN
+
+
+def timed(func=None, *, name: str = None):
+    """
+    Decorator recording every call of a function as a span (named after the function).
+    """
+    if func is None:
+        return functools.partial(timed, name=name)
+    span_name = name or func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _sinks:
+            return func(*args, **kwargs)
+        with Span(span_name, {}):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def annotate(**fields):
+    """Set fields (e.g. rows=...) on the innermost active span; no-op when nothing is recorded."""
+    if _stack:
+        _stack[-1].set(**fields)
+
+
+def count(**counts):
+    """Add to counters on the innermost active span; no-op when nothing is recorded."""
+    if _stack:
+        _stack[-1].add(**counts)
+
+
+def count_frame(df, rows: str = 'rows', nbytes: str = 'bytes'):
+    """
+    Add the rows and (shallow) memory size of a DataFrame (or PowerSeries) processed by the innermost active span.
+    """
+    if _stack and df is not None:
+        size = df.nbytes if hasattr(df, 'nbytes') else df.memory_usage(index=True, deep=False).sum()
+        _stack[-1].add(**{rows: len(df), nbytes: int(size)})
+
+
+class MemorySink:
+    """
+    Collects records in a list (records); to_dataframe() tabulates the spans (or messages).
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def __call__(self, record: dict):
+        self.records.append(record)
+
+    def clear(self):
+        self.records = []
+
+    def to_dataframe(self, record_type: str = 'span') -> pd.DataFrame:
+        return pd.DataFrame([r for r in self.records if r.get('type') == record_type])
+
+
+class JsonLinesSink:
+    """
+    Writes every record as one JSON line to a path (appending) or an open text stream.
+    """
+
+    def __init__(self, target=sys.stderr):
+        self._owned = isinstance(target, (str, os.PathLike))
+        self.stream = open(target, 'a') if self._owned else target
+
+    def __call__(self, record: dict):
+        self.stream.write(json.dumps(record, default=str) + '\n')
+
+    def close(self):
+        if self._owned:
+            self.stream.close()
+        else:
+            self.stream.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
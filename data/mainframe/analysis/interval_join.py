@@ -0,0 +1,142 @@
+### Interval joins (all overlapping pairs, nearest starts) between surge periods, CarbonTracker steps and baselines
+import numpy as np
+import pandas as pd
+
+from power_series import to_epoch_ns
+
+NS_PER_SECOND = 1_000_000_000
+
+
+def _ranges(lo: np.ndarray, hi: np.ndarray) -> (np.ndarray, np.ndarray):
+    # expand the half-open position ranges [lo[i], hi[i]) to (i, position) pairs without a Python loop
+    counts = np.maximum(hi - lo, 0)
+    owners = np.repeat(np.arange(len(lo)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owners, np.repeat(lo, counts) + offsets
+
+
+def overlap_join(a_starts, a_ends, b_starts, b_ends, closed: bool = False) -> pd.DataFrame:
+    """
+    All pairs of overlapping intervals between two sets of intervals.
+
+    Every overlapping pair is found exactly once, either because b starts inside a (a_start <= b_start < a_end)
+    or because a starts inside b (b_start < a_start < b_end). Both cases are ranges of the sorted starts found with
+    binary search, so the join takes O((n + m) log(n + m) + k) for k overlapping pairs.
+
+    Parameters:
+    a_starts, a_ends (array-like): Start and end times of the first set, as int64 epoch ns (see to_epoch_ns)
+    b_starts, b_ends (array-like): Start and end times of the second set, as int64 epoch ns
+    closed (bool): Treat the intervals as closed, so that intervals that only touch (overlap of zero length) are
+        joined as well. By default only overlaps of positive length are returned.
+
+    Returns:
+    pd.DataFrame with a, b (positions in the input sets), overlap_start, overlap_end (int64 epoch ns) and
+    overlap_seconds, ordered by a and b
+    """
+    a_starts, a_ends = np.asarray(a_starts, dtype=np.int64), np.asarray(a_ends, dtype=np.int64)
+    b_starts, b_ends = np.asarray(b_starts, dtype=np.int64), np.asarray(b_ends, dtype=np.int64)
+    a_order = np.argsort(a_starts, kind='stable')
+    b_order = np.argsort(b_starts, kind='stable')
+    a_sorted, b_sorted = a_starts[a_order], b_starts[b_order]
+    end_side = 'right' if closed else 'left'
+
+    # b starts inside a: b_start in [a_start, a_end) (closed: [a_start, a_end])
+    owners, positions = _ranges(np.searchsorted(b_sorted, a_starts, 'left'),
+                                np.searchsorted(b_sorted, a_ends, end_side))
+    a_index, b_index = [owners], [b_order[positions]]
+    # a starts inside b: a_start in (b_start, b_end) (closed: (b_start, b_end])
+    owners, positions = _ranges(np.searchsorted(a_sorted, b_starts, 'right'),
+                                np.searchsorted(a_sorted, b_ends, end_side))
+    a_index.append(a_order[positions])
+    b_index.append(owners)
+
+    a_index, b_index = np.concatenate(a_index), np.concatenate(b_index)
+    overlap_start = np.maximum(a_starts[a_index], b_starts[b_index])
+    overlap_end = np.minimum(a_ends[a_index], b_ends[b_index])
+    keep = overlap_start <= overlap_end if closed else overlap_start < overlap_end
+    order = np.lexsort((b_index[keep], a_index[keep]))
+    overlap_start, overlap_end = overlap_start[keep][order], overlap_end[keep][order]
+    return pd.DataFrame({
+        'a': a_index[keep][order],
+        'b': b_index[keep][order],
+        'overlap_start': overlap_start,
+        'overlap_end': overlap_end,
+        'overlap_seconds': (overlap_end - overlap_start) / NS_PER_SECOND,
+    })
+
+
+def nearest_start(a_starts, b_starts) -> (np.ndarray, np.ndarray):
+    """
+    For every start in a, the interval of b whose start is nearest (binary search in the sorted b starts).
+
+    Ties go to the earlier b start, and among equal b starts to the first one in b.
+
+    Parameters:
+    a_starts (array-like): Start times to match, as int64 epoch ns
+    b_starts (array-like): Candidate start times, as int64 epoch ns
+
+    Returns:
+    tuple (index, difference): position in b of the nearest start (-1 if b is empty) and b_start - a_start (ns)
+    """
+    a_starts = np.asarray(a_starts, dtype=np.int64)
+    b_starts = np.asarray(b_starts, dtype=np.int64)
+    if len(b_starts) == 0:
+        return np.full(len(a_starts), -1), np.zeros(len(a_starts), dtype=np.int64)
+    b_order = np.argsort(b_starts, kind='stable')
+    b_sorted = b_starts[b_order]
+    after = np.minimum(np.searchsorted(b_sorted, a_starts, 'left'), len(b_sorted) - 1)
+    before = np.maximum(after - 1, 0)
+    # the first of a run of equal starts, so that ties keep b's own order
+    before = np.searchsorted(b_sorted, b_sorted[before], 'left')
+    use_before = np.abs(b_sorted[before] - a_starts) <= np.abs(b_sorted[after] - a_starts)
+    position = np.where(use_before, before, after)
+    index = b_order[position]
+    return index, b_starts[index] - a_starts
+
+
+def surge_intervals(surge_periods: list) -> (np.ndarray, np.ndarray):
+    """
+    Start and end times (int64 epoch ns) of the surge periods from detect_power_surges.
+    """
+    return (to_epoch_ns([surge['start_time'] for surge in surge_periods]),
+            to_epoch_ns([surge['end_time'] for surge in surge_periods]))
+
+
+def period_intervals(time_periods: list) -> (np.ndarray, np.ndarray):
+    """
+    Start and stop times (int64 epoch ns) of the (step_name, start_time, stop_time) tuples from get_time_periods.
+    """
+    return to_epoch_ns([p[1] for p in time_periods]), to_epoch_ns([p[2] for p in time_periods])
+
+
+def join_surges_to_periods(surge_periods: list, time_periods: list, closed: bool = False) -> pd.DataFrame:
+    """
+    Attribute the surge periods to the steps (and baseline window) they overlap.
+
+    Parameters:
+    surge_periods (list): Surge periods from detect_power_surges
+    time_periods (list): Tuples (step_name, start_time, stop_time), see get_time_periods
+    closed (bool): Also join surges and periods that only touch, see overlap_join
+
+    Returns:
+    pd.DataFrame with surge (1-based, as in the printed reports), step, overlap_start, overlap_end, overlap_seconds,
+    surge_fraction and step_fraction (overlap as a fraction of the surge and of the step duration), one row per
+    overlapping (surge, period) pair
+    """
+    surge_starts, surge_ends = surge_intervals(surge_periods)
+    step_starts, step_ends = period_intervals(time_periods)
+    pairs = overlap_join(surge_starts, surge_ends, step_starts, step_ends, closed=closed)
+    overlap = (pairs['overlap_end'] - pairs['overlap_start']).to_numpy()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        surge_fraction = overlap / (surge_ends - surge_starts)[pairs['a']]
+        step_fraction = overlap / (step_ends - step_starts)[pairs['b']]
+    names = np.array([p[0] for p in time_periods], dtype=object)
+    return pd.DataFrame({
+        'surge': pairs['a'].to_numpy() + 1,
+        'step': names[pairs['b']],
+        'overlap_start': pd.to_datetime(pairs['overlap_start']),
+        'overlap_end': pd.to_datetime(pairs['overlap_end']),
+        'overlap_seconds': pairs['overlap_seconds'],
+        'surge_fraction': surge_fraction,
+        'step_fraction': step_fraction,
+    })
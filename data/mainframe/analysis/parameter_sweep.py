@@ -0,0 +1,262 @@
+### Parameter sweep of baseline percentile, surge multiplier and minimum surge duration over runs
+#
+# Usage (from data/mainframe/analysis):
+#   python parameter_sweep.py                                                     # default grid over all runs
+#   python parameter_sweep.py --percentiles 60 70 80 --multipliers 1.1 1.2 1.3 --min-durations 5 10 15 --output /tmp/sweep.csv
+#
+# surge_time_diffs.dat was picked by hand with percentile_threshold=70, surge_threshold_multiplier=1.2 and
+# min_duration_minutes=10. This stage evaluates a whole grid of the three parameters per run in one pass: the power
+# values are sorted once for all baseline thresholds and means, and the surges of every threshold are read from one
+# run structure. Every maximal stretch of samples at or above some power value is a surge for exactly the thresholds
+# from the higher of its two neighbouring samples up to its own minimum, so all surges of all thresholds are the
+# stretches whose range contains the threshold (computed once with all-nearest-smaller-values). For every setting the
+# table holds the surge count and durations and the offset of the surge nearest to the CarbonTracker start, compared
+# with surge_time_diffs.dat where it has the run. The surge is picked as the analysis picks it (nearest to the
+# CarbonTracker start), so the offset error says how far each setting's pick lands from the hand-picked surge.
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from analysis_functions import get_power_data
+from batch_analysis import DEFAULT_DATA_DIR, discover_runs, read_simpipe_data, read_surge_time_diffs, shift_simpipe_data
+from interval_join import nearest_start
+from power_series import as_power_series, to_epoch_ns
+
+DEFAULT_PERCENTILES = (50, 60, 65, 70, 75, 80, 90)
+DEFAULT_MULTIPLIERS = (1.05, 1.1, 1.15, 1.2, 1.3, 1.5)
+DEFAULT_MIN_DURATIONS = (5, 10, 15, 20, 30)
+SWEEP_COLUMNS = [
+    'percentile_threshold', 'surge_threshold_multiplier', 'min_duration_minutes', 'threshold_power',
+    'baseline_mean_power', 'surge_threshold', 'surges', 'total_surge_minutes', 'longest_surge_minutes',
+    'mean_surge_minutes', 'offset_minutes', 'end_offset_minutes',
+]
+SWEEP_RUN_COLUMNS = ['conf', 'runNr', *SWEEP_COLUMNS, 'reference_offset_minutes', 'offset_error_minutes',
+                     'matched_offset_minutes']
+
+
+def _previous_smaller(values: np.ndarray) -> np.ndarray:
+    # index of the nearest earlier value that is strictly smaller (-1 if none), by pointer jumping: every pass
+    # replaces a candidate that is not smaller by that candidate's own candidate, which keeps all values in between
+    # at or above the value
+    left = np.arange(len(values)) - 1
+    active = np.flatnonzero(left >= 0)
+    while len(active):
+        active = active[values[left[active]] >= values[active]]
+        left[active] = left[left[active]]
+        active = active[left[active] >= 0]
+    return left
+
+
+def surge_intervals(power: np.ndarray) -> (np.ndarray, np.ndarray, np.ndarray, np.ndarray):
+    """
+    All surges of all thresholds as stretches with the range of thresholds for which they are a surge.
+
+    For a threshold s a surge is a maximal run of samples with power > s that is closed by a sample at or below s
+    (see find_runs). Such a run is the maximal stretch around its minimum sample i with power >= power[i], and it is
+    a surge exactly for lower <= s < upper, with upper = power[i] and lower the higher of the two samples around it.
+
+    Parameters:
+    power (np.ndarray): Power values in time order (without NaN)
+
+    Returns:
+    tuple (starts, ends, lower, upper): inclusive sample positions of every distinct stretch and its threshold range
+    """
+    power = np.asarray(power, dtype=np.float64)
+    n = len(power)
+    left = _previous_smaller(power)
+    right = n - 1 - _previous_smaller(power[::-1])[::-1]
+    # a run that is still open at the end of the data is not a surge
+    closed = right < n
+    left, right, upper = left[closed], right[closed], power[closed]
+    lower = np.maximum(np.where(left >= 0, power[np.maximum(left, 0)], -np.inf), power[right])
+    # samples with the same value in the same stretch give the same stretch
+    _, first = np.unique(left * (n + 1) + right, return_index=True)
+    return left[first] + 1, right[first] - 1, lower[first], upper[first]
+
+
+def sweep_run(
+        power_data,
+        simpipe_data: pd.DataFrame = None,
+        percentiles=DEFAULT_PERCENTILES,
+        multipliers=DEFAULT_MULTIPLIERS,
+        min_durations=DEFAULT_MIN_DURATIONS,
+        reference_minutes: float = None) -> pd.DataFrame:
+    """
+    compute_baseline_stats + detect_power_surges for every combination of the parameters in one pass.
+
+    The baseline thresholds and means come from one sort of the power values; the surges of every threshold from
+    surge_intervals. Thresholds, surge counts and durations equal those of the per-setting calls (the baseline means
+    up to rounding, exactly for the whole-watt Tapo values).
+
+    Parameters:
+    power_data (pd.DataFrame or PowerSeries): Power data from get_power_data
+    simpipe_data (pd.DataFrame): CarbonTracker/SIMPIPE steps; without them the offsets are NaN
+    percentiles, multipliers, min_durations: Values of percentile_threshold, surge_threshold_multiplier and
+        min_duration_minutes to combine
+    reference_minutes (float): Offset of a known surge (e.g. from surge_time_diffs.dat); adds matched_offset_minutes,
+        the offset of the surge starting nearest to it
+
+    Returns:
+    pd.DataFrame with one row per setting (see SWEEP_COLUMNS). offset_minutes and end_offset_minutes belong to the
+    surge starting nearest to the CarbonTracker start (the closest surge of
+    compute_surge_vs_simpipe_start_endtime_diffs): its start minus the CarbonTracker start and its end minus the
+    CarbonTracker stop
+    """
+    series = as_power_series(power_data)
+    power = np.asarray(series.power, dtype=np.float64)
+    dates = series.dates
+
+    # one sort for all baseline thresholds and means (np.percentile of sorted values equals that of the unsorted)
+    ordered = np.sort(power)
+    thresholds = np.percentile(ordered, percentiles)
+    counts = np.searchsorted(ordered, thresholds, side='right')
+    prefix = np.concatenate([[0.0], np.cumsum(ordered)])
+    means = prefix[counts] / counts
+
+    starts, ends, lower, upper = surge_intervals(power)
+    durations = (dates[ends] - dates[starts]) / 1e9 / 60  # minutes, as in detect_power_surges
+    keep = durations >= min(min_durations)
+    starts, ends, lower, upper, durations = starts[keep], ends[keep], lower[keep], upper[keep], durations[keep]
+    start_times, end_times = dates[starts], dates[ends]
+
+    targets = None
+    if simpipe_data is not None:
+        ct_start = to_epoch_ns(pd.to_datetime(simpipe_data['start'].iloc[0]))
+        ct_stop = to_epoch_ns(pd.to_datetime(simpipe_data['stop'].iloc[-1]))
+        targets = [ct_start] if reference_minutes is None else [ct_start, ct_start + int(reference_minutes * 60e9)]
+
+    rows = []
+    for percentile, threshold, mean in zip(percentiles, thresholds, means):
+        for multiplier in multipliers:
+            surge_threshold = mean * multiplier
+            active = np.flatnonzero((lower <= surge_threshold) & (surge_threshold < upper))
+            # in time order, as detect_power_surges reports them
+            active = active[np.argsort(starts[active], kind='stable')]
+            for min_duration in min_durations:
+                selected = active[durations[active] >= min_duration]
+                selected_durations = durations[selected]
+                offset = end_offset = matched_offset = np.nan
+                if targets is not None and len(selected):
+                    nearest = selected[nearest_start(targets, start_times[selected])[0]]
+                    offset = (start_times[nearest[0]] - ct_start) / 60e9
+                    end_offset = (end_times[nearest[0]] - ct_stop) / 60e9
+                    matched_offset = (start_times[nearest[-1]] - ct_start) / 60e9
+                rows.append((percentile, multiplier, min_duration, threshold, mean, surge_threshold, len(selected),
+                             selected_durations.sum(), selected_durations.max() if len(selected) else 0.0,
+                             selected_durations.mean() if len(selected) else np.nan, offset, end_offset,
+                             matched_offset))
+    table = pd.DataFrame(rows, columns=[*SWEEP_COLUMNS, 'matched_offset_minutes'])
+    return table if reference_minutes is not None else table.drop(columns='matched_offset_minutes')
+
+
+def _sweep_job(job: dict) -> pd.DataFrame:
+    power_data = get_power_data(job["tapo"])
+    # surge_time_diffs.dat is measured against the unshifted CarbonTracker times
+    simpipe_data = shift_simpipe_data(read_simpipe_data(job["simpipe"]), 0)
+    reference = job.get("reference_offset")
+    table = sweep_run(power_data, simpipe_data, job["percentiles"], job["multipliers"], job["min_durations"],
+                      reference_minutes=reference)
+    table.insert(0, 'runNr', job["runNr"])
+    table.insert(0, 'conf', job["conf"])
+    table['reference_offset_minutes'] = np.nan if reference is None else reference
+    table['offset_error_minutes'] = table['offset_minutes'] - table['reference_offset_minutes']
+    if reference is None:
+        table['matched_offset_minutes'] = np.nan
+    return table[SWEEP_RUN_COLUMNS]
+
+
+def sweep_runs(
+        data_dir: str = DEFAULT_DATA_DIR,
+        percentiles=DEFAULT_PERCENTILES,
+        multipliers=DEFAULT_MULTIPLIERS,
+        min_durations=DEFAULT_MIN_DURATIONS,
+        surge_time_diffs_path: str = None,
+        workers: int = None) -> pd.DataFrame:
+    """
+    sweep_run for every discovered run, one run per worker process.
+
+    For a run with an entry in surge_time_diffs.dat, offset_error_minutes is the distance of the surge picked by the
+    analysis (nearest to the CarbonTracker start) from the hand-picked offset, and matched_offset_minutes the offset
+    of the surge starting nearest to the hand-picked one (NaN for other runs).
+
+    Parameters:
+    data_dir (str): Directory with the conf-* directories
+    percentiles, multipliers, min_durations: Parameter grid, see sweep_run
+    surge_time_diffs_path (str): Hand-picked offsets (default: data_dir/surge_time_diffs.dat)
+    workers (int): Number of worker processes (default: all cores)
+
+    Returns:
+    pd.DataFrame with the columns SWEEP_RUN_COLUMNS
+    """
+    surge_time_diffs_path = surge_time_diffs_path or os.path.join(data_dir, "surge_time_diffs.dat")
+    references = read_surge_time_diffs(surge_time_diffs_path) if os.path.exists(surge_time_diffs_path) else {}
+    jobs = [{**run, "percentiles": list(percentiles), "multipliers": list(multipliers),
+             "min_durations": list(min_durations), "reference_offset": references.get((run["conf"], run["runNr"]))}
+            for run in discover_runs(data_dir)]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(jobs) <= 1:
+        tables = [_sweep_job(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+            tables = list(pool.map(_sweep_job, jobs))
+    if not tables:
+        return pd.DataFrame(columns=SWEEP_RUN_COLUMNS)
+    return pd.concat(tables, ignore_index=True)
+
+
+def summarize_sweep(table: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per setting over all runs: runs with surges, mean surge count and longest surge, the median and maximum absolute
+    offset error and the number of runs where the analysis picks the hand-picked surge, best settings (smallest
+    median error) first.
+    """
+    table = table.assign(abs_offset_error=table['offset_error_minutes'].abs(),
+                         picks_reference=table['offset_minutes'] == table['matched_offset_minutes'])
+    summary = table.groupby(['percentile_threshold', 'surge_threshold_multiplier', 'min_duration_minutes']).agg(
+        runs=('runNr', 'size'),
+        runs_with_surges=('surges', lambda s: int((s > 0).sum())),
+        mean_surges=('surges', 'mean'),
+        mean_longest_surge_minutes=('longest_surge_minutes', 'mean'),
+        median_abs_offset_error=('abs_offset_error', 'median'),
+        max_abs_offset_error=('abs_offset_error', 'max'),
+        runs_picking_reference=('picks_reference', 'sum'),
+    )
+    return summary.sort_values(['median_abs_offset_error', 'max_abs_offset_error'], kind='stable').reset_index()
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Sweep the baseline and surge detection parameters over all runs.")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="directory with the conf-* directories")
+    parser.add_argument("--percentiles", type=float, nargs="+", default=DEFAULT_PERCENTILES, help="baseline percentile thresholds")
+    parser.add_argument("--multipliers", type=float, nargs="+", default=DEFAULT_MULTIPLIERS, help="surge threshold multipliers")
+    parser.add_argument("--min-durations", type=float, nargs="+", default=DEFAULT_MIN_DURATIONS, help="minimum surge durations (minutes)")
+    parser.add_argument("--surge-time-diffs", default=None, help="surge_time_diffs.dat with the hand-picked offsets")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--top", type=int, default=15, help="settings to print")
+    parser.add_argument("--output", default=None, help="write the per-run table to this CSV")
+    args = parser.parse_args(argv)
+
+    from instrumentation import recording
+
+    t0 = time.perf_counter()
+    with recording(echo=False):
+        table = sweep_runs(args.data_dir, args.percentiles, args.multipliers, args.min_durations,
+                           args.surge_time_diffs, args.workers)
+    elapsed = time.perf_counter() - t0
+
+    summary = summarize_sweep(table)
+    with pd.option_context('display.width', 200):
+        print(summary.head(args.top).to_string(index=False))
+    print(f"\n{len(summary)} settings x {table['conf'].str.cat(table['runNr']).nunique()} runs in {elapsed:.2f} s")
+    if args.output:
+        table.to_csv(args.output, index=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+### Headless, parallel export of the per-run power figures (results/power-confX-runY.png)
+#
+# Usage (from data/mainframe/analysis):
+#   python plot_export.py                                  # every run, written to ../results/
+#   python plot_export.py --runs conf-1/run1 conf-5/run3 --workers 2
+#
+# Renders plot_enhanced_visualization (as in comparison_analysis.ipynb) for every conf-*/runN.dat + power-runN.xls
+# pair with the non-interactive Agg backend, one figure per worker task.
+import matplotlib
+matplotlib.use('Agg')
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib.pyplot as plt
+
+from analysis_functions import get_power_data, compute_baseline_stats, detect_power_surges
+from batch_analysis import DEFAULT_DATA_DIR, discover_runs, read_simpipe_data, read_surge_time_diffs, shift_simpipe_data
+from instrumentation import recording
+from plotting import plot_enhanced_visualization
+
+DEFAULT_OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "results")
+
+
+def figure_path(output_dir: str, conf: str, run_nr: str) -> str:
+    """
+    results/power-confX-runY.png path of a run (conf-1, run2 -> power-conf1-run2.png).
+    """
+    return os.path.join(output_dir, f"power-{conf.replace('-', '')}-{run_nr}.png")
+
+
+def render_run_figure(job: dict) -> str:
+    """
+    Render and save the enhanced power/energy figure of one run.
+
+    Parameters:
+    job (dict): Entry of discover_runs plus output_dir, simpipe_datetime_shift (minutes), percentile_threshold,
+        surge_threshold_multiplier, min_duration_minutes, max_points, decimation and dpi
+
+    Returns:
+    path of the written PNG
+    """
+    simpipe_data = shift_simpipe_data(read_simpipe_data(job["simpipe"]), job.get("simpipe_datetime_shift", 0))
+    with recording(echo=bool(job.get("verbose"))):
+        power_data = get_power_data(job["tapo"])
+        baseline_stats = compute_baseline_stats(df=power_data, percentile_threshold=job.get("percentile_threshold", 70))
+        surge_periods, surge_threshold = detect_power_surges(
+            power_data, baseline_stats,
+            surge_threshold_multiplier=job.get("surge_threshold_multiplier", 1.2),
+            min_duration_minutes=job.get("min_duration_minutes", 10))
+        fig = plot_enhanced_visualization(
+            simpipe_data, power_data, baseline_stats, surge_periods, surge_threshold,
+            max_points=job.get("max_points"), decimation=job.get("decimation", "minmax"), show=False)
+    path = figure_path(job["output_dir"], job["conf"], job["runNr"])
+    fig.savefig(path, dpi=job.get("dpi", 100), bbox_inches="tight")
+    plt.close(fig)
+    return path
+
+
+def export_run_figures(
+        data_dir: str = DEFAULT_DATA_DIR,
+        output_dir: str = DEFAULT_OUTPUT_DIR,
+        runs: list = None,
+        surge_time_diffs_path: str = None,
+        workers: int = None,
+        **plot_options) -> list:
+    """
+    Render the figures of all (or the selected) runs in a process pool.
+
+    Parameters:
+    data_dir (str): Directory with the conf-* directories
+    output_dir (str): Where to write the PNGs
+    runs (list): Optional "conf-N/runM" selection
+    surge_time_diffs_path (str): Time shifts per run (default: data_dir/surge_time_diffs.dat)
+    workers (int): Number of worker processes (default: all cores)
+    plot_options: Passed to render_run_figure (percentile_threshold, surge_threshold_multiplier,
+        min_duration_minutes, max_points, decimation, dpi, verbose)
+
+    Returns:
+    list of written paths
+    """
+    surge_time_diffs_path = surge_time_diffs_path or os.path.join(data_dir, "surge_time_diffs.dat")
+    shifts = read_surge_time_diffs(surge_time_diffs_path) if os.path.exists(surge_time_diffs_path) else {}
+    os.makedirs(output_dir, exist_ok=True)
+
+    jobs = []
+    for run in discover_runs(data_dir):
+        if runs and f"{run['conf']}/{run['runNr']}" not in runs:
+            continue
+        jobs.append({**run, **plot_options, "output_dir": output_dir,
+                     "simpipe_datetime_shift": shifts.get((run["conf"], run["runNr"]), 0)})
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        return [render_run_figure(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=min(workers, max(len(jobs), 1))) as pool:
+        return list(pool.map(render_run_figure, jobs))
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Render results/power-confX-runY.png for all runs without a display.")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="directory with the conf-* directories")
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR, help="where to write the PNGs")
+    parser.add_argument("--runs", nargs="*", default=None, metavar="CONF/RUN", help="only these runs, e.g. conf-1/run1")
+    parser.add_argument("--surge-time-diffs", default=None, help="surge_time_diffs.dat with per-run shifts in minutes")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--percentile-threshold", type=float, default=70, help="baseline percentile threshold")
+    parser.add_argument("--surge-threshold-multiplier", type=float, default=1.2, help="surge threshold relative to baseline mean")
+    parser.add_argument("--min-duration-minutes", type=float, default=10, help="minimum surge duration")
+    parser.add_argument("--max-points", type=int, default=None, help="points per series (default: 2 per pixel column, 0: all)")
+    parser.add_argument("--decimation", choices=["minmax", "lttb"], default="minmax", help="downsampling method")
+    parser.add_argument("--dpi", type=int, default=100, help="PNG resolution")
+    parser.add_argument("--verbose", action="store_true", help="print the per-run analysis output")
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    paths = export_run_figures(
+        data_dir=args.data_dir, output_dir=args.output_dir, runs=args.runs,
+        surge_time_diffs_path=args.surge_time_diffs, workers=args.workers,
+        percentile_threshold=args.percentile_threshold, surge_threshold_multiplier=args.surge_threshold_multiplier,
+        min_duration_minutes=args.min_duration_minutes, max_points=args.max_points, decimation=args.decimation,
+        dpi=args.dpi, verbose=args.verbose)
+    for path in paths:
+        print(f"Saved {path}")
+    print(f"\nRendered {len(paths)} figures in {time.perf_counter() - t0:.2f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
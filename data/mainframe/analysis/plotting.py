@@ -0,0 +1,344 @@
+### Plotting of Tapo power data, step periods and surges (imported lazily by analysis_functions)
+import pandas as pd
+import matplotlib.pyplot as plt
+
+from decimation import decimate_indices, pixel_budget
+from instrumentation import message
+from interval_join import overlap_join, surge_intervals
+from power_series import PowerSeries, as_power_series, to_epoch_ns
+from rollup import RollupPyramid, ROLLUP_COLUMNS
+
+
+def _decimated(x: pd.Series, y: pd.Series, max_points: int = None, method: str = 'minmax') -> (pd.Series, pd.Series):
+    """
+    Reduce a series to the point budget of the current axes (2 points per pixel column if max_points is None,
+    no reduction if max_points is 0), keeping its peaks (see decimation.decimate_indices).
+    """
+    if max_points is None:
+        max_points = pixel_budget(plt.gca())
+    idx = decimate_indices(x, y, max_points, method)
+    if len(idx) == len(y):
+        return x, y
+    return x.iloc[idx], y.iloc[idx]
+
+
+def plot_energy_usage(
+        df: pd.DataFrame,
+        x_col: str = 'Date',
+        y_col: str = 'Energy(kWh)',
+        title: str = 'Energy Usage Over Time',
+        start: str = None,
+        end: str = None,
+        timestamps: str = None,
+        max_points: int = None,
+        decimation: str = 'minmax',
+        show: bool = True):
+    """
+    Plot energy usage over time using matplotlib.pyplot
+    
+    Parameters:
+    df (pd.DataFrame, PowerSeries or RollupPyramid): DataFrame with date and energy columns. For a PowerSeries
+        (or its RollupPyramid), a long window of Power(W) or Energy(kWh) is drawn as the min/max envelope of the
+        coarsest rollup level that still has a bucket per pixel column, without reading the raw samples
+    x_col (str): Column name for x-axis (default: 'Date')
+    y_col (str): Column name for y-axis (default: 'Energy(kWh)')
+    title (str): Plot title
+    start (str): Start timestamp for filtering data
+    end (str): End timestamp for filtering data
+    timestamps (list): Optional list of timestamps for highlighting specific events
+        * plot vertical line(s) at given timestamps
+    max_points (int): Maximum number of points drawn (default: 2 per pixel column, 0: all samples)
+    decimation (str): Downsampling method, 'minmax' or 'lttb'
+    show (bool): Call plt.show(); pass False to save or close the returned figure instead
+
+    Returns:
+    matplotlib.figure.Figure
+    """
+
+    fig = plt.figure(figsize=(10, 6))
+    if isinstance(df, (PowerSeries, RollupPyramid)):
+        pyramid = df if isinstance(df, RollupPyramid) else df.rollup
+        if max_points is None:
+            max_points = pixel_budget(plt.gca())
+        envelope = None
+        if x_col == 'Date' and y_col in ROLLUP_COLUMNS and decimation == 'minmax':
+            envelope = pyramid.envelope(y_col, start, end, max_points)
+        if envelope is not None:
+            plt.plot(*envelope)
+        else:
+            series = pyramid.series
+            lo, hi = series.window_bounds(start or series.date_at(0), end or series.date_at(len(series) - 1))
+            copy = series.slice(lo, hi)
+            plt.plot(*_decimated(copy[x_col], copy[y_col], max_points, decimation))
+    else:
+        if start and end:
+            copy = df[(df[x_col] >= start) & (df[x_col] <= end)]
+        elif start:
+            copy = df[df[x_col] >= start]
+        elif end:
+            copy = df[df[x_col] <= end]
+        else:
+            copy = df
+        plt.plot(*_decimated(copy[x_col], copy[y_col], max_points, decimation))
+    
+    # Add vertical lines at specified timestamps
+    if timestamps is not None:
+        for timestamp in timestamps:
+            plt.axvline(x=pd.to_datetime(timestamp), color='red', linestyle='--', alpha=0.7, label='Event')
+
+    plt.xlabel(x_col)
+    plt.ylabel(y_col)
+    plt.title(title)
+    plt.grid(True, alpha=0.3)
+    plt.xticks(rotation=45)
+    plt.tight_layout()
+    if show:
+        plt.show()
+    return fig
+
+
+def plot_energy_usage_overlay_multiple_datasets(
+        raw_power_data: pd.DataFrame,
+        data_periods: pd.DataFrame, 
+        time_periods_ct: list, 
+        start_time: str = None, 
+        end_time: str = None,
+        max_points: int = None,
+        decimation: str = 'minmax',
+        show: bool = True):
+    """
+    This plots the data as specified in plot_energy_usage and on top plots the multiple datasets as plot_multiple_datasets().
+    raw_power_data and the datasets may be DataFrames or PowerSeries (e.g. from divide_power_data_into_step_periods).
+    max_points, decimation and show are as in plot_energy_usage; returns the figure.
+    """
+    # Filter the raw data for the specified time range
+    if isinstance(raw_power_data, PowerSeries):
+        if raw_power_data.empty or not (start_time or end_time):
+            filtered_raw = raw_power_data
+        else:
+            lo, hi = raw_power_data.window_bounds(start_time or raw_power_data.date_at(0),
+                                                  end_time or raw_power_data.date_at(len(raw_power_data) - 1))
+            filtered_raw = raw_power_data.slice(lo, hi)
+    elif start_time and end_time:
+        filtered_raw = raw_power_data[(raw_power_data['Date'] >= start_time) & (raw_power_data['Date'] <= end_time)]
+    elif start_time:
+        filtered_raw = raw_power_data[raw_power_data['Date'] >= start_time]
+    elif end_time:
+        filtered_raw = raw_power_data[raw_power_data['Date'] <= end_time]
+    else:
+        filtered_raw = raw_power_data
+
+    # Create single plot with both datasets
+    fig = plt.figure(figsize=(12, 6))
+    
+    # Plot the overall energy usage first (as background)
+    plt.plot(*_decimated(filtered_raw['Date'], filtered_raw['Energy(kWh)'], max_points, decimation),
+             color='lightgray', alpha=0.7, linewidth=2, label='Overall Energy Usage')
+    
+    # Overlay the multiple datasets on the same plot
+    for i, df in enumerate(data_periods):
+        if not isinstance(df, (pd.DataFrame, PowerSeries)):
+            message("Dataset %d is not a valid DataFrame or PowerSeries.", i, level='warning')
+            continue
+        if df.empty:
+            continue
+        # Use provided label or generate default
+        if i < len(time_periods_ct):
+            label = time_periods_ct[i][0]
+        else:
+            # Create label from date range
+            start_date = df['Date'].min().strftime('%Y-%m-%d %H:%M')
+            end_date = df['Date'].max().strftime('%Y-%m-%d %H:%M')
+            label = f"Dataset {i+1}: {start_date} to {end_date}"
+        
+        plt.plot(*_decimated(df['Date'], df['Energy(kWh)'], max_points, decimation), label=label, marker='o', markersize=3)
+    
+    plt.xlabel('Date')
+    plt.ylabel('Energy(kWh)')
+    plt.title('Energy Usage Over Time with Multiple Datasets Overlay')
+    plt.legend()
+    plt.grid(True, alpha=0.3)
+    plt.xticks(rotation=45)
+    plt.tight_layout()
+    if show:
+        plt.show()
+    return fig
+
+
+def plot_multiple_datasets(
+        datasets_list,
+        time_periods,
+        column='Power(W)',
+        title=None,
+        max_points: int = None,
+        decimation: str = 'minmax',
+        show: bool = True):
+    """
+    Plot multiple filtered datasets as separate lines.
+    
+    Parameters:
+    datasets_list (list): List of DataFrames (filtered_data from compute_energy_stats)
+    labels (list): Optional list of labels for each dataset
+    column (str): Column to plot ('Power(W)' or 'Energy(kWh)')
+    title (str): Optional plot title
+    max_points, decimation, show: As in plot_energy_usage
+
+    Returns:
+    matplotlib.figure.Figure
+    """
+    fig = plt.figure(figsize=(12, 6))
+    
+    for i, df in enumerate(datasets_list):
+        if df.empty:
+            continue
+            
+        # Use provided label or generate default
+        if time_periods and i < len(time_periods):
+            label = time_periods[i][0]
+        else:
+            # Create label from date range
+            start_date = df['Date'].min().strftime('%Y-%m-%d %H:%M')
+            end_date = df['Date'].max().strftime('%Y-%m-%d %H:%M')
+            label = f"Dataset {i+1}: {start_date} to {end_date}"
+        
+        plt.plot(*_decimated(df['Date'], df[column], max_points, decimation), label=label, marker='o', markersize=3)
+    
+    plt.xlabel('Date')
+    plt.ylabel(column)
+    plt.title(title or f'{column} Over Time - Multiple Datasets')
+    plt.legend()
+    plt.grid(True, alpha=0.3)
+    plt.xticks(rotation=45)
+    plt.tight_layout()
+    if show:
+        plt.show()
+    return fig
+
+
+def plot_enhanced_visualization(
+        carbontracker_simpipe_data: pd.DataFrame,
+        power_data: pd.DataFrame,
+        baseline_stats: dict,
+        surge_periods: list,
+        surge_threshold: float,
+        max_points: int = None,
+        decimation: str = 'minmax',
+        show: bool = True):
+    # Step 5: Enhanced Visualization with Surge Periods and Carbontracker Markers
+    # max_points, decimation and show are as in plot_energy_usage; returns the figure
+
+    # Convert carbontracker timestamps to datetime and make timezone-naive for comparison
+    first_start_dt = pd.to_datetime(carbontracker_simpipe_data['start'].iloc[0]).tz_localize(None)
+    last_stop_dt = pd.to_datetime(carbontracker_simpipe_data['stop'].iloc[-1]).tz_localize(None)
+
+    message("Carbontracker period: %s to %s", first_start_dt, last_stop_dt)
+    message("Power data period: %s to %s", power_data['Date'].min(), power_data['Date'].max())
+
+    # Create the enhanced plot
+    fig = plt.figure(figsize=(16, 10))
+
+    # Main power consumption plot
+    plt.subplot(2, 1, 1)
+    plt.plot(*_decimated(power_data['Date'], power_data['Power(W)'], max_points, decimation), linewidth=1, alpha=0.7, color='blue', label='Power Consumption')
+
+    # Add baseline threshold line
+    plt.axhline(y=baseline_stats['mean_power'], color='green', linestyle='--',
+            label=f'Baseline Mean ({baseline_stats["mean_power"]:.1f} W)')
+    plt.axhline(y=surge_threshold, color='red', linestyle='--',
+            label=f'Surge Threshold ({surge_threshold:.1f} W)')
+
+    # Highlight surge periods
+    for i, surge in enumerate(surge_periods):
+        plt.axvspan(surge['start_time'], surge['end_time'],
+                alpha=0.3, color='red', label=f'Surge {i+1}' if i == 0 else "")
+
+    # Add carbontracker start and stop markers
+    plt.axvline(x=first_start_dt, color='purple', linestyle='-', linewidth=2, alpha=0.8,
+            label=f'Carbontracker Start ({first_start_dt.strftime("%H:%M")})')
+    plt.axvline(x=last_stop_dt, color='purple', linestyle='-', linewidth=2, alpha=0.8,
+            label=f'Carbontracker End ({last_stop_dt.strftime("%H:%M")})')
+
+    plt.title('Power Consumption with Surge Periods and Carbontracker Timeline')
+    plt.ylabel('Power (W)')
+    plt.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
+    plt.grid(True, alpha=0.3)
+    plt.xticks(rotation=45)
+
+    # Energy consumption plot
+    plt.subplot(2, 1, 2)
+    plt.plot(*_decimated(power_data['Date'], power_data['Energy(kWh)'], max_points, decimation), linewidth=1, alpha=0.7, color='orange', label='Energy Consumption')
+
+    # Add baseline energy line
+    plt.axhline(y=baseline_stats['mean_energy'], color='green', linestyle='--',
+            label=f'Baseline Mean ({baseline_stats["mean_energy"]:.6f} kWh)')
+
+    # Highlight surge periods
+    for i, surge in enumerate(surge_periods):
+        plt.axvspan(surge['start_time'], surge['end_time'],
+                alpha=0.3, color='red')
+
+    # Add carbontracker start and stop markers
+    plt.axvline(x=first_start_dt, color='purple', linestyle='-', linewidth=2, alpha=0.8)
+    plt.axvline(x=last_stop_dt, color='purple', linestyle='-', linewidth=2, alpha=0.8)
+
+    plt.title('Energy Consumption with Surge Periods and Carbontracker Timeline')
+    plt.ylabel('Energy (kWh)')
+    plt.xlabel('Date')
+    plt.legend()
+    plt.grid(True, alpha=0.3)
+    plt.xticks(rotation=45)
+
+    plt.tight_layout()
+    if show:
+        plt.show()
+
+    # Analysis of carbontracker period vs power surges
+    message("=== CARBONTRACKER vs POWER SURGE ANALYSIS ===")
+    message("Carbontracker monitoring period: %s - %s", first_start_dt.strftime('%H:%M'), last_stop_dt.strftime('%H:%M'))
+    carbontracker_duration = (last_stop_dt - first_start_dt).total_seconds() / 3600
+    message("Carbontracker duration: %.2f hours", carbontracker_duration)
+
+    # Check overlap with surge periods
+    message("\nOverlap analysis with detected surge periods:")
+    surge_starts, surge_ends = surge_intervals(surge_periods)
+    overlaps = overlap_join(surge_starts, surge_ends, [to_epoch_ns(first_start_dt)], [to_epoch_ns(last_stop_dt)])
+    overlaps = overlaps.set_index('a')
+    for i, surge in enumerate(surge_periods, 1):
+        surge_start = surge['start_time']
+        surge_end = surge['end_time']
+
+        if i - 1 in overlaps.index:
+            overlap = overlaps.loc[i - 1]
+            overlap_start = pd.Timestamp(overlap['overlap_start'])
+            overlap_end = pd.Timestamp(overlap['overlap_end'])
+            overlap_duration = overlap['overlap_seconds'] / 60
+            surge_duration = surge['duration_minutes']
+            overlap_percentage = (overlap_duration / surge_duration) * 100
+            message("  Surge %d: %.1f%% overlap (%.1f/%.1f minutes)", i, overlap_percentage, overlap_duration, surge_duration)
+            message("    Surge: %s - %s", surge_start.strftime('%H:%M'), surge_end.strftime('%H:%M'))
+            message("    Overlap: %s - %s", overlap_start.strftime('%H:%M'), overlap_end.strftime('%H:%M'))
+        else:
+            message("  Surge %d: No overlap", i)
+            message("    Surge: %s - %s", surge_start.strftime('%H:%M'), surge_end.strftime('%H:%M'))
+
+    # Calculate energy during carbontracker period
+    ct_stats = as_power_series(power_data).range_index.query(first_start_dt, last_stop_dt)
+
+    if ct_stats['count'][0] > 0:
+        ct_total_energy = ct_stats['total_energy'][0]
+        ct_avg_power = ct_stats['avg_power'][0]
+        ct_peak_power = ct_stats['max_power'][0]
+
+        message("\nPower statistics during Carbontracker period:")
+        message("  Average power: %.1f W", ct_avg_power)
+        message("  Peak power: %.1f W", ct_peak_power)
+        message("  Total energy: %.4f kWh", ct_total_energy)
+        message("  Carbontracker reported energy: %.4f kWh", carbontracker_simpipe_data['energy'].sum())
+
+        energy_diff = abs(ct_total_energy - carbontracker_simpipe_data['energy'].sum())
+        message("  Energy difference: %.4f kWh", energy_diff)
+    else:
+        message("\nNo power data available during Carbontracker period")
+        message("  Power data range: %s to %s", power_data['Date'].min(), power_data['Date'].max())
+        message("  Carbontracker range: %s to %s", first_start_dt, last_stop_dt)
+    return fig
@@ -0,0 +1,199 @@
+### Sidecar cache for cleaned Tapo power data
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from power_series import PowerSeries
+
+CACHE_SUFFIX = ".cache.npz"
+CACHE_VERSION = 1
+SERIES_SUFFIX = ".series"
+ROLLUP_FILE = "rollup.npz"
+
+
+def power_cache_path(data_path: str) -> str:
+    """
+    Path of the cache file written next to a Tapo export (e.g. power-run1.xls.cache.npz).
+    """
+    return f"{data_path}{CACHE_SUFFIX}"
+
+
+def _source_key(data_path: str) -> dict:
+    st = os.stat(data_path)
+    return {
+        'source_path': os.path.abspath(data_path),
+        'source_mtime_ns': st.st_mtime_ns,
+        'source_size': st.st_size,
+    }
+
+
+def read_power_cache(data_path: str):
+    """
+    Read the cached power DataFrame for a Tapo export.
+
+    Parameters:
+    data_path (str): Path to the source .xls file
+
+    Returns:
+    pd.DataFrame, or None if there is no cache or it no longer matches the
+    source file's path, mtime and size
+    """
+    cache_path = power_cache_path(data_path)
+    if not os.path.exists(cache_path):
+        return None
+    key = _source_key(data_path)
+    try:
+        with np.load(cache_path, allow_pickle=False) as cache:
+            if (int(cache['version']) != CACHE_VERSION
+                    or str(cache['source_path']) != key['source_path']
+                    or int(cache['source_mtime_ns']) != key['source_mtime_ns']
+                    or int(cache['source_size']) != key['source_size']):
+                return None
+            columns = [str(c) for c in cache['columns']]
+            data = {col: cache[f'col{i}'] for i, col in enumerate(columns)}
+            index = cache['index']
+    except (OSError, KeyError, ValueError):
+        # unreadable or truncated cache, fall back to the source file
+        return None
+    return pd.DataFrame(data, index=pd.Index(index), columns=columns)
+
+
+def write_power_cache(data_path: str, power_data: pd.DataFrame) -> str:
+    """
+    Write the cleaned power DataFrame as one binary array per column next to the source file.
+
+    Parameters:
+    data_path (str): Path to the source .xls file
+    power_data (pd.DataFrame): Output of get_power_data for that file
+
+    Returns:
+    str: Path of the written cache file
+    """
+    cache_path = power_cache_path(data_path)
+    key = _source_key(data_path)
+    arrays = {f'col{i}': power_data[col].to_numpy() for i, col in enumerate(power_data.columns)}
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(
+            f,
+            version=np.int64(CACHE_VERSION),
+            source_path=np.str_(key['source_path']),
+            source_mtime_ns=np.int64(key['source_mtime_ns']),
+            source_size=np.int64(key['source_size']),
+            columns=np.array([str(c) for c in power_data.columns]),
+            index=power_data.index.to_numpy(),
+            **arrays)
+    # atomic replace so that concurrent readers never see a partial file
+    os.replace(tmp_path, cache_path)
+    return cache_path
+
+
+def power_series_path(data_path: str) -> str:
+    """
+    Path of the memory-mappable PowerSeries directory written next to a Tapo export (e.g. power-run1.xls.series).
+    """
+    return f"{data_path}{SERIES_SUFFIX}"
+
+
+def open_power_series(data_path: str, mmap: bool = True, rollup: bool = True) -> PowerSeries:
+    """
+    Compact PowerSeries of a Tapo export, memory-mapped from a sidecar directory next to it.
+
+    The directory is written from get_power_data on first use and rewritten when the source file's path, mtime or
+    size changes, so that many runs can be opened at once while only the pages that are read are loaded.
+
+    Parameters:
+    data_path (str): Path to the source .xls file
+    mmap (bool): Memory-map the arrays (False: read them into memory)
+    rollup (bool): Attach the RollupPyramid stored in the directory (rollup.npz), building it on first use,
+        so that range queries and plots of the series do not scan it
+
+    Returns:
+    PowerSeries
+    """
+    from analysis_functions import get_power_data
+
+    series_path = power_series_path(data_path)
+    key = _source_key(data_path)
+    series = None
+    try:
+        meta = PowerSeries.read_metadata(series_path)
+        if all(meta.get(k) == v for k, v in key.items()):
+            series = PowerSeries.open(series_path, mmap=mmap)
+    except (OSError, ValueError, KeyError):
+        # missing, incomplete or outdated, rewrite it
+        pass
+    if series is None:
+        tmp_path = f"{series_path}.{os.getpid()}.tmp"
+        PowerSeries(get_power_data(data_path)).save(tmp_path, metadata=key)
+        shutil.rmtree(series_path, ignore_errors=True)
+        os.replace(tmp_path, series_path)
+        series = PowerSeries.open(series_path, mmap=mmap)
+    if rollup:
+        series.rollup = _open_rollup(series, os.path.join(series_path, ROLLUP_FILE))
+    return series
+
+
+def _open_rollup(series: PowerSeries, path: str):
+    from rollup import RollupPyramid
+
+    try:
+        return RollupPyramid.load(path, series)
+    except (OSError, ValueError, KeyError):
+        # missing, unreadable or written for an earlier version of the series, rebuild it
+        pass
+    pyramid = RollupPyramid(series)
+    try:
+        pyramid.save(path)
+    except OSError:
+        # read-only data directory, keep the pyramid in memory only
+        pass
+    return pyramid
+
+
+def clear_power_cache(data_path: str) -> bool:
+    """
+    Remove the cache file and PowerSeries directory of a Tapo export. Returns True if anything was removed.
+    """
+    removed = False
+    cache_path = power_cache_path(data_path)
+    if os.path.exists(cache_path):
+        os.remove(cache_path)
+        removed = True
+    series_path = power_series_path(data_path)
+    if os.path.isdir(series_path):
+        shutil.rmtree(series_path)
+        removed = True
+    return removed
+
+
+def time_power_data_load(data_path: str, print_stats: bool = True) -> dict:
+    """
+    Measure cold (parse .xls and write cache) and warm (read cache) load times of get_power_data.
+
+    Parameters:
+    data_path (str): Path to the source .xls file
+    print_stats (bool): Print the timings
+
+    Returns:
+    dict with cold_seconds, warm_seconds and speedup
+    """
+    from analysis_functions import get_power_data
+
+    clear_power_cache(data_path)
+    t0 = time.perf_counter()
+    get_power_data(data_path, use_cache=True)
+    cold = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    get_power_data(data_path, use_cache=True)
+    warm = time.perf_counter() - t0
+    timings = {'cold_seconds': cold, 'warm_seconds': warm, 'speedup': cold / warm if warm > 0 else float('inf')}
+    if print_stats:
+        print(f"     time_power_data_load -- {data_path}")
+        print(f"      cold (xls parse + cache write): {cold * 1000:.1f} ms")
+        print(f"      warm (cache read)             : {warm * 1000:.1f} ms")
+        print(f"      speedup                       : {timings['speedup']:.1f}x")
+    return timings
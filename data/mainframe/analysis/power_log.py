@@ -0,0 +1,131 @@
+### Append-only binary power log (one file per plug), opened memory-mapped as a PowerSeries
+#
+# Layout: a 64-byte header (magic, format version, record size, zero padding) followed by packed 12-byte records of
+# int64 epoch ns (UTC) and float32 power (W), the same per-sample layout as a compact PowerSeries. Records are only
+# ever appended, so a reader maps the complete records present when it opens the file while a collector keeps
+# writing, and a record torn by a crash is ignored (and overwritten by the next writer).
+import os
+import struct
+
+import numpy as np
+
+from power_series import PowerSeries
+
+LOG_SUFFIX = ".plog"
+LOG_MAGIC = b"PWRLOG\0\0"
+LOG_VERSION = 1
+HEADER_SIZE = 64
+RECORD_DTYPE = np.dtype([('time', '<i8'), ('power', '<f4')])
+_HEADER = struct.Struct('<8sII')
+
+
+def _header() -> bytes:
+    return _HEADER.pack(LOG_MAGIC, LOG_VERSION, RECORD_DTYPE.itemsize).ljust(HEADER_SIZE, b'\0')
+
+
+def _check_header(header: bytes, path: str):
+    if len(header) < HEADER_SIZE:
+        raise ValueError(f"{path}: truncated power log header")
+    magic, version, record_size = _HEADER.unpack_from(header)
+    if magic != LOG_MAGIC:
+        raise ValueError(f"{path}: not a power log")
+    if version != LOG_VERSION or record_size != RECORD_DTYPE.itemsize:
+        raise ValueError(f"{path}: power log version {version} with {record_size}-byte records is not supported")
+
+
+def power_log_records(path: str) -> int:
+    """
+    Number of complete records in a power log.
+    """
+    return max(0, (os.path.getsize(path) - HEADER_SIZE) // RECORD_DTYPE.itemsize)
+
+
+class PowerLogWriter:
+    """
+    Appends samples to a power log, creating it (with its header) if it does not exist.
+
+    Writes are not buffered beyond the file object: callers batch samples and pass them to append in one call.
+
+    Parameters:
+    path (str): Log file
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        self._file = open(path, 'r+b' if exists else 'wb')
+        if exists:
+            _check_header(self._file.read(HEADER_SIZE), path)
+            # drop a record torn by an interrupted write
+            self._file.truncate(HEADER_SIZE + power_log_records(path) * RECORD_DTYPE.itemsize)
+            self._file.seek(0, os.SEEK_END)
+        else:
+            self._file.write(_header())
+            self._file.flush()
+
+    def append(self, times, powers) -> int:
+        """
+        Append samples (epoch ns, W) and return how many were written.
+        """
+        records = np.empty(len(times), dtype=RECORD_DTYPE)
+        records['time'] = times
+        records['power'] = powers
+        self._file.write(records.tobytes())
+        return len(records)
+
+    def flush(self, sync: bool = False):
+        """
+        Hand the written records to the OS (and, with sync, to the disk).
+        """
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if not self._file.closed:
+            self._file.flush()
+            self._file.close()
+
+    def __enter__(self) -> 'PowerLogWriter':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_power_log(path: str, mmap: bool = True) -> PowerSeries:
+    """
+    Compact PowerSeries of a power log, memory-mapped (read-only) unless mmap is False.
+
+    The energy of every sample is derived from its power and the interval since the previous sample, as for a
+    compact series. Samples out of time order (e.g. after a clock step) are sorted, which reads the log into memory.
+
+    Parameters:
+    path (str): Log file written by PowerLogWriter
+    mmap (bool): Memory-map the records (False: read them into memory)
+
+    Returns:
+    PowerSeries
+    """
+    with open(path, 'rb') as f:
+        _check_header(f.read(HEADER_SIZE), path)
+    n = power_log_records(path)
+    if n == 0:
+        records = np.empty(0, dtype=RECORD_DTYPE)
+    elif mmap:
+        records = np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_SIZE, shape=(n,))
+    else:
+        records = np.fromfile(path, dtype=RECORD_DTYPE, count=n, offset=HEADER_SIZE)
+    dates, power = records['time'], records['power']
+    if n > 1 and np.any(dates[1:] < dates[:-1]):
+        order = np.argsort(dates, kind='stable')
+        dates, power = dates[order], power[order]
+    return PowerSeries.from_arrays(dates, power)
+
+
+def read_power_logs(directory: str, mmap: bool = True) -> dict:
+    """
+    PowerSeries of every power log (*.plog) in a directory, keyed by plug name (the file name without suffix).
+    """
+    return {name[:-len(LOG_SUFFIX)]: read_power_log(os.path.join(directory, name), mmap=mmap)
+            for name in sorted(os.listdir(directory)) if name.endswith(LOG_SUFFIX)}
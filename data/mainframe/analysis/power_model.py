@@ -0,0 +1,300 @@
+### CPU activity -> wall power regression: predict Tapo step energy of a run from its CarbonTracker/SIMPIPE data alone
+#
+# Usage (from data/mainframe/analysis):
+#   python power_model.py                       # fit on all runs, print coefficients and leave-one-run-out errors
+#   python power_model.py --predict ../data/carbontracker/conf-3/run1.dat
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from analysis_functions import get_power_data, get_time_periods
+from attribution import attribute_step_energy
+from batch_analysis import DEFAULT_DATA_DIR, discover_runs, read_simpipe_data, read_surge_time_diffs, shift_simpipe_data
+from instrumentation import recording
+from power_series import to_epoch_ns
+
+NS_PER_SECOND = 1_000_000_000
+DEFAULT_FEATURES = ['ct_power(W)']
+MODEL_STATS = ['r2', 'rmse(W)', 'steps']
+
+
+def step_features(simpipe_data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per-step model inputs of a runN.dat file.
+
+    Parameters:
+    simpipe_data (pd.DataFrame): runN.dat content with step, start, stop and energy (kWh) columns
+
+    Returns:
+    pd.DataFrame with step, duration (s) and ct_power(W), the average power CarbonTracker attributes to the step
+    """
+    starts = to_epoch_ns(simpipe_data['start'])
+    stops = to_epoch_ns(simpipe_data['stop'])
+    duration = (stops - starts) / NS_PER_SECOND
+    energy = simpipe_data['energy'].to_numpy(dtype=np.float64)
+    return pd.DataFrame({
+        'step': simpipe_data['step'].to_numpy(),
+        'duration': duration,
+        'ct_power(W)': np.where(duration > 0, energy * 3.6e6 / np.maximum(duration, 1e-9), 0.0),
+    })
+
+
+def step_mean_utilisation(times, utilisation, starts, stops) -> np.ndarray:
+    """
+    Time-weighted mean of a utilisation series (e.g. the cpuUsageSecondsTotal rate of a dry run) over each step.
+
+    Each value covers the interval ending at its timestamp; the first interval is assumed to be as long as the
+    second one. Steps are clipped to the covered time range; steps outside of it get NaN.
+
+    Parameters:
+    times: Timestamps of the utilisation values
+    utilisation: Utilisation values
+    starts, stops: Step start and stop times
+
+    Returns:
+    np.ndarray with the mean utilisation per step, usable as an extra feature column
+    """
+    t = to_epoch_ns(times)
+    u = np.asarray(utilisation, dtype=np.float64)
+    first_interval = t[1] - t[0] if len(t) > 1 else 0
+    knots = np.concatenate([[t[0] - first_interval], t])
+    cumulative = np.concatenate([[0.0], np.cumsum(u * np.diff(knots))])
+    starts, stops = to_epoch_ns(starts), to_epoch_ns(stops)
+    width = np.clip(np.minimum(stops, knots[-1]) - np.maximum(starts, knots[0]), 0, None)
+    integral = np.interp(stops, knots, cumulative) - np.interp(starts, knots, cumulative)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(width > 0, integral / width, np.nan)
+
+
+def load_training_run(job: dict) -> pd.DataFrame:
+    """
+    Step features and measured Tapo step power of one run (a discover_runs entry plus simpipe_datetime_shift).
+
+    Returns:
+    pd.DataFrame with host, conf, runNr, step, duration, ct_power(W), power(W) and energy(kWh) (absolute Tapo energy)
+    """
+    simpipe_data = shift_simpipe_data(read_simpipe_data(job['simpipe']), job.get('simpipe_datetime_shift', 0))
+    with recording(echo=bool(job.get('verbose'))):
+        power_data = get_power_data(job['tapo'])
+        attributed = attribute_step_energy(power_data, get_time_periods(simpipe_data))
+    training = step_features(simpipe_data)
+    training.insert(0, 'runNr', job['runNr'])
+    training.insert(0, 'conf', job['conf'])
+    training.insert(0, 'host', job.get('host', 'mainframe'))
+    training['power(W)'] = attributed['avg_power(W)'].to_numpy()
+    training['energy(kWh)'] = attributed['absolute_energy(kWh)'].to_numpy()
+    return training
+
+
+def build_training_set(
+        data_dir: str = DEFAULT_DATA_DIR,
+        surge_time_diffs_path: str = None,
+        host: str = 'mainframe',
+        workers: int = None) -> pd.DataFrame:
+    """
+    Stack the steps of every aligned run (conf-*/runN.dat + power-runN.xls, shifted by surge_time_diffs.dat)
+    into one training table, loading the runs in a process pool.
+    """
+    surge_time_diffs_path = surge_time_diffs_path or os.path.join(data_dir, 'surge_time_diffs.dat')
+    shifts = read_surge_time_diffs(surge_time_diffs_path) if os.path.exists(surge_time_diffs_path) else {}
+    jobs = [{**run, 'host': host, 'simpipe_datetime_shift': shifts.get((run['conf'], run['runNr']), 0)}
+            for run in discover_runs(data_dir)]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        runs = [load_training_run(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, max(len(jobs), 1))) as pool:
+            runs = list(pool.map(load_training_run, jobs))
+    training = pd.concat(runs, ignore_index=True)
+    # steps shorter than a Tapo sample carry no usable power measurement
+    return training[np.isfinite(training['power(W)']) & (training['duration'] > 0)].reset_index(drop=True)
+
+
+def _design_matrix(steps: pd.DataFrame, features: list) -> np.ndarray:
+    return np.column_stack([np.ones(len(steps)), steps[features].to_numpy(dtype=np.float64)])
+
+
+def _normal_equations(design: np.ndarray, y: np.ndarray, w: np.ndarray, groups: np.ndarray, n_groups: int):
+    """
+    Weighted normal equations (X^T W X, X^T W y) of every group, accumulated in one pass over the stacked rows.
+    """
+    k = design.shape[1]
+    xtx = np.zeros((n_groups, k, k))
+    xty = np.zeros((n_groups, k))
+    np.add.at(xtx, groups, w[:, None, None] * design[:, :, None] * design[:, None, :])
+    np.add.at(xty, groups, (w * y)[:, None] * design)
+    return xtx, xty
+
+
+def _solve(xtx: np.ndarray, xty: np.ndarray) -> np.ndarray:
+    # batched pseudo-inverse: a degenerate group (e.g. a single feature value) still gets the least-norm solution
+    return np.einsum('gij,gj->gi', np.linalg.pinv(xtx), xty)
+
+
+def fit_power_model(
+        training: pd.DataFrame,
+        features: list = None,
+        by: str = 'host',
+        weight: str = 'duration') -> pd.DataFrame:
+    """
+    Fit power(W) = intercept + sum(coef * feature) per host with weighted least squares, all hosts at once.
+
+    Steps are weighted by duration (by default), so the fit minimises the error in step energy rather than
+    treating a 2 s step like a 2 h one. The intercept is the idle (baseline) wall power of the host.
+
+    Parameters:
+    training (pd.DataFrame): Output of build_training_set (plus optional extra feature columns)
+    features (list): Feature columns (default: ct_power(W))
+    by (str): Column whose values get separate models, e.g. 'host' or 'conf'
+    weight (str): Weight column, or None for unweighted
+
+    Returns:
+    pd.DataFrame indexed by the by column with intercept, one coefficient per feature, r2, rmse(W) and steps
+    """
+    features = features or DEFAULT_FEATURES
+    hosts, groups = np.unique(training[by].astype(str).to_numpy(), return_inverse=True)
+    n_groups = len(hosts)
+    design = _design_matrix(training, features)
+    y = training['power(W)'].to_numpy(dtype=np.float64)
+    w = training[weight].to_numpy(dtype=np.float64) if weight else np.ones(len(y))
+
+    coef = _solve(*_normal_equations(design, y, w, groups, n_groups))
+    residual = y - np.einsum('ij,ij->i', design, coef[groups])
+    total_weight = np.bincount(groups, w, n_groups)
+    mean = np.bincount(groups, w * y, n_groups) / total_weight
+    ss_res = np.bincount(groups, w * residual ** 2, n_groups)
+    ss_tot = np.bincount(groups, w * (y - mean[groups]) ** 2, n_groups)
+
+    model = pd.DataFrame(coef, index=pd.Index(hosts, name=by), columns=['intercept'] + list(features))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        model['r2'] = 1 - ss_res / ss_tot
+    model['rmse(W)'] = np.sqrt(ss_res / total_weight)
+    model['steps'] = np.bincount(groups, minlength=n_groups)
+    return model
+
+
+def predict_step_power(model: pd.DataFrame, steps: pd.DataFrame, by: str = None) -> np.ndarray:
+    """
+    Predicted wall power (W) of every step row.
+
+    Parameters:
+    model (pd.DataFrame): Output of fit_power_model
+    steps (pd.DataFrame): Step rows with the feature columns (e.g. step_features of a dry run) and, if the
+        model has more than one host, the by column
+    by (str): Host column of steps (default: the model's index name)
+    """
+    features = [c for c in model.columns if c not in ['intercept'] + MODEL_STATS]
+    by = by or model.index.name
+    if by in steps:
+        keys = steps[by].astype(str).to_numpy()
+        unknown = sorted(set(keys) - set(model.index))
+        if unknown:
+            raise ValueError(f"No power model for {by} {', '.join(unknown)}")
+        coef = model.loc[keys, ['intercept'] + features].to_numpy(dtype=np.float64)
+    elif len(model) == 1:
+        coef = np.repeat(model[['intercept'] + features].to_numpy(dtype=np.float64), len(steps), axis=0)
+    else:
+        raise ValueError(f"steps need a {by} column to choose between {len(model)} power models")
+    return np.einsum('ij,ij->i', _design_matrix(steps, features), coef)
+
+
+def predict_step_energy(model: pd.DataFrame, steps: pd.DataFrame, by: str = None) -> pd.DataFrame:
+    """
+    Predicted absolute wall energy per step of a (dry) run from its features alone.
+
+    Returns:
+    copy of steps with power(W) and energy(kWh) predictions
+    """
+    predicted = steps.copy()
+    predicted['power(W)'] = predict_step_power(model, steps, by)
+    predicted['energy(kWh)'] = predicted['power(W)'] * predicted['duration'] / 3.6e6
+    return predicted
+
+
+def leave_one_run_out(
+        training: pd.DataFrame,
+        features: list = None,
+        by: str = 'host',
+        weight: str = 'duration') -> pd.DataFrame:
+    """
+    Total energy of every run predicted by a model fitted on all other runs of its host.
+
+    All held-out models are solved in one batch: each run's normal equations are subtracted from its host's.
+
+    Returns:
+    pd.DataFrame with conf, runNr, measured_energy(kWh), predicted_energy(kWh) and error(%)
+    (NaN if the host has no other run)
+    """
+    features = features or DEFAULT_FEATURES
+    design = _design_matrix(training, features)
+    y = training['power(W)'].to_numpy(dtype=np.float64)
+    w = training[weight].to_numpy(dtype=np.float64) if weight else np.ones(len(y))
+    _, host_groups = np.unique(training[by].astype(str).to_numpy(), return_inverse=True)
+    run_keys = training['conf'].astype(str) + '/' + training['runNr'].astype(str)
+    runs, run_groups = np.unique(run_keys.to_numpy(), return_inverse=True)
+
+    host_xtx, host_xty = _normal_equations(design, y, w, host_groups, host_groups.max() + 1)
+    run_xtx, run_xty = _normal_equations(design, y, w, run_groups, len(runs))
+    run_host = np.zeros(len(runs), dtype=np.int64)
+    run_host[run_groups] = host_groups
+    coef = _solve(host_xtx[run_host] - run_xtx, host_xty[run_host] - run_xty)
+
+    duration = training['duration'].to_numpy(dtype=np.float64)
+    predicted_power = np.einsum('ij,ij->i', design, coef[run_groups])
+    predicted = np.bincount(run_groups, predicted_power * duration / 3.6e6, len(runs))
+    measured = np.bincount(run_groups, training['energy(kWh)'].to_numpy(dtype=np.float64), len(runs))
+    runs_per_host = np.bincount(run_host)
+    predicted[runs_per_host[run_host] < 2] = np.nan
+    conf, run_nr = zip(*(r.split('/') for r in runs))
+    return pd.DataFrame({
+        'conf': conf,
+        'runNr': run_nr,
+        'measured_energy(kWh)': measured,
+        'predicted_energy(kWh)': predicted,
+        'error(%)': (predicted - measured) / measured * 100,
+    })
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Fit the CPU activity -> wall power model on all aligned runs.")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="directory with the conf-* directories")
+    parser.add_argument("--surge-time-diffs", default=None, help="surge_time_diffs.dat with per-run shifts in minutes")
+    parser.add_argument("--per-conf", action="store_true", help="fit one model per conf instead of one per host")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes for loading (default: all cores)")
+    parser.add_argument("--output", default=None, help="write the model coefficients to this CSV")
+    parser.add_argument("--predict", nargs="*", default=[], metavar="RUN_DAT",
+                        help="runN.dat files to predict Tapo step energy for")
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    training = build_training_set(args.data_dir, args.surge_time_diffs, workers=args.workers)
+    t1 = time.perf_counter()
+    by = 'conf' if args.per_conf else 'host'
+    model = fit_power_model(training, by=by)
+    errors = leave_one_run_out(training, by=by)
+    t2 = time.perf_counter()
+
+    print(model.to_string())
+    print(f"\nLeave-one-run-out total energy error: mean |error| {errors['error(%)'].abs().mean():.2f} %")
+    print(errors.to_string(index=False))
+    print(f"\nLoaded {len(training)} steps of {errors.shape[0]} runs in {t1 - t0:.2f} s, fitted and validated in {t2 - t1:.3f} s")
+    if args.output:
+        model.to_csv(args.output)
+
+    for path in args.predict:
+        steps = step_features(read_simpipe_data(path))
+        if by == 'conf':
+            steps['conf'] = os.path.basename(os.path.dirname(os.path.abspath(path)))
+        predicted = predict_step_energy(model, steps)
+        print(f"\n{path}: predicted Tapo energy {predicted['energy(kWh)'].sum():.4f} kWh")
+        print(predicted.to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
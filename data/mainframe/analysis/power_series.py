@@ -0,0 +1,453 @@
+### Sorted-time, array-backed Tapo power data (in memory or memory-mapped) and range queries over it
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+COLUMNS = ('Date', 'Power(W)', 'Energy(kWh)')
+STORAGE_VERSION = 1
+
+
+def to_epoch_ns(timestamps) -> np.ndarray:
+    """
+    Convert a timestamp, or a list/array of timestamps (str, datetime, pd.Timestamp), to int64 epoch nanoseconds.
+    Timezone-aware values are made timezone-naive first, like elsewhere in the analysis.
+    """
+    scalar = np.ndim(timestamps) == 0
+    converted = pd.to_datetime([timestamps] if scalar else list(timestamps))
+    if converted.tz is not None:
+        converted = converted.tz_localize(None)
+    ns = np.asarray(converted, dtype='datetime64[ns]').view(np.int64)
+    return ns[0] if scalar else ns
+
+
+class PowerSeries:
+    """
+    Power data as contiguous arrays with the 'Date' column kept as sorted int64 nanoseconds, so that time windows
+    and neighbouring samples are found with binary search instead of full-frame masks.
+
+    A PowerSeries either wraps a DataFrame (PowerSeries(df): the arrays are views of its columns, nothing is copied)
+    or is compact (from_arrays, compact, open): int64 epoch ns timestamps and float32 power, with the energy derived
+    from power and the sampling intervals on first use, i.e. 12 bytes per sample. Compact series can be saved and
+    opened memory-mapped, so that many runs can be opened at once while only the pages that are read get loaded.
+
+    Slices (slice, window) are views. Columns are available by name (series['Power(W)'] is a pd.Series), so the
+    analysis functions accept a PowerSeries wherever they accept a DataFrame from get_power_data.
+
+    Parameters:
+    df (pd.DataFrame): DataFrame with Date, Power(W), Energy(kWh) columns (e.g. from get_power_data)
+    """
+    __slots__ = ('dates', 'power', 'origin', '_energy', '_derived_energy', '_frame', '_range_index', '_rollup')
+
+    def __init__(self, df: pd.DataFrame):
+        if not df['Date'].is_monotonic_increasing:
+            df = df.sort_values('Date', kind='stable')
+        self._frame = df
+        self.dates = np.asarray(df['Date'].to_numpy(), dtype='datetime64[ns]').view(np.int64)
+        self.power = df['Power(W)'].to_numpy()
+        self._energy = df['Energy(kWh)'].to_numpy() if 'Energy(kWh)' in df.columns else None
+        self.origin = None
+        self._derived_energy = None
+        self._range_index = None
+        self._rollup = None
+
+    @classmethod
+    def from_arrays(cls, dates, power, energy=None, origin: int = None) -> 'PowerSeries':
+        """
+        Compact series from arrays (which are used as they are if they already have the right dtype, e.g. memmaps).
+
+        Parameters:
+        dates: Sorted timestamps (int64 epoch ns or datetime64)
+        power: Power (W), stored as float32
+        energy: Energy (kWh) per sample; derived from power on first use if not given
+        origin (int): Epoch ns of the sample before the first one, i.e. the start of the first sample's interval
+            (default: the first interval is as long as the second)
+
+        Returns:
+        PowerSeries
+        """
+        self = cls.__new__(cls)
+        dates = np.asarray(dates)
+        self.dates = dates.astype('datetime64[ns]').view(np.int64) if dates.dtype.kind == 'M' else dates.astype(np.int64, copy=False)
+        self.power = np.asarray(power).astype(np.float32, copy=False)
+        self._energy = None if energy is None else np.asarray(energy).astype(np.float64, copy=False)
+        self.origin = _default_origin(self.dates) if origin is None else origin
+        self._derived_energy = None
+        self._frame = None
+        self._range_index = None
+        self._rollup = None
+        return self
+
+    def compact(self) -> 'PowerSeries':
+        """
+        Compact copy (int64 dates, float32 power). The energy is only kept if it cannot be derived from the power.
+        """
+        dates = np.array(self.dates, dtype=np.int64)
+        power = np.asarray(self.power).astype(np.float32)
+        origin = self.origin if self._frame is None else _infer_origin(dates, power, self.energy)
+        derived = PowerSeries.from_arrays(dates, power, origin=origin)
+        if origin is not None and np.allclose(derived.energy, self.energy, rtol=1e-9, atol=0, equal_nan=True):
+            return derived
+        return PowerSeries.from_arrays(dates, power, energy=np.array(self.energy, dtype=np.float64), origin=derived.origin)
+
+    def save(self, path: str, metadata: dict = None) -> str:
+        """
+        Write the series as a directory of .npy files (dates, power and, if not derivable, energy) plus meta.json.
+
+        Parameters:
+        path (str): Directory to write
+        metadata (dict): Extra JSON-serialisable entries for meta.json
+
+        Returns:
+        str: path
+        """
+        series = self if self._frame is None else self.compact()
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'dates.npy'), np.ascontiguousarray(series.dates))
+        np.save(os.path.join(path, 'power.npy'), np.ascontiguousarray(series.power))
+        energy_path = os.path.join(path, 'energy.npy')
+        if series._energy is not None:
+            np.save(energy_path, np.ascontiguousarray(series._energy))
+        elif os.path.exists(energy_path):
+            os.remove(energy_path)
+        meta = {**(metadata or {}), 'version': STORAGE_VERSION, 'samples': len(series),
+                'origin': None if series.origin is None else int(series.origin)}
+        # meta.json last: a directory without it is incomplete
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        return path
+
+    @classmethod
+    def open(cls, path: str, mmap: bool = True) -> 'PowerSeries':
+        """
+        Open a series written by save, memory-mapped (read-only) unless mmap is False.
+        """
+        meta = cls.read_metadata(path)
+        mode = 'r' if mmap else None
+        energy_path = os.path.join(path, 'energy.npy')
+        return cls.from_arrays(
+            np.load(os.path.join(path, 'dates.npy'), mmap_mode=mode),
+            np.load(os.path.join(path, 'power.npy'), mmap_mode=mode),
+            energy=np.load(energy_path, mmap_mode=mode) if os.path.exists(energy_path) else None,
+            origin=meta['origin'])
+
+    @staticmethod
+    def read_metadata(path: str) -> dict:
+        """
+        meta.json of a saved series; raises FileNotFoundError if it is missing or ValueError if it is incompatible.
+        """
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta.get('version') != STORAGE_VERSION:
+            raise ValueError(f"Unsupported PowerSeries storage version {meta.get('version')} in {path}")
+        return meta
+
+    @property
+    def energy(self) -> np.ndarray:
+        """
+        Energy (kWh) per sample: power times the interval since the previous sample, as in get_power_data.
+        """
+        if self._energy is not None:
+            return self._energy
+        if self._derived_energy is None:
+            origin = _default_origin(self.dates) if self.origin is None else self.origin
+            intervals = np.diff(self.dates, prepend=np.int64(origin)) if len(self.dates) else self.dates
+            self._derived_energy = self.power.astype(np.float64) / 1000 * (intervals / 1e9 / 3600)
+        return self._derived_energy
+
+    @property
+    def frame(self) -> pd.DataFrame:
+        """
+        The wrapped DataFrame, or for a compact series a new DataFrame over its arrays.
+        """
+        if self._frame is not None:
+            return self._frame
+        return pd.DataFrame({column: self.column(column) for column in COLUMNS}, copy=False)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Bytes held by the arrays (for a wrapped DataFrame: its columns; for memory-mapped arrays: their file size).
+        """
+        arrays = [self.dates, self.power] + ([self._energy] if self._energy is not None else [])
+        return sum(a.nbytes for a in arrays)
+
+    @property
+    def empty(self) -> bool:
+        return len(self.dates) == 0
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        Array of the Date (datetime64[ns]), Power(W) or Energy(kWh) column.
+        """
+        if name == 'Date':
+            return self.dates.view('datetime64[ns]')
+        if name == 'Power(W)':
+            return self.power
+        if name == 'Energy(kWh)':
+            return self.energy
+        raise KeyError(name)
+
+    def __getitem__(self, name: str) -> pd.Series:
+        if self._frame is not None:
+            return self._frame[name]
+        return pd.Series(self.column(name), name=name, copy=False)
+
+    def slice(self, lo: int, hi: int) -> 'PowerSeries':
+        """
+        View of the rows [lo, hi).
+        """
+        if self._frame is not None:
+            return PowerSeries(self._frame.iloc[lo:hi])
+        view = PowerSeries.from_arrays(
+            self.dates[lo:hi], self.power[lo:hi],
+            energy=None if self._energy is None else self._energy[lo:hi],
+            origin=int(self.dates[lo - 1]) if 0 < lo <= len(self.dates) else self.origin)
+        if self._derived_energy is not None:
+            view._derived_energy = self._derived_energy[lo:hi]
+        return view
+
+    def __len__(self):
+        return len(self.dates)
+
+    @property
+    def range_index(self) -> 'PowerRangeIndex':
+        """
+        PowerRangeIndex over this series, built on first use.
+        """
+        if self._range_index is None:
+            self._range_index = PowerRangeIndex(self)
+        return self._range_index
+
+    @property
+    def rollup(self) -> 'RollupPyramid':
+        """
+        RollupPyramid (multi-resolution aggregates) over this series, built on first use unless one was attached
+        (open_power_series attaches the pyramid stored next to the data).
+        """
+        if self._rollup is None:
+            from rollup import RollupPyramid
+
+            self._rollup = RollupPyramid(self)
+        return self._rollup
+
+    @rollup.setter
+    def rollup(self, pyramid: 'RollupPyramid'):
+        self._rollup = pyramid
+
+    def window_bounds(self, starts, ends) -> (np.ndarray, np.ndarray):
+        """
+        Row positions [lo, hi) of the samples with start <= Date <= end, for one or many windows.
+
+        Parameters:
+        starts, ends: Window bounds (timestamps or int64 epoch ns), scalar or array-like
+
+        Returns:
+        tuple (lo, hi) of int arrays (or ints for scalar input)
+        """
+        lo = np.searchsorted(self.dates, self._ns(starts), side='left')
+        hi = np.searchsorted(self.dates, self._ns(ends), side='right')
+        return lo, np.maximum(hi, lo)
+
+    def window(self, start, end) -> 'PowerSeries':
+        """
+        View of the rows with start <= Date <= end.
+        """
+        lo, hi = self.window_bounds(start, end)
+        return self.slice(lo, hi)
+
+    def last_before(self, timestamps):
+        """
+        Position of the last sample with Date < timestamp, or -1 if there is none.
+        """
+        return np.searchsorted(self.dates, self._ns(timestamps), side='left') - 1
+
+    def first_after(self, timestamps):
+        """
+        Position of the first sample with Date > timestamp, or len(self) if there is none.
+        """
+        return np.searchsorted(self.dates, self._ns(timestamps), side='right')
+
+    def date_at(self, position) -> pd.Timestamp:
+        """
+        Timestamp of the sample at a row position, NaT when the position is out of range.
+        """
+        if 0 <= position < len(self.dates):
+            return pd.Timestamp(self.dates[position])
+        return pd.NaT
+
+    def resolve_periods(self, time_periods: list) -> dict:
+        """
+        Resolve the window and neighbouring samples of every (name, start, end) period in one batched call.
+
+        Parameters:
+        time_periods (list): Tuples (step_name, start_time, stop_time), see get_time_periods
+
+        Returns:
+        dict of int arrays, one entry per period:
+            lo, hi          rows [lo, hi) inside the period
+            before_start    last row before the period start (-1 if none)
+            after_end       first row after the period end (len(self) if none); for a period
+                            with data this is also the first row after its last sample
+        """
+        starts = self._ns([p[1] for p in time_periods])
+        ends = self._ns([p[2] for p in time_periods])
+        lo = np.searchsorted(self.dates, starts, side='left')
+        after_end = np.searchsorted(self.dates, ends, side='right')
+        return {
+            'lo': lo,
+            'hi': np.maximum(after_end, lo),
+            'before_start': lo - 1,
+            'after_end': after_end,
+        }
+
+    @staticmethod
+    def _ns(timestamps):
+        if isinstance(timestamps, (np.ndarray, np.integer)) and np.asarray(timestamps).dtype == np.int64:
+            return timestamps
+        return to_epoch_ns(timestamps)
+
+
+def as_power_series(power_data) -> PowerSeries:
+    """
+    PowerSeries of a DataFrame (wrapped, no copy), or the PowerSeries itself.
+    """
+    return power_data if isinstance(power_data, PowerSeries) else PowerSeries(power_data)
+
+
+def _default_origin(dates: np.ndarray):
+    # start of the first sample's interval when it is not known: the first interval is as long as the second
+    if len(dates) == 0:
+        return None
+    return int(dates[0]) - (int(dates[1] - dates[0]) if len(dates) > 1 else 0)
+
+
+def _infer_origin(dates: np.ndarray, power: np.ndarray, energy: np.ndarray):
+    # start of the first sample's interval, recovered from its energy; None if it cannot be (no power or no samples)
+    if len(dates) == 0 or not power[0] > 0 or not np.isfinite(energy[0]):
+        return None
+    interval_ns = float(energy[0]) * 1000 / float(power[0]) * 3600 * 1e9
+    return int(dates[0]) - int(round(interval_ns))
+
+
+class PowerRangeIndex:
+    """
+    Precomputed range-query index over a PowerSeries.
+
+    Sums (energy, power) come from prefix sums in O(1). Min/max power come from a sparse table
+    over fixed-size blocks plus in-block prefix/suffix extrema, which is O(1) per query and
+    needs O(n) memory instead of the O(n log n) of a plain sparse table. Locating a window by
+    time is a binary search, so a query by timestamps costs O(log n). All queries accept arrays
+    of windows and are evaluated without Python loops.
+
+    Parameters:
+    series (PowerSeries): Power data to index
+    block_size (int): Block length of the min/max structure
+    """
+
+    def __init__(self, series: PowerSeries, block_size: int = 32):
+        self.series = series
+        self.block_size = block_size
+        power = np.asarray(series.power, dtype=np.float64)
+        energy = np.asarray(series.energy, dtype=np.float64)
+        self.power = power
+        self.power_csum = np.concatenate([[0.0], np.cumsum(power)])
+        self.energy_csum = np.concatenate([[0.0], np.cumsum(energy)])
+        self._max = _BlockExtremum(power, block_size, np.maximum, -np.inf)
+        self._min = _BlockExtremum(power, block_size, np.minimum, np.inf)
+
+    def query_positions(self, lo, hi) -> dict:
+        """
+        Statistics over rows [lo, hi) for one or many windows.
+
+        Returns:
+        dict of arrays: count, total_energy, total_power, avg_power, max_power, min_power.
+        Empty windows have count 0, total_energy 0 and NaN power statistics.
+        """
+        lo = np.atleast_1d(np.asarray(lo, dtype=np.int64))
+        hi = np.atleast_1d(np.asarray(hi, dtype=np.int64))
+        count = np.maximum(hi - lo, 0)
+        hi = lo + count
+        total_power = self.power_csum[hi] - self.power_csum[lo]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            avg_power = np.where(count > 0, total_power / count, np.nan)
+        return {
+            'count': count,
+            'total_energy': self.energy_csum[hi] - self.energy_csum[lo],
+            'total_power': total_power,
+            'avg_power': avg_power,
+            'max_power': self._max.query(lo, hi),
+            'min_power': self._min.query(lo, hi),
+        }
+
+    def query(self, starts, ends) -> dict:
+        """
+        Statistics over the samples with start <= Date <= end for one or many windows.
+
+        Parameters:
+        starts, ends: Window bounds (timestamps or int64 epoch ns), scalar or array-like
+
+        Returns:
+        dict of arrays, see query_positions
+        """
+        lo, hi = self.series.window_bounds(starts, ends)
+        return self.query_positions(lo, hi)
+
+
+class _BlockExtremum:
+    # Range max (or min) in O(1): in-block prefix/suffix extrema for the partial blocks at the
+    # window edges, and a sparse table over whole blocks for everything in between.
+
+    def __init__(self, values: np.ndarray, block_size: int, ufunc, fill: float):
+        self.ufunc = ufunc
+        self.fill = fill
+        self.block_size = block_size
+        n = len(values)
+        n_blocks = max(-(-n // block_size), 1)
+        padded = np.full(n_blocks * block_size, fill)
+        padded[:n] = values
+        self.blocks = padded.reshape(n_blocks, block_size)
+        self.prefix = ufunc.accumulate(self.blocks, axis=1).ravel()
+        self.suffix = ufunc.accumulate(self.blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+        levels = [ufunc.reduce(self.blocks, axis=1)]
+        width = 1
+        while 2 * width <= n_blocks:
+            prev = levels[-1]
+            levels.append(ufunc(prev[:-width], prev[width:]))
+            width *= 2
+        self.table = np.full((len(levels), n_blocks), fill)
+        for k, level in enumerate(levels):
+            self.table[k, :len(level)] = level
+
+    def query(self, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+        B = self.block_size
+        out = np.full(len(lo), np.nan)
+        nonempty = hi > lo
+        lo, last = lo[nonempty], hi[nonempty] - 1
+        b_lo, b_hi = lo // B, last // B
+        res = np.full(len(lo), self.fill)
+
+        # windows inside a single block: reduce over a masked (k, B) gather
+        same = b_lo == b_hi
+        if same.any():
+            offsets = np.arange(B)
+            cols = offsets[None, :]
+            rows = self.blocks[b_lo[same]]
+            inside = (cols >= (lo[same] % B)[:, None]) & (cols <= (last[same] % B)[:, None])
+            res[same] = self.ufunc.reduce(np.where(inside, rows, self.fill), axis=1)
+
+        # windows spanning blocks: edge blocks from suffix/prefix, whole blocks from the sparse table
+        cross = ~same
+        if cross.any():
+            r = self.ufunc(self.suffix[lo[cross]], self.prefix[last[cross]])
+            a, b = b_lo[cross] + 1, b_hi[cross] - 1
+            inner = b >= a
+            if inner.any():
+                a, b = a[inner], b[inner]
+                k = np.floor(np.log2(b - a + 1)).astype(np.int64)
+                whole = self.ufunc(self.table[k, a], self.table[k, b - (1 << k) + 1])
+                r[inner] = self.ufunc(r[inner], whole)
+            res[cross] = r
+        out[nonempty] = res
+        return out
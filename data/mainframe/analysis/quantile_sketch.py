@@ -0,0 +1,258 @@
+### Mergeable quantile sketch (KLL) for baseline thresholds and time-windowed rolling baselines
+import math
+
+import numpy as np
+import pandas as pd
+
+from power_series import as_power_series
+
+DEFAULT_K = 200
+_MIN_CAPACITY = 8
+_CAPACITY_DECAY = 2 / 3
+
+
+class QuantileSketch:
+    """
+    KLL quantile sketch (Karnin, Lang, Liberty 2016) over float values.
+
+    Level h holds values that each stand for 2^h inputs. A level that outgrows its capacity (k at the top level,
+    shrinking by 2/3 per level below, at least 8) is sorted and every other value, from a random offset, moves up
+    one level. About 3k values are retained however many are added, and sketches of different parts of the data
+    (blocks of a long log, runs, time windows) can be merged in any order.
+
+    Every estimated quantile is one of the added values, and its rank is within rank_error * n of the requested
+    rank with 99% confidence (about 1.3% for k = 200). The minimum and maximum are kept exactly. Until values have
+    to be compacted the sketch holds all of them and is exact.
+
+    Parameters:
+    k (int): Accuracy parameter; memory grows and the rank error shrinks linearly with k
+    seed (int or np.random.Generator): Random seed of the compaction offsets, or a generator to share with other
+        sketches (copies share their sketch's generator)
+    """
+
+    def __init__(self, k: int = DEFAULT_K, seed=0):
+        self.k = k
+        self.n = 0
+        self.min = np.nan
+        self.max = np.nan
+        self.levels = [np.empty(0, dtype=np.float64)]
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, values) -> 'QuantileSketch':
+        """
+        Add an array of values (NaNs are skipped, like the nan-reductions of compute_baseline_stats).
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return self
+        self.n += len(values)
+        self.min = np.fmin(self.min, values.min())
+        self.max = np.fmax(self.max, values.max())
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        return self._compress()
+
+    def merge(self, other: 'QuantileSketch') -> 'QuantileSketch':
+        """
+        Fold in another sketch. The merged sketch keeps the accuracy of the smaller k.
+        """
+        if other.n == 0:
+            return self
+        self.k = min(self.k, other.k)
+        self.n += other.n
+        self.min = np.fmin(self.min, other.min)
+        self.max = np.fmax(self.max, other.max)
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0, dtype=np.float64))
+        for h, level in enumerate(other.levels):
+            self.levels[h] = np.concatenate([self.levels[h], level])
+        return self._compress()
+
+    def copy(self) -> 'QuantileSketch':
+        sketch = QuantileSketch.__new__(QuantileSketch)
+        sketch.k, sketch.n, sketch.min, sketch.max, sketch._rng = self.k, self.n, self.min, self.max, self._rng
+        # merge and _compress replace levels rather than modifying them, so the arrays can be shared
+        sketch.levels = list(self.levels)
+        return sketch
+
+    def _capacities(self) -> list:
+        top = len(self.levels) - 1
+        return [max(_MIN_CAPACITY, math.ceil(self.k * _CAPACITY_DECAY ** (top - h))) for h in range(top + 1)]
+
+    def _compress(self) -> 'QuantileSketch':
+        # as in the KLL paper: while the sketch holds more than its total capacity, compact the lowest level that is
+        # over its own capacity
+        capacities = self._capacities()
+        while self.retained > sum(capacities):
+            h = next(h for h, level in enumerate(self.levels) if len(level) > capacities[h])
+            if h + 1 == len(self.levels):
+                self.levels.append(np.empty(0, dtype=np.float64))
+                capacities = self._capacities()
+            level = np.sort(self.levels[h])
+            # an odd value out stays on this level
+            keep = len(level) % 2
+            promoted = level[keep + self._rng.integers(2)::2]
+            self.levels[h] = level[:keep]
+            self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+        return self
+
+    @property
+    def retained(self) -> int:
+        return sum(len(level) for level in self.levels)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(level.nbytes for level in self.levels)
+
+    @property
+    def rank_error(self) -> float:
+        """
+        Normalized rank error of a single quantile at 99% confidence (0 while the sketch is exact).
+        """
+        if len(self.levels) == 1:
+            return 0.0
+        # empirical constants of the KLL sketch of Apache DataSketches for the same capacities
+        return 2.296 / self.k ** 0.9723
+
+    def _weights(self) -> np.ndarray:
+        # weight 2^h of every retained value, in the order of np.concatenate(self.levels)
+        return np.repeat(np.left_shift(1, np.arange(len(self.levels), dtype=np.int64)),
+                         [len(level) for level in self.levels])
+
+    def _weighted(self) -> (np.ndarray, np.ndarray):
+        # retained values sorted, with the cumulative number of inputs they stand for
+        values = np.concatenate(self.levels)
+        weights = self._weights()
+        order = np.argsort(values, kind='stable')
+        return values[order], np.cumsum(weights[order])
+
+    def quantiles(self, fractions) -> np.ndarray:
+        """
+        Estimated quantiles (fractions in [0, 1]); 0 and 1 give the exact minimum and maximum.
+        """
+        fractions = np.asarray(fractions, dtype=np.float64)
+        if self.n == 0:
+            return np.full(fractions.shape, np.nan)
+        values, cumulative = self._weighted()
+        # the smallest value with at least fraction * n inputs at or below it (scaled to the retained weight)
+        positions = np.searchsorted(cumulative, fractions * cumulative[-1], side='left')
+        result = values[np.minimum(positions, len(values) - 1)]
+        result = np.where(fractions <= 0, self.min, result)
+        return np.where(fractions >= 1, self.max, result)
+
+    def quantile(self, fraction: float) -> float:
+        return float(self.quantiles([fraction])[0])
+
+    def percentile(self, percentile: float) -> float:
+        return self.quantile(percentile / 100)
+
+    def rank(self, value: float) -> float:
+        """
+        Estimated fraction of the inputs at or below value.
+        """
+        if self.n == 0:
+            return np.nan
+        values, cumulative = self._weighted()
+        position = np.searchsorted(values, value, side='right')
+        return cumulative[position - 1] / cumulative[-1] if position else 0.0
+
+    def mean_below(self, value: float) -> float:
+        """
+        Estimated mean of the inputs at or below value (weighted mean of the retained values).
+        """
+        values = np.concatenate(self.levels)
+        weights = self._weights()
+        selected = values <= value
+        return np.sum(values[selected] * weights[selected]) / np.sum(weights[selected]) if selected.any() else np.nan
+
+
+def baseline_quantiles(sketch: QuantileSketch, percentile_threshold: float = 70.0) -> dict:
+    """
+    Baseline threshold and baseline median from a sketch of the power values (see compute_baseline_stats).
+
+    The baseline median is the median of the values at or below the threshold, i.e. the quantile at half the rank
+    of the threshold.
+
+    Returns:
+    dict with threshold_power, median_power, baseline_fraction (estimated fraction of samples at or below the
+    threshold) and rank_error
+    """
+    threshold = sketch.percentile(percentile_threshold)
+    fraction = sketch.rank(threshold)
+    return {
+        'threshold_power': threshold,
+        'median_power': sketch.quantile(fraction / 2),
+        'baseline_fraction': fraction,
+        'rank_error': sketch.rank_error,
+    }
+
+
+def rolling_baseline(
+        power_data,
+        window: str = '6h',
+        step: str = '1h',
+        percentile_threshold: float = 70.0,
+        k: int = DEFAULT_K) -> pd.DataFrame:
+    """
+    Baseline estimates over sliding time windows, so that a drifting idle draw can be followed across a long
+    measurement campaign.
+
+    The samples are sketched once per step-long block. The blocks are grouped into runs as long as a window, and
+    every block keeps the merge of its run up to it (prefix) and from it to the end of its run (suffix). A window
+    spans at most two runs and is the merge of one suffix and one prefix (van Herk / Gil-Werman), so no window is
+    sorted again and every window costs a single merge however many blocks it holds.
+
+    Parameters:
+    power_data (pd.DataFrame or PowerSeries): Power data from get_power_data
+    window (str): Window length (pandas Timedelta string), a multiple of step
+    step (str): Distance between consecutive windows
+    percentile_threshold (float): Percentile below which power counts as baseline
+    k (int): Accuracy parameter of the sketches, see QuantileSketch
+
+    Returns:
+    pd.DataFrame with start, end, samples, threshold_power, median_power, mean_power (estimated mean of the
+    samples at or below the threshold), baseline_fraction and rank_error, one row per window
+    """
+    series = as_power_series(power_data)
+    columns = ['start', 'end', 'samples', 'threshold_power', 'median_power', 'mean_power',
+               'baseline_fraction', 'rank_error']
+    if series.empty:
+        return pd.DataFrame(columns=columns)
+    step_ns, window_ns = pd.Timedelta(step).value, pd.Timedelta(window).value
+    blocks_per_window = max(1, int(round(window_ns / step_ns)))
+    dates = series.dates
+    origin = dates[0]
+    n_blocks = int((dates[-1] - origin) // step_ns) + 1
+    bounds = np.searchsorted(dates, origin + np.arange(n_blocks + 1) * step_ns, side='left')
+    power = series.power
+    rng = np.random.default_rng(0)
+    sketches = [QuantileSketch(k, rng).update(power[lo:hi]) for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+    # prefix and suffix merges within runs of blocks_per_window blocks
+    prefix, suffix = list(sketches), list(sketches)
+    for b in range(1, n_blocks):
+        if b % blocks_per_window:
+            prefix[b] = prefix[b - 1].copy().merge(sketches[b])
+    for b in range(n_blocks - 2, -1, -1):
+        if (b + 1) % blocks_per_window:
+            suffix[b] = suffix[b + 1].copy().merge(sketches[b])
+
+    rows = []
+    for first in range(max(1, n_blocks - blocks_per_window + 1)):
+        sketch = suffix[first]
+        if first % blocks_per_window:
+            sketch = sketch.copy().merge(prefix[first + blocks_per_window - 1])
+        if sketch.n == 0:
+            continue
+        estimate = baseline_quantiles(sketch, percentile_threshold)
+        rows.append({
+            'start': pd.Timestamp(origin + first * step_ns),
+            'end': pd.Timestamp(origin + (first + blocks_per_window) * step_ns),
+            'samples': sketch.n,
+            'threshold_power': estimate['threshold_power'],
+            'median_power': estimate['median_power'],
+            'mean_power': sketch.mean_below(estimate['threshold_power']),
+            'baseline_fraction': estimate['baseline_fraction'],
+            'rank_error': estimate['rank_error'],
+        })
+    return pd.DataFrame(rows, columns=columns)
@@ -0,0 +1,316 @@
+### Multi-resolution rollup pyramid of a PowerSeries for fast range queries and plots over long histories
+#
+# Every level holds, per non-empty time bucket (1 s, 1 min, 5 min, 1 h by default, aligned to the epoch), the sample
+# count and the sum/min/max of Power(W) and Energy(kWh). A range query covers the inside of the window with whole
+# buckets of the coarsest level that fits, the remaining edges with buckets of the finer levels, and reads raw samples
+# only for what is left at the very edges (less than one bucket of the finest level on each side), so the result is
+# exact while the cost does not grow with the window length. Plots draw the min/max envelope of the coarsest level
+# that still has a bucket per pixel column. Levels that would not hold at least two samples per bucket on average
+# (e.g. 1 s buckets over 5-minute Tapo data) are not built.
+import os
+
+import numpy as np
+import pandas as pd
+
+from power_series import PowerSeries, as_power_series
+
+DEFAULT_RESOLUTIONS = (1, 60, 300, 3600)
+ROLLUP_COLUMNS = ('Power(W)', 'Energy(kWh)')
+ROLLUP_VERSION = 1
+DEFAULT_BLOCK_SIZE = 1 << 20
+FIELDS = ('count', 'power_sum', 'power_min', 'power_max', 'energy_sum', 'energy_min', 'energy_max')
+_REDUCERS = {
+    'count': np.add, 'power_sum': np.add, 'power_min': np.minimum, 'power_max': np.maximum,
+    'energy_sum': np.add, 'energy_min': np.minimum, 'energy_max': np.maximum,
+}
+_PREFIXES = {'Power(W)': 'power', 'Energy(kWh)': 'energy'}
+
+
+def resolution_ns(resolution) -> int:
+    """
+    Resolution in ns from seconds (int/float) or a pandas Timedelta or offset string ('5min', '1h').
+    """
+    if isinstance(resolution, (int, float, np.integer, np.floating)):
+        return int(round(resolution * 1e9))
+    return pd.Timedelta(resolution).value
+
+
+def _merge_buckets(starts: np.ndarray, fields: dict, bucket_ns: int) -> (np.ndarray, dict):
+    # combine consecutive entries (sorted by time) that fall into the same bucket of width bucket_ns
+    if len(starts) == 0:
+        return starts[:0], {name: values[:0] for name, values in fields.items()}
+    ids = starts // bucket_ns
+    first = np.flatnonzero(np.concatenate([[True], ids[1:] != ids[:-1]]))
+    return ids[first] * bucket_ns, {name: _REDUCERS[name].reduceat(values, first) for name, values in fields.items()}
+
+
+class RollupLevel:
+    """
+    Aggregates at one resolution: start (epoch ns) of every non-empty bucket [start, start + resolution_ns) and, per
+    bucket, the sample count and the sum/min/max of power and energy (see FIELDS).
+    """
+    __slots__ = ('resolution_ns', 'starts') + FIELDS
+
+    def __init__(self, resolution_ns: int, starts: np.ndarray, fields: dict):
+        self.resolution_ns = int(resolution_ns)
+        self.starts = starts
+        for name in FIELDS:
+            setattr(self, name, fields[name])
+
+    def __len__(self):
+        return len(self.starts)
+
+    @property
+    def resolution(self) -> pd.Timedelta:
+        return pd.Timedelta(self.resolution_ns, unit='ns')
+
+    @property
+    def nbytes(self) -> int:
+        return self.starts.nbytes + sum(getattr(self, name).nbytes for name in FIELDS)
+
+    def fields(self) -> dict:
+        return {name: getattr(self, name) for name in FIELDS}
+
+    def bucket_range(self, start_ns: int, end_ns: int) -> (int, int):
+        """
+        Positions [i, j) of the buckets starting in [start_ns, end_ns).
+        """
+        return (int(np.searchsorted(self.starts, start_ns, side='left')),
+                int(np.searchsorted(self.starts, end_ns, side='left')))
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        The level as a DataFrame: Date (bucket start), count, sum/mean/min/max of Power(W) and Energy(kWh).
+        """
+        df = pd.DataFrame({'Date': self.starts.view('datetime64[ns]'), 'count': self.count})
+        for column, prefix in _PREFIXES.items():
+            total = getattr(self, f'{prefix}_sum')
+            df[f'{column} sum'] = total
+            df[f'{column} mean'] = total / self.count
+            df[f'{column} min'] = getattr(self, f'{prefix}_min')
+            df[f'{column} max'] = getattr(self, f'{prefix}_max')
+        return df
+
+
+class RollupPyramid:
+    """
+    Rollup levels of a PowerSeries plus the series itself, which is read only at the edges of a query.
+
+    Parameters:
+    series (PowerSeries or pd.DataFrame): Power data (e.g. from open_power_series or get_power_data)
+    resolutions: Bucket widths (seconds, or Timedelta/offset strings), finest first
+    block_size (int): Samples aggregated at a time while building, so a memory-mapped series is read in bounded memory
+    """
+
+    def __init__(self, series, resolutions=DEFAULT_RESOLUTIONS, block_size: int = DEFAULT_BLOCK_SIZE):
+        self.series = as_power_series(series)
+        self.levels = _build_levels(self.series, sorted(resolution_ns(r) for r in resolutions), block_size)
+
+    @classmethod
+    def from_levels(cls, series, levels: list) -> 'RollupPyramid':
+        self = cls.__new__(cls)
+        self.series = as_power_series(series)
+        self.levels = levels
+        return self
+
+    @property
+    def resolutions(self) -> list:
+        """Bucket widths of the built levels, finest first."""
+        return [level.resolution for level in self.levels]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(level.nbytes for level in self.levels)
+
+    def level_for(self, resolution):
+        """
+        The coarsest level with buckets no wider than resolution, or None if there is none.
+        """
+        max_ns = resolution_ns(resolution)
+        fitting = [level for level in self.levels if level.resolution_ns <= max_ns]
+        return fitting[-1] if fitting else None
+
+    def _cover(self, start_ns: int, stop_ns: int) -> (list, list):
+        # exact decomposition of [start_ns, stop_ns): whole buckets (level, i, j), coarse to fine, then the raw row
+        # ranges (lo, hi) left over at the edges
+        buckets = []
+        pending = [(start_ns, stop_ns)]
+        for level in reversed(self.levels):
+            width = level.resolution_ns
+            rest = []
+            for a, b in pending:
+                first, last = -(-a // width) * width, (b // width) * width
+                if first >= last:
+                    rest.append((a, b))
+                    continue
+                buckets.append((level, *level.bucket_range(first, last)))
+                if a < first:
+                    rest.append((a, first))
+                if last < b:
+                    rest.append((last, b))
+            pending = rest
+        dates = self.series.dates
+        rows = [(int(np.searchsorted(dates, a, side='left')), int(np.searchsorted(dates, b, side='left')))
+                for a, b in pending]
+        return buckets, rows
+
+    def _query_one(self, start_ns: int, end_ns: int, level: RollupLevel = None) -> tuple:
+        n, total_power, total_energy, max_power, min_power = 0, 0.0, 0.0, -np.inf, np.inf
+        if level is not None:
+            # approximate: window edges rounded to the nearest bucket boundary of the level
+            half = level.resolution_ns // 2
+            width = level.resolution_ns
+            buckets = [(level, *level.bucket_range((start_ns + half) // width * width,
+                                                   (end_ns + 1 + half) // width * width))]
+            rows = []
+        else:
+            buckets, rows = self._cover(start_ns, end_ns + 1)
+        for bucket_level, i, j in buckets:
+            if j > i:
+                n += int(bucket_level.count[i:j].sum())
+                total_power += float(bucket_level.power_sum[i:j].sum())
+                total_energy += float(bucket_level.energy_sum[i:j].sum())
+                max_power = max(max_power, float(bucket_level.power_max[i:j].max()))
+                min_power = min(min_power, float(bucket_level.power_min[i:j].min()))
+        for lo, hi in rows:
+            if hi > lo:
+                edge = self.series.slice(lo, hi)
+                power = np.asarray(edge.power, dtype=np.float64)
+                n += hi - lo
+                total_power += float(power.sum())
+                total_energy += float(np.sum(edge.energy))
+                max_power = max(max_power, float(power.max()))
+                min_power = min(min_power, float(power.min()))
+        if n == 0:
+            return 0, 0.0, 0.0, np.nan, np.nan, np.nan
+        return n, total_energy, total_power, total_power / n, max_power, min_power
+
+    def query(self, starts, ends, resolution=None) -> dict:
+        """
+        Statistics over the samples with start <= Date <= end for one or many windows, like PowerRangeIndex.query.
+
+        Parameters:
+        starts, ends: Window bounds (timestamps or int64 epoch ns), scalar or array-like
+        resolution: Precision the caller is content with (seconds or Timedelta/offset string). If given, windows are
+            answered from the coarsest level with buckets no wider than that, their edges rounded to the nearest
+            bucket boundary (i.e. moved by at most resolution / 2), and no raw samples are read. Default: exact.
+
+        Returns:
+        dict of arrays: count, total_energy, total_power, avg_power, max_power, min_power.
+        Empty windows have count 0, total_energy 0 and NaN power statistics.
+        """
+        starts = np.atleast_1d(self.series._ns(starts))
+        ends = np.atleast_1d(self.series._ns(ends))
+        level = None if resolution is None else self.level_for(resolution)
+        results = [self._query_one(int(s), int(e), level) for s, e in zip(starts, ends)]
+        keys = ('count', 'total_energy', 'total_power', 'avg_power', 'max_power', 'min_power')
+        columns = list(zip(*results)) if results else [()] * len(keys)
+        return {key: np.array(values, dtype=np.int64 if key == 'count' else np.float64)
+                for key, values in zip(keys, columns)}
+
+    def envelope(self, column: str = 'Power(W)', start=None, end=None, max_points: int = 2000):
+        """
+        Min/max envelope of a column between start and end from the coarsest level with at least max_points / 2
+        buckets in the window, for plotting (every peak and dip is kept, as in decimation.minmax_indices).
+
+        Parameters:
+        column (str): 'Power(W)' or 'Energy(kWh)' (per-sample values)
+        start, end: Window (default: the whole series)
+        max_points (int): Point budget, e.g. from decimation.pixel_budget
+
+        Returns:
+        tuple (x, y) of arrays with the minimum and maximum of every bucket at its centre, or None when the window
+        holds no more than max_points samples or no level is fine enough (draw the raw samples instead)
+        """
+        prefix = _PREFIXES[column]
+        series = self.series
+        if series.empty or max_points is None or max_points <= 0:
+            return None
+        start_ns = int(series.dates[0]) if start is None else int(series._ns(start))
+        end_ns = int(series.dates[-1]) if end is None else int(series._ns(end))
+        lo, hi = series.window_bounds(start_ns, end_ns)
+        if hi - lo <= max_points:
+            return None
+        level = self.level_for(pd.Timedelta(max(end_ns - start_ns, 1) // max(max_points // 2, 1), unit='ns'))
+        if level is None:
+            return None
+        i, j = level.bucket_range(start_ns // level.resolution_ns * level.resolution_ns, end_ns + 1)
+        centres = level.starts[i:j] + level.resolution_ns // 2
+        x = np.repeat(centres, 2).view('datetime64[ns]')
+        y = np.column_stack([getattr(level, f'{prefix}_min')[i:j], getattr(level, f'{prefix}_max')[i:j]]).ravel()
+        return x, y
+
+    def save(self, path: str) -> str:
+        """
+        Write the levels to one .npz file; load checks them against the series they are opened with.
+        """
+        dates = self.series.dates
+        arrays = {'version': np.int64(ROLLUP_VERSION), 'samples': np.int64(len(dates)),
+                  'first_date': np.int64(dates[0] if len(dates) else 0),
+                  'last_date': np.int64(dates[-1] if len(dates) else 0),
+                  'resolutions': np.array([level.resolution_ns for level in self.levels], dtype=np.int64)}
+        for k, level in enumerate(self.levels):
+            arrays[f'level{k}_starts'] = level.starts
+            arrays.update({f'level{k}_{name}': values for name, values in level.fields().items()})
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        # atomic replace so that concurrent readers never see a partial file
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path: str, series) -> 'RollupPyramid':
+        """
+        Levels saved by save, attached to series. Raises OSError if the file is missing or unreadable and ValueError if
+        it does not belong to the series (different sample count or time range) or has another version.
+        """
+        series = as_power_series(series)
+        dates = series.dates
+        with np.load(path, allow_pickle=False) as stored:
+            if int(stored['version']) != ROLLUP_VERSION:
+                raise ValueError(f"Unsupported rollup version {int(stored['version'])} in {path}")
+            if (int(stored['samples']) != len(dates)
+                    or (len(dates) and (int(stored['first_date']) != dates[0] or int(stored['last_date']) != dates[-1]))):
+                raise ValueError(f"Rollup {path} does not match the power series")
+            levels = [RollupLevel(width, stored[f'level{k}_starts'],
+                                  {name: stored[f'level{k}_{name}'] for name in FIELDS})
+                      for k, width in enumerate(stored['resolutions'])]
+        return cls.from_levels(series, levels)
+
+
+def _build_levels(series: PowerSeries, widths: list, block_size: int) -> list:
+    # aggregate block by block: the finest level from the raw samples, every coarser one from the next finer level;
+    # buckets cut by a block boundary are combined when the blocks are joined
+    n = len(series)
+    if n > 1:
+        # skip levels whose buckets would hold fewer than two samples on average
+        sample = series.dates[:min(n, 10_000)]
+        interval = float(np.median(np.diff(sample))) if len(sample) > 1 else 0.0
+        widths = [w for w in widths if w >= 2 * interval]
+    parts = [[] for _ in widths]
+    for lo in range(0, n, block_size):
+        block = series.slice(lo, min(lo + block_size, n))
+        power = np.asarray(block.power, dtype=np.float64)
+        energy = np.asarray(block.energy, dtype=np.float64)
+        raw = (np.asarray(block.dates, dtype=np.int64),
+               {'count': np.ones(len(power), dtype=np.int64),
+                'power_sum': power, 'power_min': power, 'power_max': power,
+                'energy_sum': energy, 'energy_min': energy, 'energy_max': energy})
+        source = raw
+        for k, width in enumerate(widths):
+            # a level nests in the previous one only if its width is a multiple of it
+            if k and width % widths[k - 1]:
+                source = raw
+            source = _merge_buckets(*source, width)
+            parts[k].append(source)
+    levels = []
+    for width, level_parts in zip(widths, parts):
+        starts = np.concatenate([p[0] for p in level_parts]) if level_parts else np.empty(0, dtype=np.int64)
+        fields = {name: (np.concatenate([p[1][name] for p in level_parts]) if level_parts
+                         else np.empty(0, dtype=np.int64 if name == 'count' else np.float64))
+                  for name in FIELDS}
+        if len(level_parts) > 1:
+            starts, fields = _merge_buckets(starts, fields, width)
+        levels.append(RollupLevel(width, starts, fields))
+    return levels
@@ -0,0 +1,265 @@
+### Content-addressed on-disk cache of the analysis chain stages, with least-recently-used eviction
+#
+# Every stage result is stored under a key that hashes the stage name, the code of the analysis modules (the stage
+# function's module and the helpers it calls), the keys (or content digests) of its inputs and its parameters. A
+# downstream key is built from the upstream keys, so changing a parameter recomputes only the stages that depend on
+# it: with a new surge multiplier, the parsed power data, baseline, time periods and step segments are read back from
+# the cache and only detect_power_surges runs again.
+import hashlib
+import json
+import os
+import pickle
+import sys
+
+import numpy as np
+import pandas as pd
+
+from analysis_functions import (
+    compute_baseline_stats,
+    compute_relative_energy_usage,
+    detect_power_surges,
+    divide_power_data_into_step_periods,
+    get_power_data,
+    get_time_periods,
+)
+from instrumentation import annotate, span
+
+STAGE_CACHE_VERSION = 1
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+ENTRY_SUFFIX = ".pkl"
+
+_file_digests = {}
+
+
+def file_digest(path: str) -> str:
+    """
+    SHA-256 of a file's content, remembered per (path, mtime, size) so that unchanged files are hashed once.
+    """
+    st = os.stat(path)
+    memo = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    if memo not in _file_digests:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        _file_digests[memo] = digest.hexdigest()
+    return _file_digests[memo]
+
+
+def frame_digest(df: pd.DataFrame) -> str:
+    """
+    SHA-256 of a DataFrame's columns, dtypes and values.
+    """
+    digest = hashlib.sha256(json.dumps([list(map(str, df.columns)), list(map(str, df.dtypes))]).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def code_digest(function) -> str:
+    """
+    SHA-256 of the source of every module next to the one defining function.
+
+    Stage results depend on the code that computed them, including the helpers the stage function calls (e.g.
+    divide_power_data_into_step_periods through power_series, get_power_data through power_cache), so the whole
+    analysis directory is hashed rather than only the defining module.
+    """
+    directory = os.path.dirname(os.path.abspath(sys.modules[function.__module__].__file__))
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.py'):
+            digest.update(f"{name}\0{file_digest(os.path.join(directory, name))}\0".encode())
+    return digest.hexdigest()
+
+
+class StageCache:
+    """
+    Directory of pickled stage results keyed by content hash.
+
+    Reading an entry marks it as used (its mtime); when the directory grows beyond max_bytes, the least recently used
+    entries are removed. Entries are written atomically, so several processes can share a cache directory.
+
+    Parameters:
+    directory (str): Cache directory (created if missing)
+    max_bytes (int): Size limit of the cache directory
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(stage: str, inputs: list, params: dict = None) -> str:
+        """
+        Key of a stage result: hash of the stage name, its inputs (keys or digests) and its (JSON-serialisable)
+        parameters.
+        """
+        payload = json.dumps([STAGE_CACHE_VERSION, stage, list(inputs), params or {}], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}{ENTRY_SUFFIX}")
+
+    def get(self, key: str):
+        """
+        Cached value of key; raises KeyError if it is not (or no longer) cached.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            raise KeyError(key) from e
+        try:
+            os.utime(path)
+        except OSError:
+            # evicted by another process in the meantime
+            pass
+        return value
+
+    def put(self, key: str, value):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def stage(self, stage: str, function, inputs: list, params: dict = None, *args, **kwargs) -> (object, str):
+        """
+        Result of function(*args, **kwargs) for a stage, from the cache if it holds one for the same code, inputs and
+        parameters.
+
+        Parameters:
+        stage (str): Stage name
+        function: Stage function (the source of its module and the modules next to it is part of the key)
+        inputs (list): Keys of the upstream stages and digests of the input files/frames
+        params (dict): Parameters of the stage
+
+        Returns:
+        tuple (result, key)
+        """
+        key = self.key(stage, [code_digest(function), *inputs], params)
+        with span(f"stage_cache.{stage}"):
+            try:
+                value = self.get(key)
+                self.hits += 1
+                annotate(cache_hit=True)
+            except KeyError:
+                self.misses += 1
+                annotate(cache_hit=False)
+                value = function(*args, **kwargs)
+                self.put(key, value)
+        return value, key
+
+    def entries(self) -> pd.DataFrame:
+        """
+        key, bytes and last_used (pd.Timestamp) of every entry, least recently used first.
+        """
+        rows = []
+        for name in os.listdir(self.directory):
+            if name.endswith(ENTRY_SUFFIX):
+                try:
+                    st = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                rows.append((name[:-len(ENTRY_SUFFIX)], st.st_size, st.st_mtime_ns))
+        entries = pd.DataFrame(rows, columns=['key', 'bytes', 'last_used']).sort_values('last_used', kind='stable')
+        entries['last_used'] = pd.to_datetime(entries['last_used'])
+        return entries.reset_index(drop=True)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.entries()['bytes'].sum())
+
+    def evict(self, max_bytes: int = None) -> int:
+        """
+        Remove least recently used entries until the cache holds at most max_bytes (default: the cache's limit).
+        Returns the number of removed entries.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = self.entries()
+        excess = entries['bytes'].sum() - max_bytes
+        if excess <= 0:
+            return 0
+        # oldest entries first, until the excess is covered
+        remove = entries['key'][:np.searchsorted(entries['bytes'].cumsum().to_numpy(), excess) + 1]
+        for key in remove:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+        return len(remove)
+
+    def clear(self) -> int:
+        return self.evict(0)
+
+
+def cached_power_data(cache: StageCache, tapo_path: str) -> (pd.DataFrame, str):
+    """
+    get_power_data of a Tapo export through the cache, keyed by the export's content. Returns (power_data, key).
+    """
+    return cache.stage('power_data', get_power_data, [file_digest(tapo_path)], None, tapo_path)
+
+
+def cached_chain(
+        cache: StageCache,
+        tapo_path: str,
+        simpipe_data: pd.DataFrame,
+        percentile_threshold: float = 70,
+        surge_threshold_multiplier: float = 1.2,
+        min_duration_minutes: float = 10,
+        detect_surges: bool = True) -> dict:
+    """
+    The chain get_power_data -> compute_baseline_stats -> detect_power_surges -> get_time_periods ->
+    divide_power_data_into_step_periods -> compute_relative_energy_usage with every stage memoized in cache.
+
+    Parameters:
+    cache (StageCache): Cache to read and fill
+    tapo_path (str): Tapo .xls export (keyed by content)
+    simpipe_data (pd.DataFrame): CarbonTracker/SIMPIPE steps, already shifted (keyed by content)
+    percentile_threshold (float): See compute_baseline_stats
+    surge_threshold_multiplier, min_duration_minutes (float): See detect_power_surges
+    detect_surges (bool): Also run (or look up) detect_power_surges
+
+    Returns:
+    dict with power_data, baseline_stats, surge_periods and surge_threshold (None without detect_surges),
+    time_periods, segments, relative_energy (DataFrame), baseline_energy, total_absolute_energy,
+    total_relative_energy and keys (stage name -> cache key)
+    """
+    keys = {}
+    power_data, keys['power_data'] = cached_power_data(cache, tapo_path)
+    baseline_stats, keys['baseline_stats'] = cache.stage(
+        'baseline_stats', compute_baseline_stats, [keys['power_data']], {'percentile_threshold': percentile_threshold},
+        df=power_data, percentile_threshold=percentile_threshold, print_stats=True)
+    surge_periods, surge_threshold = None, None
+    if detect_surges:
+        (surge_periods, surge_threshold), keys['surges'] = cache.stage(
+            'surges', detect_power_surges, [keys['power_data'], keys['baseline_stats']],
+            {'surge_threshold_multiplier': surge_threshold_multiplier, 'min_duration_minutes': min_duration_minutes},
+            power_data, baseline_stats, surge_threshold_multiplier=surge_threshold_multiplier,
+            min_duration_minutes=min_duration_minutes)
+    time_periods, keys['time_periods'] = cache.stage(
+        'time_periods', get_time_periods, [frame_digest(simpipe_data)], None, simpipe_data)
+    segments, keys['segments'] = cache.stage(
+        'segments', divide_power_data_into_step_periods, [keys['time_periods'], keys['power_data']], None,
+        time_periods, power_data)
+    (relative_energy, baseline_energy, total_absolute_energy, total_relative_energy), keys['relative_energy'] = cache.stage(
+        'relative_energy', compute_relative_energy_usage,
+        [keys['segments'], keys['time_periods'], keys['baseline_stats']], None,
+        segments, time_periods, baseline_stats)
+    return {
+        'power_data': power_data,
+        'baseline_stats': baseline_stats,
+        'surge_periods': surge_periods,
+        'surge_threshold': surge_threshold,
+        'time_periods': time_periods,
+        'segments': segments,
+        'relative_energy': relative_energy,
+        'baseline_energy': baseline_energy,
+        'total_absolute_energy': total_absolute_energy,
+        'total_relative_energy': total_relative_energy,
+        'keys': keys,
+    }
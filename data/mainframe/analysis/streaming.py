@@ -0,0 +1,179 @@
+### Online (streaming) baseline tracking and power surge detection
+import numpy as np
+import pandas as pd
+
+NS_PER_SECOND = 1_000_000_000
+
+
+class OnlineSurgeDetector:
+    """
+    Incremental counterpart of compute_baseline_stats + detect_power_surges for live plug samples.
+
+    Samples are fed one at a time (update) or in small batches (update_batch). Memory is constant:
+    the baseline is estimated from a ring buffer of the most recent non-surge samples, and an
+    ongoing surge is tracked with running aggregates instead of its raw samples.
+
+    Events are dicts with an 'event' key:
+        surge_start      a sample rose above the surge threshold ('time', 'surge_threshold')
+        surge_end        a surge lasting at least min_duration_minutes ended; carries the same
+                         statistics as an entry of detect_power_surges (except surge_data)
+        surge_cancelled  a surge ended before reaching min_duration_minutes
+
+    Parameters:
+    percentile_threshold (float): Percentile below which power counts as baseline (see compute_baseline_stats)
+    surge_threshold_multiplier (float): Multiplier above baseline mean to consider as surge
+    min_duration_minutes (float): Minimum duration in minutes of a reported surge
+    baseline_window (int): Number of recent non-surge samples used for the baseline estimate
+    baseline_refresh (int): Recompute the baseline estimate every this many samples
+    warmup_samples (int): Samples required before surges are detected (ignored if baseline_stats is given)
+    baseline_stats (dict): Fixed baseline (e.g. from compute_baseline_stats on an earlier run).
+        When given, the baseline is not re-estimated and the detector reproduces detect_power_surges.
+    """
+
+    def __init__(
+            self,
+            percentile_threshold: float = 70.0,
+            surge_threshold_multiplier: float = 1.2,
+            min_duration_minutes: float = 10,
+            baseline_window: int = 2048,
+            baseline_refresh: int = 32,
+            warmup_samples: int = 12,
+            baseline_stats: dict = None):
+        self.percentile_threshold = percentile_threshold
+        self.surge_threshold_multiplier = surge_threshold_multiplier
+        self.min_duration_minutes = min_duration_minutes
+        self.baseline_refresh = baseline_refresh
+        self.warmup_samples = warmup_samples
+        self.fixed_baseline = baseline_stats is not None
+
+        # ring buffer of recent non-surge samples
+        self._power_ring = np.empty(baseline_window)
+        self._energy_ring = np.empty(baseline_window)
+        self._ring_pos = 0
+        self._ring_count = 0
+        self._since_refresh = 0
+
+        self.baseline_stats = dict(baseline_stats) if baseline_stats is not None else None
+        self.surge_threshold = (baseline_stats['mean_power'] * surge_threshold_multiplier
+                                if baseline_stats is not None else None)
+
+        self._last_time = None
+        self.samples_seen = 0
+        self._surge = None
+
+    def update(self, time, power: float, energy: float = None) -> list:
+        """
+        Feed one sample and return the events it triggered.
+
+        Parameters:
+        time: Sample timestamp (str, datetime, pd.Timestamp or int64 epoch ns)
+        power (float): Power in W
+        energy (float): Energy in kWh since the previous sample. Derived from power and the time
+            since the previous sample if not given; the first sample then has no energy and is
+            skipped, as in get_power_data.
+        """
+        t = time if isinstance(time, (int, np.integer)) else pd.Timestamp(time).value
+        power = float(power)
+        previous = self._last_time
+        self._last_time = t
+        if energy is None:
+            if previous is None:
+                return []
+            energy = power / 1000 * ((t - previous) / NS_PER_SECOND / 3600)
+        self.samples_seen += 1
+
+        events = []
+        if self.surge_threshold is not None and power > self.surge_threshold:
+            if self._surge is None:
+                self._surge = {'start': t, 'end': t, 'count': 0, 'power_sum': 0.0, 'energy_sum': 0.0,
+                               'peak': -np.inf, 'min': np.inf, 'threshold': self.surge_threshold}
+                events.append({'event': 'surge_start', 'time': pd.Timestamp(t), 'surge_threshold': self.surge_threshold})
+            s = self._surge
+            s['end'] = t
+            s['count'] += 1
+            s['power_sum'] += power
+            s['energy_sum'] += energy
+            s['peak'] = max(s['peak'], power)
+            s['min'] = min(s['min'], power)
+            return events
+
+        if self._surge is not None:
+            events.append(self._close_surge())
+        if not self.fixed_baseline:
+            self._push_baseline(power, energy)
+        return events
+
+    def update_batch(self, times, powers, energies=None) -> list:
+        """
+        Feed several samples in time order and return all events they triggered.
+        """
+        if isinstance(times, (pd.Series, pd.DatetimeIndex, np.ndarray)):
+            times = np.asarray(pd.to_datetime(times), dtype='datetime64[ns]').view(np.int64)
+        if energies is None:
+            energies = [None] * len(powers)
+        events = []
+        for t, p, e in zip(times, powers, energies):
+            events.extend(self.update(int(t), p, e))
+        return events
+
+    def current_surge(self) -> dict:
+        """
+        Statistics of the surge in progress (None if there is none), e.g. to flag a run while it executes.
+        """
+        if self._surge is None:
+            return None
+        return self._surge_info(self._surge)
+
+    def _close_surge(self) -> dict:
+        info = self._surge_info(self._surge)
+        self._surge = None
+        if info['duration_minutes'] >= self.min_duration_minutes:
+            return {'event': 'surge_end', **info}
+        return {'event': 'surge_cancelled', **info}
+
+    def _surge_info(self, s: dict) -> dict:
+        duration = (s['end'] - s['start']) / NS_PER_SECOND / 60
+        mean_energy = self.baseline_stats['mean_energy'] if self.baseline_stats else 0.0
+        return {
+            'start_time': pd.Timestamp(s['start']),
+            'end_time': pd.Timestamp(s['end']),
+            'duration_minutes': duration,
+            'peak_power': s['peak'],
+            'avg_power': s['power_sum'] / s['count'],
+            'min_power': s['min'],
+            'total_energy': s['energy_sum'],
+            'data_points': s['count'],
+            'avg_energy_per_point': s['energy_sum'] / s['count'],
+            'energy_above_baseline': s['energy_sum'] - s['count'] * mean_energy,
+            'surge_threshold': s['threshold'],
+        }
+
+    def _push_baseline(self, power: float, energy: float):
+        size = len(self._power_ring)
+        self._power_ring[self._ring_pos] = power
+        self._energy_ring[self._ring_pos] = energy
+        self._ring_pos = (self._ring_pos + 1) % size
+        self._ring_count = min(self._ring_count + 1, size)
+        self._since_refresh += 1
+        if self._ring_count >= self.warmup_samples and (
+                self.baseline_stats is None or self._since_refresh >= self.baseline_refresh):
+            self._refresh_baseline()
+
+    def _refresh_baseline(self):
+        self._since_refresh = 0
+        power = self._power_ring[:self._ring_count]
+        energy = self._energy_ring[:self._ring_count]
+        threshold = np.percentile(power, self.percentile_threshold)
+        mask = power <= threshold
+        self.baseline_stats = {
+            'threshold_power': threshold,
+            'baseline_periods': int(mask.sum()),
+            'total_periods': self._ring_count,
+            'mean_power': power[mask].mean(),
+            'median_power': np.median(power[mask]),
+            'std_power': power[mask].std(ddof=1) if mask.sum() > 1 else np.nan,
+            'min_power': power[mask].min(),
+            'max_power': power[mask].max(),
+            'mean_energy': energy[mask].mean(),
+        }
+        self.surge_threshold = self.baseline_stats['mean_power'] * self.surge_threshold_multiplier
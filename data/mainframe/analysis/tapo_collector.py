@@ -0,0 +1,330 @@
+### Asyncio collector polling Tapo plugs into append-only power logs, with a local stand-in plug for testing
+#
+# Usage (from data/mainframe/analysis):
+#   python tapo_collector.py --plug mainframe=192.168.1.50:80 --log-dir ../data/live            # poll every second
+#   python tapo_collector.py --stand-in 3 --interval 0.2 --duration 10 --log-dir /tmp/live       # no plug needed
+#
+# Every plug is polled by its own task on a fixed schedule (a tick that is missed while waiting for a slow plug is
+# skipped, not made up), so one slow or unreachable plug does not delay the others. Samples are collected in memory
+# and written to one power log per plug (<log-dir>/<name>.plog, see power_log.py) in batches every flush interval,
+# in a worker thread so that the event loop is never blocked by the disk. read_power_log opens a log as a PowerSeries
+# that every analysis function accepts, also while the collector is still writing it.
+#
+# The plugs are asked for get_energy_usage as a JSON request (POST /app) and report current_power in mW, which is
+# what the stand-in plug implements. A real P115 wraps this request in its authenticated, encrypted local protocol
+# (KLAP); pass collect a reader coroutine built on a Tapo client library to poll real plugs.
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from power_log import LOG_SUFFIX, PowerLogWriter, read_power_log
+
+DEFAULT_INTERVAL = 1.0
+DEFAULT_FLUSH_INTERVAL = 5.0
+DEFAULT_TIMEOUT = 2.0
+DEFAULT_PATH = "/app"
+ENERGY_USAGE_REQUEST = {'method': 'get_energy_usage'}
+
+
+def parse_address(address: str) -> (str, int, str):
+    """
+    Split 'host[:port][/path]' into host, port (default 80) and path (default /app).
+    """
+    address, slash, path = address.partition('/')
+    host, _, port = address.rpartition(':') if ':' in address else (address, '', '80')
+    return host, int(port), f"/{path}" if slash else DEFAULT_PATH
+
+
+async def post_json(address: str, payload: dict, timeout: float = DEFAULT_TIMEOUT) -> dict:
+    """
+    POST a JSON payload over a fresh HTTP/1.1 connection (asyncio streams) and return the decoded JSON response.
+
+    Raises OSError if the connection fails, asyncio.TimeoutError after timeout seconds, EOFError
+    (asyncio.IncompleteReadError) if the plug closes the connection before the end of the body, and ValueError for a
+    non-200 response or a body that is not JSON.
+    """
+    host, port, path = parse_address(address)
+    body = json.dumps(payload).encode()
+    async with asyncio.timeout(timeout):
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            writer.write(f"POST {path} HTTP/1.1\r\nHost: {host}:{port}\r\nContent-Type: application/json\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+            status = (await reader.readline()).decode('latin-1').split()
+            if len(status) < 2 or status[1] != '200':
+                raise ValueError(f"{address}: unexpected response {' '.join(status)!r}")
+            length = None
+            while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                name, _, value = line.decode('latin-1').partition(':')
+                if name.strip().lower() == 'content-length':
+                    length = int(value)
+            data = await (reader.readexactly(length) if length is not None else reader.read())
+        finally:
+            writer.close()
+    return json.loads(data)
+
+
+async def read_power(address: str, timeout: float = DEFAULT_TIMEOUT) -> float:
+    """
+    Current power (W) of a plug from its get_energy_usage response (current_power in mW).
+
+    Raises ValueError for an error code or a response without a numeric current_power (besides the errors of
+    post_json).
+    """
+    response = await post_json(address, ENERGY_USAGE_REQUEST, timeout)
+    if not isinstance(response, dict):
+        raise ValueError(f"{address}: malformed response {str(response)[:80]!r}")
+    if response.get('error_code', 0) != 0:
+        raise ValueError(f"{address}: error_code {response['error_code']}")
+    result = response.get('result')
+    current_power = result.get('current_power') if isinstance(result, dict) else None
+    if isinstance(current_power, bool) or not isinstance(current_power, (int, float)):
+        raise ValueError(f"{address}: no numeric current_power in {str(response)[:80]!r}")
+    return current_power / 1000
+
+
+async def _poll(address: str, reader, interval: float, start: float, stop: float,
+                buffer: list, stats: dict, timeout: float):
+    loop = asyncio.get_running_loop()
+    tick = 0
+    while stop is None or start + tick * interval < stop:
+        delay = start + tick * interval - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        sampled = time.time_ns()
+        try:
+            power = await asyncio.wait_for(reader(address), timeout)
+        except (OSError, EOFError, asyncio.TimeoutError, ValueError, KeyError, TypeError):
+            # a failed or malformed poll only costs this plug its sample
+            stats['errors'] += 1
+        else:
+            buffer.append((sampled, power))
+            stats['samples'] += 1
+        # the next tick that is still ahead
+        tick = max(tick + 1, int((loop.time() - start) / interval) + 1)
+
+
+def _write_batches(writers: dict, batches: dict, sync: bool):
+    for name, batch in batches.items():
+        if batch:
+            times, powers = zip(*batch)
+            writers[name].append(times, powers)
+            writers[name].flush(sync)
+
+
+async def _flush(writers: dict, buffers: dict, sync: bool):
+    # swap the buffers first: the pollers keep appending to new lists while the batch is written
+    batches = {name: buffer[:] for name, buffer in buffers.items()}
+    for name, batch in batches.items():
+        del buffers[name][:len(batch)]
+    await asyncio.to_thread(_write_batches, writers, batches, sync)
+
+
+async def collect(
+        plugs: dict,
+        log_dir: str,
+        interval: float = DEFAULT_INTERVAL,
+        duration: float = None,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        reader=read_power,
+        timeout: float = DEFAULT_TIMEOUT,
+        sync: bool = False) -> dict:
+    """
+    Poll plugs concurrently and append their samples to one power log per plug.
+
+    Runs for duration seconds, or until cancelled; the samples collected so far are written either way.
+
+    Parameters:
+    plugs (dict): Plug name -> address ('host[:port][/path]'); the name is the log's file name
+    log_dir (str): Directory of the power logs (appended to if they exist)
+    interval (float): Seconds between polls of every plug
+    duration (float): Seconds to collect (None: until cancelled)
+    flush_interval (float): Seconds between batched writes
+    reader: Coroutine function address -> power (W); read_power by default
+    timeout (float): Seconds before a poll counts as failed
+    sync (bool): fsync the logs after every batch
+
+    Returns:
+    dict plug name -> dict with path, samples and errors (failed polls)
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    writers = {name: PowerLogWriter(os.path.join(log_dir, f"{name}{LOG_SUFFIX}")) for name in plugs}
+    buffers = {name: [] for name in plugs}
+    stats = {name: {'path': writers[name].path, 'samples': 0, 'errors': 0} for name in plugs}
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    stop = None if duration is None else start + duration
+    pollers = [asyncio.create_task(_poll(address, reader, interval, start, stop, buffers[name], stats[name],
+                                         timeout))
+               for name, address in plugs.items()]
+
+    done = asyncio.Event()
+
+    async def flush_periodically():
+        # one writer task, so that batches reach the logs in order; the last batch is written after done is set
+        while not done.is_set():
+            try:
+                await asyncio.wait_for(done.wait(), flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await _flush(writers, buffers, sync)
+
+    flusher = asyncio.create_task(flush_periodically())
+    try:
+        await asyncio.gather(*pollers)
+    finally:
+        for task in pollers:
+            task.cancel()
+        await asyncio.gather(*pollers, return_exceptions=True)
+        done.set()
+        try:
+            await flusher
+        finally:
+            for writer in writers.values():
+                writer.close()
+    return stats
+
+
+def synthetic_power(base: float = 200.0, surge: float = 120.0, period: float = 60.0, noise: float = 2.0,
+                    seed: int = 0):
+    """
+    Power profile (epoch seconds -> W) for a stand-in plug: an idle draw with a surge in the second half of every
+    period, plus Gaussian noise.
+    """
+    rng = np.random.default_rng(seed)
+
+    def power(t: float) -> float:
+        return base + (surge if t % period >= period / 2 else 0.0) + rng.normal(0.0, noise)
+    return power
+
+
+class StandInPlug:
+    """
+    Local HTTP server answering get_energy_usage like a Tapo plug, so that the collector can be run and tested
+    without a device.
+
+    Parameters:
+    power: Function epoch seconds -> power (W); synthetic_power() by default
+    host (str): Address to listen on
+    port (int): Port (0: any free port, see address)
+    latency (float): Seconds to wait before answering
+    failure_rate (float): Fraction of requests answered with error_code -1
+    seed (int): Random seed of the failures
+    """
+
+    def __init__(self, power=None, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0,
+                 failure_rate: float = 0.0, seed: int = 0):
+        self.power = power or synthetic_power(seed=seed)
+        self.host, self.port = host, port
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self._rng = np.random.default_rng(seed)
+        self._server = None
+
+    @property
+    def address(self) -> str:
+        return f"{self.host}:{self.port}{DEFAULT_PATH}"
+
+    async def start(self) -> 'StandInPlug':
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def __aenter__(self) -> 'StandInPlug':
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = (await reader.readline()).decode('latin-1').split()
+            length = 0
+            while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                name, _, value = line.decode('latin-1').partition(':')
+                if name.strip().lower() == 'content-length':
+                    length = int(value)
+            payload = json.loads(await reader.readexactly(length)) if length else {}
+            self.requests += 1
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if len(request) < 2 or request[0] != 'POST' or payload.get('method') != 'get_energy_usage':
+                response = {'error_code': -1002}
+            elif self._rng.random() < self.failure_rate:
+                response = {'error_code': -1}
+            else:
+                response = {'error_code': 0, 'result': {'current_power': int(round(self.power(time.time()) * 1000))}}
+            body = json.dumps(response).encode()
+            writer.write(f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                         f"Connection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # broken request, client gone, or the server is shut down while answering
+            pass
+        finally:
+            writer.close()
+
+
+async def _collect_from_stand_ins(count: int, log_dir: str, **kwargs) -> dict:
+    plugs = [await StandInPlug(seed=i).start() for i in range(count)]
+    try:
+        return await collect({f"stand-in-{i}": plug.address for i, plug in enumerate(plugs)}, log_dir, **kwargs)
+    finally:
+        for plug in plugs:
+            await plug.close()
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Poll Tapo plugs into append-only power logs.")
+    parser.add_argument("--plug", action="append", default=[], metavar="NAME=HOST[:PORT][/PATH]",
+                        help="plug to poll (repeatable)")
+    parser.add_argument("--stand-in", type=int, default=0, metavar="N", help="poll N local stand-in plugs instead")
+    parser.add_argument("--log-dir", required=True, help="directory of the power logs")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL, help="seconds between polls")
+    parser.add_argument("--duration", type=float, default=None, help="seconds to collect (default: until Ctrl-C)")
+    parser.add_argument("--flush-interval", type=float, default=DEFAULT_FLUSH_INTERVAL, help="seconds between writes")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="seconds before a poll fails")
+    parser.add_argument("--sync", action="store_true", help="fsync the logs after every write")
+    args = parser.parse_args(argv)
+    if not args.plug and not args.stand_in:
+        parser.error("give --plug or --stand-in")
+
+    options = dict(interval=args.interval, duration=args.duration, flush_interval=args.flush_interval,
+                   timeout=args.timeout, sync=args.sync)
+    if args.stand_in:
+        run = _collect_from_stand_ins(args.stand_in, args.log_dir, **options)
+    else:
+        plugs = dict(plug.split('=', 1) for plug in args.plug)
+        run = collect(plugs, args.log_dir, **options)
+    t0 = time.perf_counter()
+    try:
+        stats = asyncio.run(run)
+    except KeyboardInterrupt:
+        # collect has written the samples of the interrupted run
+        stats = {name[:-len(LOG_SUFFIX)]: {'path': os.path.join(args.log_dir, name), 'samples': None, 'errors': None}
+                 for name in sorted(os.listdir(args.log_dir)) if name.endswith(LOG_SUFFIX)}
+    elapsed = time.perf_counter() - t0
+
+    for name, plug_stats in stats.items():
+        series = read_power_log(plug_stats['path'])
+        mean = f"{float(np.mean(series.power)):.1f} W" if len(series) else "-"
+        polled = '' if plug_stats['samples'] is None else f", {plug_stats['samples']} polled, {plug_stats['errors']} failed"
+        print(f"{name}: {len(series)} samples in {plug_stats['path']}{polled}, mean power {mean}")
+    print(f"Collected for {elapsed:.1f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
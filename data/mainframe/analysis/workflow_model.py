@@ -0,0 +1,460 @@
+### Argo workflow DAGs joined with measured step statistics: critical path and what-if energy of pipeline variants
+#
+# Usage (from data/mainframe/analysis):
+#   python workflow_model.py                                        # DAGs, fitted step models, check against the runs
+#   python workflow_model.py --base conf-3 --set alignment-bwa.tool=minimap2 --set trimming.cpus=6
+#   python workflow_model.py --base conf-4 --grid trimming=2,4,6 alignment=2,4,6,8 --top 10
+#
+# The data/workflows/conf-N.yaml Argo Workflows are parsed into a task table (dependencies, CPU request and main tool
+# of every task). Every (task, tool) pair gets a duration model T(cpus) = serial + parallel / cpus (Amdahl's law) and
+# an energy model E = fixed + power * T, fitted to the runN.dat steps of all confs that ran it (with different CPU
+# requests where available). A variant of a workflow (other CPU requests, another tool for a task) is then evaluated
+# without running it: step durations and energies, the critical path through the DAG and the total energy. Variants
+# are evaluated as arrays (one row per variant), so thousands of candidates are ranked in milliseconds.
+# The measured step energies hardly depend on CPUs, so the ranking charges the machine's idle power over the run
+# as well: by default the mean baseline power of the base conf's Tapo exports.
+import argparse
+import itertools
+import os
+import re
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from analysis_functions import compute_baseline_stats, get_power_data
+from batch_analysis import DEFAULT_DATA_DIR, discover_runs, read_simpipe_data
+from instrumentation import recording
+
+DEFAULT_WORKFLOW_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "workflows")
+# main program of a task: the first of these (in this order) that its script calls, so that an alignment step
+# that indexes with bwa but aligns with minimap2 counts as minimap2, and samtools only counts if nothing else runs
+KNOWN_TOOLS = ('minimap2', 'bwa', 'fastp', 'gatk', 'picard', 'samtools')
+# share of a step's time that scales with CPUs, for steps only measured at one CPU request
+# (trimming and alignment give about 0.7-0.8 between conf-4 and conf-5)
+DEFAULT_PARALLEL_FRACTION = 0.75
+# pause between consecutive steps in the runN.dat files
+DEFAULT_GAP_SECONDS = 10
+MODEL_COLUMNS = ['runs', 'cpus', 'serial(s)', 'parallel(cpu*s)', 'fixed_energy(kWh)', 'power(W)', 'fitted']
+_TOOL_PATTERN = re.compile(r'(?<![\w./-])(' + '|'.join(KNOWN_TOOLS) + r')(?![\w-])')
+_DEPENDS_STATUS = re.compile(r'\.(Succeeded|Failed|Errored|Skipped|Omitted|Daemoned|AnySucceeded|AllFailed)\b')
+
+
+def parse_cpu(quantity) -> float:
+    """
+    Kubernetes CPU quantity ("6", 6, "500m") in CPUs.
+    """
+    quantity = str(quantity).strip()
+    if quantity.endswith('m'):
+        return float(quantity[:-1]) / 1000
+    return float(quantity)
+
+
+def _script_tool(container: dict):
+    # main known tool called in the command/args of a container or script template (comment lines ignored)
+    parts = container.get('command', []) + container.get('args', []) + [container.get('source', '')]
+    text = '\n'.join(line for part in parts for line in str(part).splitlines() if not line.strip().startswith('#'))
+    called = set(_TOOL_PATTERN.findall(text))
+    return next((tool for tool in KNOWN_TOOLS if tool in called), None)
+
+
+def _parse_depends(task: dict) -> tuple:
+    # task names in an Argo "depends" expression ("a.Succeeded && (b || c)") plus the "dependencies" list;
+    # alternatives (||) are treated like &&, i.e. a task waits for all of them
+    names = list(task.get('dependencies', []))
+    expression = _DEPENDS_STATUS.sub('', task.get('depends', '') or '')
+    names += [name for name in re.split(r'[\s()!&|]+', expression) if name]
+    return tuple(dict.fromkeys(names))
+
+
+def read_workflow(path: str) -> pd.DataFrame:
+    """
+    Parse an Argo Workflow YAML into its DAG.
+
+    Parameters:
+    path (str): Workflow YAML (e.g. data/workflows/conf-1.yaml)
+
+    Returns:
+    pd.DataFrame indexed by task with template, depends (tuple of task names), cpus (CPU request), memory (request)
+    image and tool (main program, see KNOWN_TOOLS); attrs['name'] is the entrypoint
+    """
+    with open(path) as f:
+        workflow = yaml.safe_load(f)
+    spec = workflow['spec']
+    templates = {template['name']: template for template in spec['templates']}
+    entrypoint = templates[spec['entrypoint']]
+    if 'dag' not in entrypoint:
+        raise ValueError(f"Entrypoint '{spec['entrypoint']}' of {path} is not a DAG template")
+    rows = []
+    for task in entrypoint['dag']['tasks']:
+        template = templates[task['template']]
+        container = template.get('container') or template.get('script') or {}
+        requests = container.get('resources', {}).get('requests', {})
+        rows.append({
+            'task': task['name'],
+            'template': task['template'],
+            'depends': _parse_depends(task),
+            'cpus': parse_cpu(requests.get('cpu', 1)),
+            'memory': requests.get('memory'),
+            'image': container.get('image'),
+            'tool': _script_tool(container),
+        })
+    tasks = pd.DataFrame(rows).set_index('task')
+    unknown = {d for depends in tasks['depends'] for d in depends} - set(tasks.index)
+    if unknown:
+        raise ValueError(f"{path}: tasks depend on unknown tasks {sorted(unknown)}")
+    tasks.attrs['name'] = spec['entrypoint']
+    topological_order(tasks)
+    return tasks
+
+
+def read_workflows(workflow_dir: str = DEFAULT_WORKFLOW_DIR) -> dict:
+    """
+    {conf: task table} of every conf-N.yaml in workflow_dir.
+    """
+    names = [n for n in os.listdir(workflow_dir) if re.fullmatch(r'conf-\d+\.yaml', n)]
+    return {name[:-5]: read_workflow(os.path.join(workflow_dir, name))
+            for name in sorted(names, key=lambda n: int(re.findall(r'\d+', n)[0]))}
+
+
+def topological_order(tasks: pd.DataFrame) -> list:
+    """
+    Task names ordered so that every task comes after its dependencies; raises ValueError on a cycle.
+    """
+    remaining = {task: set(depends) for task, depends in tasks['depends'].items()}
+    order = []
+    while remaining:
+        ready = [task for task, depends in remaining.items() if not depends]
+        if not ready:
+            raise ValueError(f"Dependency cycle between tasks {sorted(remaining)}")
+        for task in ready:
+            del remaining[task]
+        for depends in remaining.values():
+            depends.difference_update(ready)
+        order += ready
+    return order
+
+
+def step_measurements(data_dir: str = DEFAULT_DATA_DIR, workflows: dict = None) -> pd.DataFrame:
+    """
+    Measured steps of every run joined with the DAG of its conf.
+
+    Returns:
+    pd.DataFrame with conf, runNr, task, tool, cpus, duration (s), energy (kWh) and start/stop of every step
+    that is a task of the conf's workflow
+    """
+    workflows = read_workflows() if workflows is None else workflows
+    frames = []
+    for run in discover_runs(data_dir):
+        if run['conf'] not in workflows:
+            continue
+        tasks = workflows[run['conf']]
+        steps = read_simpipe_data(run['simpipe'])
+        steps = steps[steps['step'].isin(tasks.index)]
+        frames.append(pd.DataFrame({
+            'conf': run['conf'],
+            'runNr': run['runNr'],
+            'task': steps['step'].to_numpy(),
+            'tool': tasks.loc[steps['step'], 'tool'].to_numpy(),
+            'cpus': tasks.loc[steps['step'], 'cpus'].to_numpy(),
+            'duration': steps['duration'].to_numpy(dtype=np.float64),
+            'energy': steps['energy'].to_numpy(dtype=np.float64),
+            'start': pd.to_datetime(steps['start']).to_numpy(),
+            'stop': pd.to_datetime(steps['stop']).to_numpy(),
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def baseline_power(data_dir: str, conf: str, percentile_threshold: float = 70) -> float:
+    """
+    Mean baseline power (W) of a conf: compute_baseline_stats' mean_power of every Tapo export of its runs, averaged.
+    """
+    powers = []
+    with recording(echo=False):
+        for run in discover_runs(data_dir):
+            if run['conf'] == conf:
+                stats = compute_baseline_stats(get_power_data(run['tapo']), percentile_threshold, print_stats=False)
+                powers.append(stats['mean_power'])
+    if not powers:
+        raise ValueError(f"No Tapo exports of {conf} in {data_dir}")
+    return float(np.mean(powers))
+
+
+def _fit_line(x: np.ndarray, y: np.ndarray) -> (float, float):
+    # least-squares y = a + b * x with a, b >= 0
+    if np.ptp(x) > 0:
+        b, a = np.polyfit(x, y, 1)
+        if b >= 0 and a >= 0:
+            return a, b
+        if b < 0:
+            return float(np.mean(y)), 0.0
+        return 0.0, float(np.dot(x, y) / np.dot(x, x))
+    return float(np.mean(y)), 0.0
+
+
+def fit_step_models(measurements: pd.DataFrame, parallel_fraction: float = DEFAULT_PARALLEL_FRACTION) -> pd.DataFrame:
+    """
+    Duration and energy model of every (task, tool) from the measured steps.
+
+    With runs at two or more CPU requests, duration = serial + parallel / cpus and energy = fixed + power * duration
+    are least-squares fits over all runs (coefficients kept non-negative). Otherwise parallel_fraction of the mean
+    duration at the measured CPU request is taken to scale with CPUs and the energy is taken as the same for any
+    CPU request (fitted is False).
+
+    Parameters:
+    measurements (pd.DataFrame): Result of step_measurements
+    parallel_fraction (float): Share of the duration that scales with CPUs, for steps measured at one CPU request
+
+    Returns:
+    pd.DataFrame indexed by (task, tool) with runs, cpus (measured CPU requests), serial(s), parallel(cpu*s),
+    fixed_energy(kWh), power(W) and fitted
+    """
+    rows = {}
+    for (task, tool), group in measurements.groupby(['task', 'tool'], sort=False):
+        cpus = group['cpus'].to_numpy(dtype=np.float64)
+        duration = group['duration'].to_numpy(dtype=np.float64)
+        energy = group['energy'].to_numpy(dtype=np.float64)
+        fitted = len(np.unique(cpus)) > 1
+        if fitted:
+            serial, parallel = _fit_line(1 / cpus, duration)
+            fixed_energy, energy_per_second = _fit_line(duration, energy)
+        else:
+            mean = float(duration.mean())
+            serial, parallel = (1 - parallel_fraction) * mean, parallel_fraction * mean * cpus[0]
+            fixed_energy, energy_per_second = float(energy.mean()), 0.0
+        rows[(task, tool)] = [len(group), tuple(sorted(set(cpus.tolist()))), serial, parallel, fixed_energy,
+                              energy_per_second * 3.6e6, fitted]
+    models = pd.DataFrame.from_dict(rows, orient='index', columns=MODEL_COLUMNS)
+    models.index = pd.MultiIndex.from_tuples(models.index, names=['task', 'tool'])
+    return models
+
+
+def _model_for(models: pd.DataFrame, task: str, tool: str) -> pd.Series:
+    # model of (task, tool); for a tool never run as this task (e.g. minimap2 for alignment-bwa),
+    # the model of the one task that ran it
+    if (task, tool) in models.index:
+        return models.loc[(task, tool)]
+    candidates = models[models.index.get_level_values('tool') == tool]
+    if len(candidates) == 1:
+        return candidates.iloc[0]
+    if len(candidates) == 0:
+        raise KeyError(f"No measurements of tool '{tool}' (task '{task}')")
+    raise KeyError(f"Tool '{tool}' was measured in several tasks {list(candidates.index.get_level_values('task'))}, "
+                   f"none of them '{task}'")
+
+
+def _settings(position: dict, tools: list, cpus: list, overrides: dict) -> (list, list):
+    # copies of the tools and CPU requests of the tasks (at position[task]) with {task: {'cpus': n, 'tool': name}} applied
+    tools, cpus = list(tools), list(cpus)
+    for task, changes in (overrides or {}).items():
+        if task not in position:
+            raise KeyError(f"Unknown task '{task}', expected one of {list(position)}")
+        t = position[task]
+        for key, value in changes.items():
+            if key == 'cpus':
+                cpus[t] = float(value)
+            elif key == 'tool':
+                tools[t] = value
+            else:
+                raise KeyError(f"Unknown task setting '{key}', expected 'cpus' or 'tool'")
+    return tools, cpus
+
+
+def evaluate_variants(
+        tasks: pd.DataFrame,
+        models: pd.DataFrame,
+        variants: dict,
+        gap_seconds: float = DEFAULT_GAP_SECONDS,
+        idle_power: float = 0.0) -> pd.DataFrame:
+    """
+    Predicted duration and energy of many variants of a workflow at once.
+
+    Parameters:
+    tasks (pd.DataFrame): Workflow from read_workflow
+    models (pd.DataFrame): Step models from fit_step_models
+    variants (dict): {name: {task: {'cpus': n, 'tool': name}}}; an empty dict is the workflow as it is
+    gap_seconds (float): Pause before a step starts after its dependencies (and between steps run one after another)
+    idle_power (float): Power (W) drawn for the whole run on top of the step energies, e.g. baseline_power;
+        charged over the serial duration, as the measured runs executed their steps one at a time. With the
+        default 0, variants that only change CPU requests get almost the same energy
+
+    Returns:
+    pd.DataFrame indexed by variant with critical_path(s) (DAG with unlimited parallelism), serial(s),
+    step_energy(kWh) and energy(kWh)
+    """
+    order = topological_order(tasks)
+    position = {task: i for i, task in enumerate(order)}
+    depends = [[position[d] for d in tasks.loc[task, 'depends']] for task in order]
+    names = list(variants)
+    # per variant and task: model coefficients and CPUs, as (variants, tasks) arrays
+    coefficients = np.empty((len(names), len(order), 5))
+    base_tools, base_cpus = tasks.loc[order, 'tool'].tolist(), tasks.loc[order, 'cpus'].tolist()
+    cache = {}
+    for v, name in enumerate(names):
+        tools, cpus = _settings(position, base_tools, base_cpus, variants[name])
+        for t, task in enumerate(order):
+            key = (task, tools[t])
+            if key not in cache:
+                cache[key] = _model_for(models, *key)[MODEL_COLUMNS[2:6]].to_numpy(dtype=np.float64)
+            coefficients[v, t, :4] = cache[key]
+        coefficients[v, :, 4] = cpus
+    serial, parallel, fixed_energy, power, cpus = np.moveaxis(coefficients, -1, 0)
+    duration = serial + parallel / cpus
+    energy = fixed_energy + power * duration / 3.6e6
+    finish = np.zeros_like(duration)
+    for t in range(len(order)):
+        start = finish[:, depends[t]].max(axis=1) + gap_seconds if depends[t] else 0.0
+        finish[:, t] = start + duration[:, t]
+    serial_seconds = duration.sum(axis=1) + gap_seconds * max(len(order) - 1, 0)
+    step_energy = energy.sum(axis=1)
+    return pd.DataFrame({
+        'critical_path(s)': finish.max(axis=1) if len(order) else 0.0,
+        'serial(s)': serial_seconds,
+        'step_energy(kWh)': step_energy,
+        'energy(kWh)': step_energy + idle_power * serial_seconds / 3.6e6,
+    }, index=pd.Index(names, name='variant'))
+
+
+def simulate_workflow(
+        tasks: pd.DataFrame,
+        models: pd.DataFrame,
+        overrides: dict = None,
+        gap_seconds: float = DEFAULT_GAP_SECONDS) -> pd.DataFrame:
+    """
+    Step-level schedule of one variant of a workflow with unlimited parallelism.
+
+    Parameters:
+    tasks (pd.DataFrame): Workflow from read_workflow
+    models (pd.DataFrame): Step models from fit_step_models
+    overrides (dict): {task: {'cpus': n, 'tool': name}}
+    gap_seconds (float): Pause before a step starts after its dependencies
+
+    Returns:
+    pd.DataFrame indexed by task (in topological order) with tool, cpus, duration(s), energy(kWh), start(s),
+    finish(s) and critical (on the critical path)
+    """
+    order = topological_order(tasks)
+    tools, cpus = _settings({task: t for t, task in enumerate(order)},
+                            tasks.loc[order, 'tool'].tolist(), tasks.loc[order, 'cpus'].tolist(), overrides)
+    rows = {}
+    for t, task in enumerate(order):
+        model = _model_for(models, task, tools[t])
+        duration = model['serial(s)'] + model['parallel(cpu*s)'] / cpus[t]
+        depends = tasks.loc[task, 'depends']
+        start = max(rows[d]['finish(s)'] for d in depends) + gap_seconds if depends else 0.0
+        rows[task] = {'tool': tools[t], 'cpus': cpus[t], 'duration(s)': duration,
+                      'energy(kWh)': model['fixed_energy(kWh)'] + model['power(W)'] * duration / 3.6e6,
+                      'start(s)': start, 'finish(s)': start + duration, 'critical': False}
+    # walk back from the last task to finish through the dependency that finished last
+    task = max(order, key=lambda t: rows[t]['finish(s)']) if order else None
+    while task is not None:
+        rows[task]['critical'] = True
+        depends = tasks.loc[task, 'depends']
+        task = max(depends, key=lambda d: rows[d]['finish(s)']) if depends else None
+    return pd.DataFrame.from_dict(rows, orient='index').rename_axis('task')
+
+
+def cpu_grid(grid: dict) -> dict:
+    """
+    Variants for every combination of CPU requests, e.g. {'trimming': [2, 4, 6], 'alignment': [4, 6]}.
+
+    Returns:
+    dict {name: overrides} for evaluate_variants, named like "trimming=2 alignment=4"
+    """
+    tasks = list(grid)
+    return {' '.join(f"{task}={cpus:g}" for task, cpus in zip(tasks, combination)):
+            {task: {'cpus': cpus} for task, cpus in zip(tasks, combination)}
+            for combination in itertools.product(*(grid[task] for task in tasks))}
+
+
+def check_against_runs(workflows: dict, models: pd.DataFrame, measurements: pd.DataFrame,
+                       gap_seconds: float = DEFAULT_GAP_SECONDS) -> pd.DataFrame:
+    """
+    Predicted serial duration and step energy of every conf's own workflow next to the mean of its runs.
+    """
+    runs = measurements.groupby(['conf', 'runNr']).agg(
+        start=('start', 'min'), stop=('stop', 'max'), energy=('energy', 'sum'))
+    runs['duration'] = (runs['stop'] - runs['start']).dt.total_seconds()
+    measured = runs.groupby('conf')[['duration', 'energy']].mean()
+    rows = []
+    for conf, tasks in workflows.items():
+        if conf not in measured.index:
+            continue
+        predicted = evaluate_variants(tasks, models, {conf: {}}, gap_seconds).iloc[0]
+        rows.append({'conf': conf,
+                     'measured(s)': measured.loc[conf, 'duration'], 'predicted(s)': predicted['serial(s)'],
+                     'critical_path(s)': predicted['critical_path(s)'],
+                     'measured(kWh)': measured.loc[conf, 'energy'], 'predicted(kWh)': predicted['step_energy(kWh)']})
+    return pd.DataFrame(rows).set_index('conf')
+
+
+def _parse_settings(settings: list) -> dict:
+    # ["alignment-bwa.tool=minimap2", "trimming.cpus=6"] -> {task: {key: value}}
+    overrides = {}
+    for setting in settings:
+        match = re.fullmatch(r'([\w-]+)\.(cpus|tool)=(\S+)', setting)
+        if not match:
+            raise argparse.ArgumentTypeError(f"Expected TASK.cpus=N or TASK.tool=NAME, got '{setting}'")
+        task, key, value = match.groups()
+        overrides.setdefault(task, {})[key] = value
+    return overrides
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Critical path and energy of Argo workflow variants from measured steps.")
+    parser.add_argument("--workflow-dir", default=DEFAULT_WORKFLOW_DIR, help="directory with the conf-N.yaml workflows")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="directory with the conf-* run directories")
+    parser.add_argument("--base", default=None, help="conf whose workflow the variants change (e.g. conf-4)")
+    parser.add_argument("--set", dest="settings", nargs="*", action="extend", default=[], metavar="TASK.KEY=VALUE",
+                        help="change a task of the base workflow: TASK.cpus=N or TASK.tool=NAME")
+    parser.add_argument("--grid", nargs="*", default=[], metavar="TASK=N,N,...",
+                        help="rank every combination of these CPU requests (on top of --set)")
+    parser.add_argument("--idle-power", type=float, default=None,
+                        help="power (W) drawn during the whole run (default: mean baseline power of the --base conf)")
+    parser.add_argument("--parallel-fraction", type=float, default=DEFAULT_PARALLEL_FRACTION,
+                        help="CPU-scaling share of steps measured at one CPU request only")
+    parser.add_argument("--top", type=int, default=20, help="variants to print")
+    args = parser.parse_args(argv)
+
+    workflows = read_workflows(args.workflow_dir)
+    measurements = step_measurements(args.data_dir, workflows)
+    models = fit_step_models(measurements, args.parallel_fraction)
+
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        if args.base is None:
+            for conf, tasks in workflows.items():
+                print(f"{conf} ({tasks.attrs['name']})")
+                print(tasks[['depends', 'cpus', 'tool']].to_string())
+                print()
+            print(models.to_string())
+            print()
+            print(check_against_runs(workflows, models, measurements).to_string())
+            return 0
+
+        base = workflows[args.base]
+        overrides = _parse_settings(args.settings)
+        print(simulate_workflow(base, models, overrides).to_string())
+        if args.grid:
+            grid = {task: [float(c) for c in cpus.split(',')]
+                    for task, cpus in (item.split('=', 1) for item in args.grid)}
+            variants = {name: {**overrides, **{task: {**overrides.get(task, {}), **changes}
+                                               for task, changes in variant.items()}}
+                        for name, variant in cpu_grid(grid).items()}
+        else:
+            variants = {}
+        variants = {'base': {}, **({'variant': overrides} if overrides else {}), **variants}
+        idle_power = baseline_power(args.data_dir, args.base) if args.idle_power is None else args.idle_power
+        t0 = time.perf_counter()
+        ranked = evaluate_variants(base, models, variants, idle_power=idle_power).sort_values('energy(kWh)')
+        elapsed = time.perf_counter() - t0
+        print()
+        print(ranked.head(args.top).to_string())
+        print(f"\nEvaluated {len(variants)} variants of {args.base} in {elapsed * 1000:.1f} ms"
+              f" (idle power {idle_power:.1f} W)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,254 @@
+### Benchmark suite: scaling of the analysis functions on synthetic traces
+#
+# Usage (from data/mainframe/benchmarks):
+#   python run_benchmarks.py                                   # 10^3 .. 10^6 samples, writes results/<commit>.json
+#   python run_benchmarks.py --sizes 1e3 1e5 1e7 --interval 10 --repeat 5
+#   python run_benchmarks.py --compare results/<old>.json      # run and compare against an earlier result
+#   python run_benchmarks.py --compare results/<old>.json --against results/<new>.json   # compare stored results only
+#
+# Sizes of 10^7 and 10^8 samples need roughly 2 GB and 20 GB of memory.
+# The cold get_power_data[xls] path is timed on the largest raw export in
+# data/carbontracker and, when the optional xlwt is installed, on synthetic .xls
+# files of every size up to 65535 samples; skipped cases are printed.
+# Result files are machine-specific and not committed (see .gitignore).
+import argparse
+import datetime
+import gc
+import glob
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, "..", "analysis"))
+
+import numpy as np
+import pandas as pd
+
+from analysis_functions import (
+    get_power_data,
+    compute_baseline_stats,
+    detect_power_surges,
+    divide_power_data_into_step_periods,
+    compute_relative_energy_usage,
+)
+from instrumentation import recording
+from power_cache import write_power_cache
+from synthetic import synthetic_trace, time_periods, write_tapo_xls
+
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, "results")
+DEFAULT_SIZES = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6]
+REGRESSION_RATIO = 1.2
+REAL_EXPORTS = os.path.join(BENCHMARK_DIR, "..", "data", "carbontracker", "conf-*", "power-run*.xls")
+
+
+def _prepare(n_samples: int, interval_seconds: float, workdir: str) -> dict:
+    """
+    Synthetic inputs for every benchmarked function at one size.
+    """
+    power_data, steps = synthetic_trace(n_samples, interval_seconds=interval_seconds)
+    periods = time_periods(steps)
+    with recording(echo=False):
+        baseline_stats = compute_baseline_stats(power_data, 70, print_stats=False)
+        segments = divide_power_data_into_step_periods(periods, power_data)
+
+    # get_power_data: a cache hit needs a source file to key on; the cold path needs a real .xls export
+    source = os.path.join(workdir, f"power-{n_samples}.xls")
+    xls, xls_skipped = None, None
+    try:
+        write_tapo_xls(power_data, source)
+        xls = source
+    except ImportError:
+        xls_skipped = "xlwt not installed"
+    except ValueError as e:
+        xls_skipped = str(e)
+    if xls is None:
+        with open(source, "wb") as f:
+            f.write(b"synthetic")
+    write_power_cache(source, power_data)
+    return {
+        "power_data": power_data,
+        "periods": periods,
+        "baseline_stats": baseline_stats,
+        "segments": segments,
+        "source": source,
+        "xls": xls,
+        "xls_skipped": xls_skipped,
+    }
+
+
+def real_export() -> str:
+    """
+    The largest raw (unfiltered) Tapo export under data/carbontracker, or None if there is none.
+    """
+    paths = [p for p in glob.glob(REAL_EXPORTS) if not p.endswith("-filtered.xls")]
+    return max(paths, key=os.path.getsize) if paths else None
+
+
+def benchmark_cases(inputs: dict) -> dict:
+    """
+    {name: zero-argument callable} of the functions to time for one prepared input.
+    """
+    cases = {
+        "get_power_data[cache]": lambda: get_power_data(inputs["source"]),
+        "compute_baseline_stats": lambda: compute_baseline_stats(inputs["power_data"], 70, print_stats=False),
+        "detect_power_surges": lambda: detect_power_surges(inputs["power_data"], inputs["baseline_stats"]),
+        "divide_power_data_into_step_periods": lambda: divide_power_data_into_step_periods(inputs["periods"], inputs["power_data"]),
+        "compute_relative_energy_usage": lambda: compute_relative_energy_usage(
+            inputs["segments"], inputs["periods"], inputs["baseline_stats"]),
+    }
+    if inputs["xls"] is not None:
+        cases["get_power_data[xls]"] = lambda: get_power_data(inputs["xls"], use_cache=False)
+    return cases
+
+
+def measure(func, repeat: int) -> dict:
+    """
+    Best and median wall time over repeat calls, then the peak traced memory of one more call.
+    """
+    times = []
+    with recording(echo=False):
+        for _ in range(repeat):
+            gc.collect()
+            t0 = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - t0)
+        gc.collect()
+        tracemalloc.start()
+        try:
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return {"seconds_best": min(times), "seconds_median": statistics.median(times), "peak_mb": peak / 1e6}
+
+
+def run_benchmarks(sizes: list, interval_seconds: float = 10, repeat: int = 3, functions: list = None) -> list:
+    """
+    Time every function at every size.
+
+    Returns:
+    list of dicts with function, size, seconds_best, seconds_median, peak_mb and steps (pipeline steps in the trace;
+    0 for the real export, whose file is given in input)
+    """
+    def selected(name):
+        return not functions or name.split("[")[0] in functions or name in functions
+
+    def record(name, size, steps, func, **extra):
+        result = {"function": name, "size": size, "steps": steps, **extra, **measure(func, repeat)}
+        results.append(result)
+        print(f"{name:<38} n={size:<10} best {result['seconds_best'] * 1000:10.2f} ms"
+              f"  median {result['seconds_median'] * 1000:10.2f} ms  peak {result['peak_mb']:9.1f} MB"
+              + (f"  ({extra['input']})" if "input" in extra else ""))
+
+    results = []
+    if selected("get_power_data[xls]"):
+        export = real_export()
+        if export is None:
+            print(f"{'get_power_data[xls]':<38} skipped: no export matches {os.path.relpath(REAL_EXPORTS, BENCHMARK_DIR)}")
+        else:
+            with recording(echo=False):
+                n_rows = len(get_power_data(export, use_cache=False))
+            record("get_power_data[xls]", n_rows, 0, lambda: get_power_data(export, use_cache=False),
+                   input=os.path.relpath(export, BENCHMARK_DIR))
+    workdir = tempfile.mkdtemp(prefix="analysis-bench-")
+    try:
+        for size in sizes:
+            inputs = _prepare(size, interval_seconds, workdir)
+            for name, func in benchmark_cases(inputs).items():
+                if selected(name):
+                    record(name, size, len(inputs["periods"]), func)
+            if inputs["xls"] is None and selected("get_power_data[xls]"):
+                print(f"{'get_power_data[xls]':<38} n={size:<10} skipped: {inputs['xls_skipped']}")
+            del inputs
+            gc.collect()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def git_revision() -> str:
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARK_DIR,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        # only changes to the benchmarked code make the measured revision "dirty"
+        dirty = subprocess.run(["git", "status", "--porcelain", "--", os.path.join("..", "analysis")], cwd=BENCHMARK_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+        return f"{revision}-dirty" if dirty else revision
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def save_results(results: list, path: str, interval_seconds: float, repeat: int) -> str:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({
+            "revision": git_revision(),
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "machine": f"{platform.machine()} {os.cpu_count()} cpus",
+            "interval_seconds": interval_seconds,
+            "repeat": repeat,
+            "results": results,
+        }, f, indent=1)
+    return path
+
+
+def compare_results(base: dict, new: dict, threshold: float = REGRESSION_RATIO) -> pd.DataFrame:
+    """
+    Per function and size: best time of base and new and their ratio; ratios above threshold are flagged.
+    """
+    columns = ["function", "size", "seconds_best", "peak_mb"]
+    merged = pd.merge(pd.DataFrame(base["results"])[columns], pd.DataFrame(new["results"])[columns],
+                      on=["function", "size"], suffixes=("_base", "_new"))
+    merged["ratio"] = merged["seconds_best_new"] / merged["seconds_best_base"]
+    merged["flag"] = np.where(merged["ratio"] > threshold, "SLOWER", np.where(merged["ratio"] < 1 / threshold, "faster", ""))
+    return merged
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the analysis functions on synthetic traces.")
+    parser.add_argument("--sizes", type=float, nargs="+", default=DEFAULT_SIZES, help="numbers of samples")
+    parser.add_argument("--interval", type=float, default=10, help="sampling interval in seconds (Tapo exports: 300)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed calls per function and size")
+    parser.add_argument("--functions", nargs="*", default=None, help="only these functions")
+    parser.add_argument("--output", default=None, help="result file (default: results/<revision>.json)")
+    parser.add_argument("--compare", default=None, metavar="BASE_JSON", help="compare against an earlier result file")
+    parser.add_argument("--against", default=None, metavar="NEW_JSON", help="with --compare: compare two stored files without running")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_RATIO, help="slowdown ratio flagged as regression")
+    args = parser.parse_args(argv)
+
+    if args.compare and args.against:
+        with open(args.compare) as f:
+            base = json.load(f)
+        with open(args.against) as f:
+            new = json.load(f)
+    else:
+        results = run_benchmarks([int(s) for s in args.sizes], args.interval, args.repeat, args.functions)
+        output = args.output or os.path.join(RESULTS_DIR, f"{git_revision()}.json")
+        save_results(results, output, args.interval, args.repeat)
+        print(f"\nResults saved to {output}")
+        if not args.compare:
+            return 0
+        with open(args.compare) as f:
+            base = json.load(f)
+        with open(output) as f:
+            new = json.load(f)
+
+    comparison = compare_results(base, new, args.threshold)
+    print(f"\n{base['revision']} -> {new['revision']}")
+    print(comparison.to_string(index=False))
+    return 1 if (comparison["flag"] == "SLOWER").any() else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
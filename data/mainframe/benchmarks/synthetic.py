@@ -0,0 +1,150 @@
+### Synthetic Tapo power traces with CarbonTracker/SIMPIPE step schedules, for benchmarking the analysis functions
+import os
+
+import numpy as np
+import pandas as pd
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "carbontracker")
+DEFAULT_SCHEDULE_RUN = os.path.join(DATA_DIR, "conf-1", "run1.dat")
+DT_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def read_step_schedule(path: str = DEFAULT_SCHEDULE_RUN) -> pd.DataFrame:
+    """
+    Step names, durations, gaps and CarbonTracker power of a real runN.dat, used as the template pipeline run.
+
+    Returns:
+    pd.DataFrame with step, offset (s from the run start), duration (s) and ct_power(W)
+    """
+    run = pd.read_csv(path, sep=r'\s+', comment='#', header=0)
+    start = pd.to_datetime(run['start']).dt.tz_localize(None)
+    stop = pd.to_datetime(run['stop']).dt.tz_localize(None)
+    duration = (stop - start).dt.total_seconds().to_numpy()
+    return pd.DataFrame({
+        'step': run['step'].to_numpy(),
+        'offset': (start - start.iloc[0]).dt.total_seconds().to_numpy(),
+        'duration': duration,
+        'ct_power(W)': np.where(duration > 0, run['energy'].to_numpy(dtype=np.float64) * 3.6e6 / np.maximum(duration, 1), 0.0),
+    })
+
+
+def synthetic_trace(
+        n_samples: int,
+        interval_seconds: float = 300,
+        schedule: pd.DataFrame = None,
+        baseline_power: float = 203.0,
+        power_gain: float = 1.0,
+        noise_power: float = 2.0,
+        idle_seconds: float = None,
+        start: str = '2025-09-01 00:00:00',
+        seed: int = 0) -> (pd.DataFrame, pd.DataFrame):
+    """
+    A Tapo-like power trace of n_samples samples with repeated pipeline runs, plus the matching step table.
+
+    Power is baseline_power plus Gaussian noise, and during a step baseline_power + power_gain * ct_power(W) of the
+    template step (the shape of the six NHRF steps in the template runN.dat). Runs are separated by idle_seconds
+    (default: one run duration), the first one starts after half of that, and runs are repeated until the trace
+    is full; the last step is cut off at the end of the trace.
+
+    Parameters:
+    n_samples (int): Number of power samples (as returned by get_power_data, i.e. after dropping the first)
+    interval_seconds (float): Sampling interval (Tapo exports: 300 s)
+    schedule (pd.DataFrame): Template run from read_step_schedule (default: conf-1/run1.dat)
+    baseline_power, power_gain, noise_power (float): Shape of the trace in W
+    idle_seconds (float): Idle time between runs
+    start (str): Timestamp of the first sample
+    seed (int): Random seed
+
+    Returns:
+    tuple (power_data, steps): power_data has the Date, Power(W) and Energy(kWh) columns of get_power_data;
+    steps has the runN.dat columns step, start, stop, duration, co2, energy plus run
+    """
+    schedule = read_step_schedule() if schedule is None else schedule
+    rng = np.random.default_rng(seed)
+    run_seconds = float((schedule['offset'] + schedule['duration']).max())
+    period = run_seconds + (run_seconds if idle_seconds is None else idle_seconds)
+    interval_ns = int(interval_seconds * 1e9)
+    start_ns = pd.Timestamp(start).value
+
+    # one extra leading sample whose energy is undefined, as in get_power_data
+    t = start_ns + interval_ns * np.arange(n_samples + 1, dtype=np.int64)
+    span = (t[-1] - start_ns) / 1e9
+    n_runs = int(np.ceil(span / period)) + 1
+
+    # all step boundaries of all runs, in ns
+    run_offsets = np.arange(n_runs)[:, None] * period + (period - run_seconds) / 2
+    step_start = ((run_offsets + schedule['offset'].to_numpy()[None, :]).ravel() * 1e9).astype(np.int64) + start_ns
+    step_stop = np.minimum(step_start + (np.tile(schedule['duration'].to_numpy(), n_runs) * 1e9).astype(np.int64), t[-1])
+    step_power = np.tile(schedule['ct_power(W)'].to_numpy(), n_runs)
+
+    # piecewise-constant step power sampled at every t (steps do not overlap)
+    i = np.searchsorted(step_start, t, side='right') - 1
+    inside = (i >= 0) & (t < step_stop[np.maximum(i, 0)])
+    power = baseline_power + noise_power * rng.standard_normal(len(t))
+    power[inside] += power_gain * step_power[i[inside]]
+    power = np.maximum(power, 0.0)
+
+    power_data = pd.DataFrame({
+        'Date': t[1:].view('datetime64[ns]'),
+        'Power(W)': power[1:],
+        'Energy(kWh)': power[1:] / 1000 * (interval_seconds / 3600),
+    }, index=pd.RangeIndex(1, n_samples + 1))
+
+    # keep the steps that start inside the trace
+    keep = step_start < t[-1]
+    durations = (step_stop - step_start) / 1e9
+    steps = pd.DataFrame({
+        'run': np.repeat(np.arange(n_runs), len(schedule))[keep],
+        'step': np.tile(schedule['step'].to_numpy(), n_runs)[keep],
+        'start': pd.to_datetime(step_start[keep]),
+        'stop': pd.to_datetime(step_stop[keep]),
+        'duration': durations[keep],
+        'co2': 0.0,
+        'energy': (step_power * durations / 3.6e6)[keep],
+    })
+    return power_data, steps
+
+
+def time_periods(steps: pd.DataFrame) -> list:
+    """
+    (step_name, start, stop) tuples as returned by get_time_periods, built without the per-row loop.
+    """
+    return list(zip(steps['step'], steps['start'].dt.strftime(DT_FORMAT), steps['stop'].dt.strftime(DT_FORMAT)))
+
+
+def write_run_dat(steps: pd.DataFrame, path: str, title: str = "synthetic run") -> str:
+    """
+    Write (one run of) a step table in the runN.dat format.
+    """
+    with open(path, "w") as f:
+        f.write(f"# {title}\n")
+        f.write("step\tstart\tstop\tduration\tco2\tenergy\tstatus\toutput\n")
+        for row in steps.itertuples():
+            f.write(f"{row.step}\t{row.start.strftime('%Y-%m-%dT%H:%M:%SZ')}\t{row.stop.strftime('%Y-%m-%dT%H:%M:%SZ')}\t"
+                    f"{int(row.duration)}\t{row.co2}\t{row.energy:.6f}\tSucceeded\t{row.step}-results*\n")
+    return path
+
+
+def write_tapo_xls(power_data: pd.DataFrame, path: str) -> str:
+    """
+    Write a trace as a Tapo-like .xls export (first column: timestamp, then Power(W) as integers).
+    Needs the optional xlwt package; .xls files hold at most 65535 samples.
+    """
+    import xlwt
+
+    if len(power_data) + 1 > 65535:
+        raise ValueError(f".xls exports hold at most 65535 samples, got {len(power_data) + 1}")
+    book = xlwt.Workbook()
+    sheet = book.add_sheet("Power")
+    sheet.write(0, 0, "Time")
+    sheet.write(0, 1, "Power(W)")
+    dates = power_data['Date'].dt.strftime(DT_FORMAT).to_numpy()
+    # the leading sample get_power_data drops
+    first = (power_data['Date'].iloc[0] - (power_data['Date'].iloc[1] - power_data['Date'].iloc[0])).strftime(DT_FORMAT)
+    sheet.write(1, 0, first)
+    sheet.write(1, 1, int(round(power_data['Power(W)'].iloc[0])))
+    for r, (date, power) in enumerate(zip(dates, np.rint(power_data['Power(W)'].to_numpy()).astype(int)), start=2):
+        sheet.write(r, 0, date)
+        sheet.write(r, 1, int(power))
+    book.save(path)
+    return path